@@ -1,6 +1,6 @@
+import asyncio
 from datetime import datetime
-from io import BytesIO
-from pathlib import PurePath
+from pathlib import Path, PurePath
 from typing import Annotated
 from uuid import UUID
 
@@ -8,16 +8,17 @@ from PIL import Image, UnidentifiedImageError
 from fastapi import APIRouter, Depends, HTTPException, params, UploadFile, File
 from loguru import logger
 
-from app.Models.api_models.admin_api_model import ImageOptUpdateModel
-from app.Models.api_models.admin_query_params import UploadImageModel
-from app.Models.api_response.admin_api_response import ServerInfoResponse, ImageUploadResponse
+from app.Models.api_models.admin_api_model import ImageOptUpdateModel, UploadStatusQueryModel
+from app.Models.api_models.admin_query_params import UploadImageModel, BulkUploadImageModel
+from app.Models.api_response.admin_api_response import ServerInfoResponse, ImageUploadResponse, CacheStatistics, \
+    UploadStatusResponse, UploadBatchStatusResponse, BulkImageUploadResponse
 from app.Models.api_response.base import NekoProtocol
 from app.Models.img_data import ImageData
 from app.Services.authentication import force_admin_token_verify
 from app.Services.provider import ServiceProvider
+from app.Services.upload_service import UploadQueueFullError, TooManyUploadFilesError
 from app.Services.vector_db_context import PointNotFoundError
 from app.config import config
-from app.util.generate_uuid import generate_uuid
 
 admin_router = APIRouter(dependencies=[Depends(force_admin_token_verify)], tags=["Admin"])
 
@@ -82,6 +83,35 @@ IMAGE_MIMES = {
     "image/webp": "webp",
     "image/gif": "gif",
 }
+IMAGE_EXTENSIONS = {'jpg', 'png', 'jpeg', 'jfif', 'webp', 'gif'}
+ARCHIVE_MIMES = {'application/zip', 'application/x-zip-compressed', 'application/x-tar', 'application/gzip',
+                 'application/x-gzip', 'application/x-bzip2', 'application/x-xz'}
+ARCHIVE_EXTENSIONS = {'.zip', '.tar', '.gz', '.tgz', '.bz2', '.xz'}
+
+
+def _get_image_format(image_file: UploadFile) -> str | None:
+    if image_file.content_type and image_file.content_type.lower() in IMAGE_MIMES:
+        return IMAGE_MIMES[image_file.content_type.lower()]
+    if image_file.filename:
+        extension = PurePath(image_file.filename).suffix.lower()[1:]
+        if extension in IMAGE_EXTENSIONS:
+            return extension
+    return None
+
+
+def _is_archive(file: UploadFile) -> bool:
+    if file.content_type and file.content_type.lower() in ARCHIVE_MIMES:
+        return True
+    return bool(file.filename) and PurePath(file.filename).suffix.lower() in ARCHIVE_EXTENSIONS
+
+
+def _is_valid_image(image_path: Path) -> bool:
+    try:
+        with Image.open(image_path) as image:
+            image.verify()
+        return True
+    except (UnidentifiedImageError, OSError):
+        return False
 
 
 @admin_router.post("/upload",
@@ -90,24 +120,18 @@ IMAGE_MIMES = {
 async def upload_image(image_file: Annotated[UploadFile, File(description="The image to be uploaded.")],
                        model: Annotated[UploadImageModel, Depends()]):
     # generate an ID for the image
-    img_type = None
-    if image_file.content_type.lower() in IMAGE_MIMES:
-        img_type = IMAGE_MIMES[image_file.content_type.lower()]
-    elif image_file.filename:
-        extension = PurePath(image_file.filename).suffix.lower()
-        if extension in {'.jpg', '.png', '.jpeg', '.jfif', '.webp', '.gif'}:
-            img_type = extension[1:]
+    img_type = _get_image_format(image_file)
     if not img_type:
         raise HTTPException(415, "Unsupported image format.")
-    img_bytes = await image_file.read()
-    img_id = generate_uuid(img_bytes)
+    # The upload is hashed while it is written to the spool directory, so it's never fully loaded into memory
+    img_id, spooled_file = await services.upload_service.spool_file(image_file.file, img_type)
     if len(await services.db_context.validate_ids([str(img_id)])) != 0:  # check for duplicate points
+        services.upload_service.discard_spooled_file(spooled_file)
         raise HTTPException(409, f"The uploaded point is already contained in the database! entity id: {img_id}")
 
-    try:
-        image = Image.open(BytesIO(img_bytes))
-    except UnidentifiedImageError as ex:
-        raise HTTPException(400, "Cannot open the image file.") from ex
+    if not await asyncio.to_thread(_is_valid_image, spooled_file):
+        services.upload_service.discard_spooled_file(spooled_file)
+        raise HTTPException(400, "Cannot open the image file.")
 
     image_data = ImageData(id=img_id,
                            url=model.url,
@@ -118,11 +142,129 @@ async def upload_image(image_file: Annotated[UploadFile, File(description="The i
                            format=img_type,
                            index_date=datetime.now())
 
-    await services.upload_service.upload_image(image, image_data, img_bytes, model.skip_ocr)
+    try:
+        await services.upload_service.upload_image(image_data, model.skip_ocr)
+    except UploadQueueFullError as ex:
+        raise HTTPException(503, "The upload queue is full, please retry later.",
+                            headers={"Retry-After": str(config.upload.retry_after)}) from ex
     return ImageUploadResponse(message="OK. Image added to upload queue.", image_id=img_id)
 
 
+@admin_router.post("/upload/bulk",
+                   description="Upload several images to local storage at once, as multiple files and/or zip or tar "
+                               "archives of images. The images are checked for duplicates together, and are indexed "
+                               "and written to the database in batches.")
+async def bulk_upload_images(
+        image_files: Annotated[list[UploadFile], File(description="The images or archives to be uploaded.")],
+        model: Annotated[BulkUploadImageModel, Depends()]) -> BulkImageUploadResponse:
+    if not config.storage.method.enabled:
+        raise HTTPException(400, "Bulk upload requires the storage to be enabled.")
+    max_files = config.upload.bulk_max_files
+    spooled: dict[UUID, tuple[Path, str]] = {}  # id -> (spooled file, original file name)
+    duplicates: set[UUID] = set()
+    invalid_files: list[str] = []
+
+    def discard_all():
+        for spooled_file, _ in spooled.values():
+            services.upload_service.discard_spooled_file(spooled_file)
+
+    def add_spooled(file_name: str, img_id: UUID, spooled_file: Path):
+        if img_id in spooled:  # The same image appears more than once in the request
+            duplicates.add(img_id)
+            if spooled_file != spooled[img_id][0]:  # Spooled again under another extension
+                services.upload_service.discard_spooled_file(spooled_file)
+        else:
+            spooled[img_id] = (spooled_file, file_name)
+
+    too_many_files_message = f"Too many images. At most {max_files} images can be uploaded at once."
+    for i, image_file in enumerate(image_files):
+        file_name = image_file.filename or f"<file {i}>"
+        if _is_archive(image_file):
+            try:
+                files, skipped = await services.upload_service.spool_archive(image_file.file, IMAGE_EXTENSIONS,
+                                                                             max_files - len(spooled))
+            except TooManyUploadFilesError as ex:
+                discard_all()
+                raise HTTPException(413, too_many_files_message) from ex
+            except ValueError as ex:
+                discard_all()
+                raise HTTPException(400, f"Cannot read the archive {file_name}: {ex}") from ex
+            invalid_files += skipped
+            for spooled_file in files:
+                add_spooled(*spooled_file)
+        elif img_type := _get_image_format(image_file):
+            if len(spooled) >= max_files:
+                discard_all()
+                raise HTTPException(413, too_many_files_message)
+            add_spooled(file_name, *await services.upload_service.spool_file(image_file.file, img_type))
+        else:
+            invalid_files.append(file_name)
+
+    if not spooled:
+        raise HTTPException(400, "No image found in the uploaded files.")
+    # Check the duplicates of the whole request in a single query
+    for img_id in await services.db_context.validate_ids([str(t) for t in spooled]):
+        duplicates.add(UUID(img_id))
+        services.upload_service.discard_spooled_file(spooled.pop(UUID(img_id))[0])
+
+    validity = await asyncio.to_thread(lambda: [_is_valid_image(t[0]) for t in spooled.values()])
+    for img_id, valid in zip(list(spooled), validity):
+        if not valid:
+            spooled_file, file_name = spooled.pop(img_id)
+            invalid_files.append(file_name)
+            services.upload_service.discard_spooled_file(spooled_file)
+
+    index_date = datetime.now()
+    image_data = [ImageData(id=img_id,
+                            local=True,
+                            categories=model.categories,
+                            starred=model.starred,
+                            format=spooled_file.suffix[1:],
+                            index_date=index_date) for img_id, (spooled_file, _) in spooled.items()]
+    try:
+        queued_ids = await services.upload_service.upload_images(image_data, model.skip_ocr)
+    except UploadQueueFullError as ex:
+        raise HTTPException(503, "The upload queue is full, please retry later.",
+                            headers={"Retry-After": str(config.upload.retry_after)}) from ex
+    # The images uploaded by a previous request and still waiting in the queue are not queued again
+    queued_id_set = set(queued_ids)
+    already_queued = [t for t in spooled if t not in queued_id_set]
+    return BulkImageUploadResponse(message=f"OK. {len(queued_ids)} images added to upload queue.",
+                                   image_ids=queued_ids, duplicates=list(duplicates), already_queued=already_queued,
+                                   invalid_files=invalid_files)
+
+
+@admin_router.get("/upload/status/{image_id}",
+                  description="Get the status of an upload job, including the time spent in each stage. Finished jobs "
+                              "are kept for a limited time.")
+async def upload_status(
+        image_id: Annotated[UUID, params.Path(description="The id returned by the upload API.")]
+) -> UploadStatusResponse:
+    status = services.upload_service.get_job_status(image_id)
+    if status is None:
+        raise HTTPException(404, "Cannot find the upload job with the given ID.")
+    return UploadStatusResponse(message="Successfully get upload status!", status=status,
+                                queue_length=services.upload_service.queue_length)
+
+
+@admin_router.post("/upload/status", description="Get the status of several upload jobs at once.")
+async def upload_batch_status(model: UploadStatusQueryModel) -> UploadBatchStatusResponse:
+    statuses = []
+    not_found = []
+    for image_id in model.image_ids:
+        if (status := services.upload_service.get_job_status(image_id)) is not None:
+            statuses.append(status)
+        else:
+            not_found.append(image_id)
+    return UploadBatchStatusResponse(message="Successfully get upload status!", statuses=statuses,
+                                     not_found=not_found, queue_length=services.upload_service.queue_length)
+
+
 @admin_router.get("/server_info", description="Get server information")
 async def server_info():
+    cache = services.inference_service.text_embedding_cache
     return ServerInfoResponse(message="Successfully get server information!",
-                              image_count=await services.db_context.get_counts(exact=True))
+                              image_count=await services.db_context.get_counts(exact=True),
+                              text_embedding_cache=CacheStatistics(size=len(cache), max_size=cache.max_size,
+                                                                   hits=cache.hits, misses=cache.misses,
+                                                                   evictions=cache.evictions))
@@ -1,21 +1,23 @@
+import asyncio
 from io import BytesIO
-from typing import Annotated, List, Union
-from uuid import uuid4, UUID
+from typing import Annotated, List
+from uuid import UUID
 
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 from fastapi import APIRouter, HTTPException
 from fastapi.params import File, Query, Path, Depends
 from loguru import logger
+from qdrant_client.models import SearchRequest, RecommendRequest, QueryRequest, ScrollRequest
 
 from app.Models.api_models.search_api_model import AdvancedSearchModel, CombinedSearchModel, SearchBasisEnum, \
-    SearchCombinedBasisEnum
-from app.Models.api_response.search_api_response import SearchApiResponse
-from app.Models.query_params import SearchPagingParams, FilterParams
+    SearchCombinedBasisEnum, BatchSearchModel, BatchTextSearchQuery, BatchSimilarSearchQuery
+from app.Models.api_response.search_api_response import SearchApiResponse, BatchSearchApiResponse
+from app.Models.query_params import SearchPagingParams, FilterParams, PayloadFieldsParams
 from app.Models.search_result import SearchResult
 from app.Services.authentication import force_access_token_verify
 from app.Services.provider import ServiceProvider
+from app.Services.query_cache_service import QueryNotFoundError
 from app.config import config
-from app.util.calculate_vectors_cosine import calculate_vectors_cosine
 
 search_router = APIRouter(dependencies=([Depends(force_access_token_verify)] if config.access_protected else None),
                          tags=["Search"])
@@ -43,163 +45,323 @@ class SearchCombinedParams:
 
 
 async def result_postprocessing(resp: SearchApiResponse) -> SearchApiResponse:
+    if not config.storage.method.enabled:
+        return resp
+    # All the urls of the page are presigned at once, concurrently
+    targets = []
     for item in resp.result:
-        if item.img.local and config.storage.method.enabled:
-            img_extension = item.img.format or item.img.url.split('.')[-1]
-            img_remote_filename = f"{item.img.id}.{img_extension}"
-            item.img.url = await services.storage_service.active_storage.presign_url(img_remote_filename)
+        if item.img.local:
+            if item.img.url is not None:  # The url may be excluded by the payload fields selection
+                img_extension = item.img.format or item.img.url.split('.')[-1]
+                targets.append((item.img, 'url', f"{item.img.id}.{img_extension}"))
             if item.img.thumbnail_url is not None:
-                thumbnail_remote_filename = f"thumbnails/{item.img.id}.webp"
-                item.img.thumbnail_url = await services.storage_service.active_storage.presign_url(
-                    thumbnail_remote_filename)
+                targets.append((item.img, 'thumbnail_url', f"thumbnails/{item.img.id}.webp"))
+    urls = await services.storage_service.active_storage.presign_urls([t[2] for t in targets])
+    for (img, field, _), url in zip(targets, urls):
+        setattr(img, field, url)
     return resp
 
 
-@search_router.get("/text/{prompt}", description="Search images by text prompt")
+async def cached_search_response(results: list[SearchResult], skip: int, count: int,
+                                 payload_fields: PayloadFieldsParams,
+                                 request: SearchRequest | RecommendRequest | QueryRequest | ScrollRequest | None = None
+                                 ) -> SearchApiResponse:
+    query_id, next_cursor = services.query_cache_service.add_query(results, skip, count, payload_fields, request)
+    return await result_postprocessing(
+        SearchApiResponse(result=results, message=f"Successfully get {len(results)} results.", query_id=query_id,
+                          next_cursor=next_cursor))
+
+
+@search_router.get("/text/{prompt}", response_model_exclude_unset=True, description="Search images by text prompt")
 async def textSearch(
         prompt: Annotated[
             str, Path(max_length=100, description="The image prompt text you want to search.")],
         basis: Annotated[SearchBasisParams, Depends(SearchBasisParams)],
         filter_param: Annotated[FilterParams, Depends(FilterParams)],
         paging: Annotated[SearchPagingParams, Depends(SearchPagingParams)],
+        payload_fields: Annotated[PayloadFieldsParams, Depends(PayloadFieldsParams)],
         exact: Annotated[bool, Query(
             description="If using OCR search, this option will require the ocr text contains **exactly** the "
                         "criteria you have given. This won't take any effect in vision search.")] = False
 ) -> SearchApiResponse:
     logger.info("Text search request received, prompt: {}", prompt)
-    text_vector = services.transformers_service.get_text_vector(prompt) if basis.basis == SearchBasisEnum.vision \
-        else services.transformers_service.get_bert_vector(prompt)
+    text_vector = await services.inference_service.get_text_vector(prompt) if basis.basis == SearchBasisEnum.vision \
+        else await services.inference_service.get_bert_vector(prompt)
     if basis.basis == SearchBasisEnum.ocr and exact:
         filter_param.ocr_text = prompt
-    results = await services.db_context.querySearch(text_vector,
-                                                    query_vector_name=services.db_context.getVectorByBasis(basis.basis),
-                                                    filter_param=filter_param,
-                                                    top_k=paging.count,
-                                                    skip=paging.skip)
-    return await result_postprocessing(
-        SearchApiResponse(result=results, message=f"Successfully get {len(results)} results.", query_id=uuid4()))
+    if basis.basis == SearchBasisEnum.ocr and services.db_context.hybrid_search_enabled:
+        # The keywords are matched by the lexical vector, and fused with the semantic matches of the BERT vector
+        request = services.db_context.get_hybrid_request(prompt, text_vector,
+                                                         filter_param=filter_param,
+                                                         top_k=paging.count,
+                                                         skip=paging.skip,
+                                                         payload_fields=payload_fields)
+    else:
+        query_vector_name = services.db_context.getVectorByBasis(basis.basis)
+        request = services.db_context.get_search_request(text_vector,
+                                                         query_vector_name=query_vector_name,
+                                                         filter_param=filter_param,
+                                                         top_k=paging.count,
+                                                         skip=paging.skip,
+                                                         payload_fields=payload_fields)
+    results = await services.db_context.query_request(request)
+    return await cached_search_response(results, paging.skip, paging.count, payload_fields, request)
 
 
-@search_router.post("/image", description="Search images by image")
+@search_router.post("/image", response_model_exclude_unset=True, description="Search images by image")
 async def imageSearch(
         image: Annotated[bytes, File(max_length=10 * 1024 * 1024, media_type="image/*",
                                      description="The image you want to search.")],
         filter_param: Annotated[FilterParams, Depends(FilterParams)],
-        paging: Annotated[SearchPagingParams, Depends(SearchPagingParams)]
+        paging: Annotated[SearchPagingParams, Depends(SearchPagingParams)],
+        payload_fields: Annotated[PayloadFieldsParams, Depends(PayloadFieldsParams)]
 ) -> SearchApiResponse:
     fakefile = BytesIO(image)
-    img = Image.open(fakefile)
+    try:
+        img = Image.open(fakefile)
+    except UnidentifiedImageError as ex:
+        raise HTTPException(400, "Cannot open the image file.") from ex
     logger.info("Image search request received")
-    image_vector = services.transformers_service.get_image_vector(img)
-    results = await services.db_context.querySearch(image_vector,
-                                                    top_k=paging.count,
-                                                    skip=paging.skip,
-                                                    filter_param=filter_param)
-    return await result_postprocessing(
-        SearchApiResponse(result=results, message=f"Successfully get {len(results)} results.", query_id=uuid4()))
+    image_vector = await services.inference_service.get_image_vector(img)
+    request = services.db_context.get_search_request(image_vector,
+                                                     top_k=paging.count,
+                                                     skip=paging.skip,
+                                                     filter_param=filter_param,
+                                                     payload_fields=payload_fields)
+    results = await services.db_context.query_request(request)
+    return await cached_search_response(results, paging.skip, paging.count, payload_fields, request)
 
 
-@search_router.get("/similar/{image_id}",
+@search_router.get("/similar/{image_id}", response_model_exclude_unset=True,
                   description="Search images similar to the image with given id. "
                               "Won't include the given image itself in the result.")
 async def similarWith(
         image_id: Annotated[UUID, Path(description="The id of the image you want to search.")],
         basis: Annotated[SearchBasisParams, Depends(SearchBasisParams)],
         filter_param: Annotated[FilterParams, Depends(FilterParams)],
-        paging: Annotated[SearchPagingParams, Depends(SearchPagingParams)]
+        paging: Annotated[SearchPagingParams, Depends(SearchPagingParams)],
+        payload_fields: Annotated[PayloadFieldsParams, Depends(PayloadFieldsParams)]
 ) -> SearchApiResponse:
     logger.info("Similar search request received, id: {}", image_id)
-    results = await services.db_context.querySimilar(search_id=str(image_id),
-                                                     top_k=paging.count,
-                                                     skip=paging.skip,
-                                                     filter_param=filter_param,
-                                                     query_vector_name=services.db_context.getVectorByBasis(
-                                                         basis.basis))
-    return await result_postprocessing(
-        SearchApiResponse(result=results, message=f"Successfully get {len(results)} results.", query_id=uuid4()))
+    query_vector_name = services.db_context.getVectorByBasis(basis.basis)
+    request = services.db_context.get_similar_request(search_id=str(image_id),
+                                                      top_k=paging.count,
+                                                      skip=paging.skip,
+                                                      filter_param=filter_param,
+                                                      query_vector_name=query_vector_name,
+                                                      payload_fields=payload_fields)
+    results = await services.db_context.query_request(request)
+    return await cached_search_response(results, paging.skip, paging.count, payload_fields, request)
 
 
-@search_router.post("/advanced", description="Search with multiple criteria")
+@search_router.post("/advanced", response_model_exclude_unset=True, description="Search with multiple criteria")
 async def advancedSearch(
         model: AdvancedSearchModel,
         basis: Annotated[SearchBasisParams, Depends(SearchBasisParams)],
         filter_param: Annotated[FilterParams, Depends(FilterParams)],
-        paging: Annotated[SearchPagingParams, Depends(SearchPagingParams)]) -> SearchApiResponse:
+        paging: Annotated[SearchPagingParams, Depends(SearchPagingParams)],
+        payload_fields: Annotated[PayloadFieldsParams, Depends(PayloadFieldsParams)]) -> SearchApiResponse:
     if len(model.criteria) + len(model.negative_criteria) == 0:
         raise HTTPException(status_code=422, detail="At least one criteria should be provided.")
     logger.info("Advanced search request received: {}", model)
-    result = await process_advanced_and_combined_search_query(model, basis, filter_param, paging)
-    return await result_postprocessing(
-        SearchApiResponse(result=result, message=f"Successfully get {len(result)} results.", query_id=uuid4()))
+    result, request = await process_advanced_search_query(model, basis, filter_param, paging, payload_fields)
+    return await cached_search_response(result, paging.skip, paging.count, payload_fields, request)
 
 
-@search_router.post("/combined", description="Search with combined criteria")
+@search_router.post("/combined", response_model_exclude_unset=True,
+                    description="Search with combined criteria. The candidates are found by the criteria, then ranked "
+                                "by the extra prompt. The score of a result is its cosine similarity to the extra "
+                                "prompt, instead of the product of the criteria and extra prompt scores returned by "
+                                "the earlier versions.")
 async def combinedSearch(
         model: CombinedSearchModel,
         basis: Annotated[SearchCombinedParams, Depends(SearchCombinedParams)],
         filter_param: Annotated[FilterParams, Depends(FilterParams)],
-        paging: Annotated[SearchPagingParams, Depends(SearchPagingParams)]) -> SearchApiResponse:
+        paging: Annotated[SearchPagingParams, Depends(SearchPagingParams)],
+        payload_fields: Annotated[PayloadFieldsParams, Depends(PayloadFieldsParams)]) -> SearchApiResponse:
     if len(model.criteria) + len(model.negative_criteria) == 0:
         raise HTTPException(status_code=422, detail="At least one criteria should be provided.")
     logger.info("Combined search request received: {}", model)
-    result = await process_advanced_and_combined_search_query(model, basis, filter_param, paging)
-    calculate_and_sort_by_combined_scores(model, basis, result)
-    result = result[:paging.count] if len(result) > paging.count else result
-    return await result_postprocessing(
-        SearchApiResponse(result=result, message=f"Successfully get {len(result)} results.", query_id=uuid4()))
+    result, request = await process_combined_search_query(model, basis, filter_param, paging, payload_fields)
+    return await cached_search_response(result, paging.skip, paging.count, payload_fields, request)
+
+
+@search_router.post("/batch", response_model_exclude_unset=True,
+                    description="Search with several text, similar and advanced queries at once, e.g. to render "
+                                "several rows of a page. The text criteria of all the queries are inferred together, "
+                                "and the queries are sent to the database in one round trip.")
+async def batchSearch(
+        model: BatchSearchModel,
+        filter_param: Annotated[FilterParams, Depends(FilterParams)],
+        payload_fields: Annotated[PayloadFieldsParams, Depends(PayloadFieldsParams)]) -> BatchSearchApiResponse:
+    logger.info("Batch search request received, {} queries", len(model.queries))
+    if not config.ocr_search.enable and any(t.basis == SearchBasisEnum.ocr for t in model.queries):
+        raise HTTPException(400, "OCR search is not enabled.")
+    similar_ids = [str(t.image_id) for t in model.queries if isinstance(t, BatchSimilarSearchQuery)]
+    if similar_ids and len(set(await services.db_context.validate_ids(similar_ids))) != len(set(similar_ids)):
+        raise HTTPException(404, "Cannot find the image with the given ID.")
+
+    async def build_request(query):
+        query_vector_name = services.db_context.getVectorByBasis(query.basis)
+        if isinstance(query, BatchSimilarSearchQuery):
+            return services.db_context.get_similar_request(query_vector_name=query_vector_name,
+                                                           search_id=str(query.image_id),
+                                                           filter_param=filter_param,
+                                                           top_k=query.count,
+                                                           skip=query.skip,
+                                                           payload_fields=payload_fields)
+        embed = services.inference_service.get_bert_vector if query.basis == SearchBasisEnum.ocr \
+            else services.inference_service.get_text_vector
+        if isinstance(query, BatchTextSearchQuery) and query.basis == SearchBasisEnum.ocr \
+                and services.db_context.hybrid_search_enabled:
+            return services.db_context.get_hybrid_request(query.prompt, await embed(query.prompt),
+                                                          filter_param=filter_param,
+                                                          top_k=query.count,
+                                                          skip=query.skip,
+                                                          payload_fields=payload_fields)
+        if isinstance(query, BatchTextSearchQuery):
+            return services.db_context.get_search_request(await embed(query.prompt),
+                                                          query_vector_name=query_vector_name,
+                                                          filter_param=filter_param,
+                                                          top_k=query.count,
+                                                          skip=query.skip,
+                                                          payload_fields=payload_fields)
+        if len(query.criteria) + len(query.negative_criteria) == 0:
+            raise HTTPException(status_code=422, detail="At least one criteria should be provided.")
+        vectors = await asyncio.gather(*[embed(t) for t in query.criteria + query.negative_criteria])
+        return services.db_context.get_similar_request(query_vector_name=query_vector_name,
+                                                       positive_vectors=vectors[:len(query.criteria)],
+                                                       negative_vectors=vectors[len(query.criteria):],
+                                                       mode=query.mode,
+                                                       filter_param=filter_param,
+                                                       top_k=query.count,
+                                                       skip=query.skip,
+                                                       payload_fields=payload_fields)
+
+    # All the texts are submitted concurrently, so they will be inferred in as few batches as possible
+    requests = await asyncio.gather(*[build_request(t) for t in model.queries])
+    results = await services.db_context.query_batch(requests)
+    responses = await asyncio.gather(*[cached_search_response(result, query.skip, query.count, payload_fields, request)
+                                       for query, request, result in zip(model.queries, requests, results)])
+    return BatchSearchApiResponse(results=responses,
+                                  message=f"Successfully get the results of {len(responses)} queries.")
 
 
-@search_router.get("/random", description="Get random images")
+@search_router.get("/random", response_model_exclude_unset=True, description="Get random images")
 async def randomPick(
         filter_param: Annotated[FilterParams, Depends(FilterParams)],
-        paging: Annotated[SearchPagingParams, Depends(SearchPagingParams)]) -> SearchApiResponse:
-    logger.info("Random pick request received")
-    random_vector = services.transformers_service.get_random_vector()
-    result = await services.db_context.querySearch(random_vector, top_k=paging.count, filter_param=filter_param)
+        paging: Annotated[SearchPagingParams, Depends(SearchPagingParams)],
+        payload_fields: Annotated[PayloadFieldsParams, Depends(PayloadFieldsParams)],
+        seed: Annotated[int | None, Query(
+            description="The seed of the random order. The same seed gives the same pages, which can be paged by "
+                        "`skip` or the `next_cursor`. Without a seed, a new random sample is returned every time, "
+                        "and it can't be paged, so `skip` must be 0.")] = None) -> SearchApiResponse:
+    logger.info("Random pick request received, seed: {}", seed)
+    if seed is None:
+        try:
+            result = await services.db_context.queryRandom(filter_param=filter_param, top_k=paging.count,
+                                                           skip=paging.skip, payload_fields=payload_fields)
+        except ValueError as ex:
+            raise HTTPException(422, str(ex)) from ex
+        return await cached_search_response(result, 0, paging.count, payload_fields, None)
+    request = services.db_context.get_random_request(seed, filter_param)
+    candidates = await services.db_context.query_candidates(request, paging.skip, paging.count)
+    result = await services.db_context.retrieve_search_results(candidates, payload_fields)
+    return await cached_search_response(result, paging.skip, paging.count, payload_fields, request)
+
+
+@search_router.get("/cursor/{cursor}", response_model_exclude_unset=True,
+                   description="Get the next page of the results of a previous search, by the `next_cursor` returned "
+                               "with its results. The next pages are served from the cached ranking of the query, "
+                               "which is much cheaper than searching again with a larger `skip`. The cursor expires "
+                               "along with the cached query.")
+async def cursorSearch(
+        cursor: Annotated[str, Path(max_length=200, description="The next_cursor of the previous page.")]
+) -> SearchApiResponse:
+    logger.info("Cursor search request received, cursor: {}", cursor)
+    try:
+        query_id, results, next_cursor = await services.query_cache_service.get_page(cursor)
+    except QueryNotFoundError as ex:
+        raise HTTPException(404, "The query is not found or has expired. Please search again.") from ex
+    except ValueError as ex:
+        raise HTTPException(422, str(ex)) from ex
+    return await result_postprocessing(
+        SearchApiResponse(result=results, message=f"Successfully get {len(results)} results.", query_id=query_id,
+                          next_cursor=next_cursor))
+
+
+@search_router.get("/recall/{query_id}", response_model_exclude_unset=True,
+                   description="Recall the first page of results of a previous search with the given query_id, e.g. "
+                               "on back-navigation. The results are served from the cached ranking of the query, "
+                               "without inferring or searching again.")
+async def recallQuery(
+        query_id: Annotated[UUID, Path(description="The query_id of the previous search.")]
+) -> SearchApiResponse:
+    logger.info("Recall request received, query_id: {}", query_id)
+    try:
+        results, next_cursor = await services.query_cache_service.recall(query_id)
+    except QueryNotFoundError as ex:
+        raise HTTPException(404, "The query is not found or has expired. Please search again.") from ex
     return await result_postprocessing(
-        SearchApiResponse(result=result, message=f"Successfully get {len(result)} results.", query_id=uuid4()))
+        SearchApiResponse(result=results, message=f"Successfully get {len(results)} results.", query_id=query_id,
+                          next_cursor=next_cursor))
 
 
-@search_router.get("/recall/{query_id}", description="Recall the query with given queryId")
-async def recallQuery(query_id: str):
-    raise NotImplementedError()
+async def process_advanced_search_query(model: AdvancedSearchModel,
+                                       basis: SearchBasisParams,
+                                       filter_param: FilterParams,
+                                       paging: SearchPagingParams,
+                                       payload_fields: PayloadFieldsParams | None = None
+                                       ) -> tuple[List[SearchResult], RecommendRequest]:
+    """
+    :return: The results, and the equivalent request of the query for the query cache.
+    """
+    embed = services.inference_service.get_bert_vector if basis.basis == SearchBasisEnum.ocr \
+        else services.inference_service.get_text_vector
+    # All the criteria are submitted concurrently, so they will be inferred in as few batches as possible
+    vectors = await asyncio.gather(*[embed(t) for t in model.criteria + model.negative_criteria])
+    positive_vectors = vectors[:len(model.criteria)]
+    negative_vectors = vectors[len(model.criteria):]
+    query_vector_name = services.db_context.getVectorByBasis(basis.basis)
+    request = services.db_context.get_similar_request(query_vector_name=query_vector_name,
+                                                      positive_vectors=positive_vectors,
+                                                      negative_vectors=negative_vectors,
+                                                      mode=model.mode,
+                                                      filter_param=filter_param,
+                                                      top_k=paging.count,
+                                                      skip=paging.skip,
+                                                      payload_fields=payload_fields)
+    return await services.db_context.query_request(request), request
 
 
-async def process_advanced_and_combined_search_query(model: Union[AdvancedSearchModel, CombinedSearchModel],
-                                                     basis: Union[SearchBasisParams, SearchCombinedParams],
-                                                     filter_param: FilterParams,
-                                                     paging: SearchPagingParams) -> List[SearchResult]:
-    if basis.basis == SearchBasisEnum.ocr:
-        positive_vectors = [services.transformers_service.get_bert_vector(t) for t in model.criteria]
-        negative_vectors = [services.transformers_service.get_bert_vector(t) for t in model.negative_criteria]
+async def process_combined_search_query(model: CombinedSearchModel,
+                                        basis: SearchCombinedParams,
+                                        filter_param: FilterParams,
+                                        paging: SearchPagingParams,
+                                        payload_fields: PayloadFieldsParams | None = None
+                                        ) -> tuple[List[SearchResult], QueryRequest]:
+    """
+    The candidates are found by the criteria on the vector of the primary basis, then ranked by the extra prompt on
+    the vector of the other basis, all inside the database.
+    :return: The results, and the equivalent request of the query for the query cache.
+    """
+    if basis.basis == SearchCombinedBasisEnum.ocr:
+        embed, extra_embed = services.inference_service.get_bert_vector, services.inference_service.get_text_vector
+        query_vector_name, rerank_vector_name = services.db_context.TEXT_VECTOR, services.db_context.IMG_VECTOR
     else:
-        positive_vectors = [services.transformers_service.get_text_vector(t) for t in model.criteria]
-        negative_vectors = [services.transformers_service.get_text_vector(t) for t in model.negative_criteria]
-    # In order to ensure the query effect of the combined query, modify the actual top_k
-    _query_top_k = min(max(30, paging.count * 3), 100) if isinstance(model, CombinedSearchModel) else paging.count
-    result = await services.db_context.querySimilar(query_vector_name=services.db_context.getVectorByBasis(basis.basis),
-                                                    positive_vectors=positive_vectors,
-                                                    negative_vectors=negative_vectors,
-                                                    mode=model.mode,
-                                                    filter_param=filter_param,
-                                                    with_vectors=True if isinstance(basis,
-                                                                                    SearchCombinedParams) else False,
-                                                    top_k=_query_top_k,
-                                                    skip=paging.skip)
-    return result
-
-
-def calculate_and_sort_by_combined_scores(model: CombinedSearchModel,
-                                          basis: SearchCombinedParams,
-                                          result: List[SearchResult]) -> None:
-    # First, calculate the extra prompt vector
-    extra_prompt_vector = services.transformers_service.get_text_vector(model.extra_prompt) \
-        if basis.basis == SearchCombinedBasisEnum.ocr \
-        else services.transformers_service.get_bert_vector(model.extra_prompt)
-    # Then, calculate combined_similar_score (original score * similar_score) and write to SearchResult.score
-    for itm in result:
-        extra_vector = itm.img.image_vector if itm.img.image_vector is not None else itm.img.text_contain_vector
-        similar_score = calculate_vectors_cosine(extra_vector, extra_prompt_vector)
-        itm.score = similar_score * itm.score
-    # Finally, sort the result by combined_similar_score
-    result.sort(key=lambda i: i.score, reverse=True)
+        embed, extra_embed = services.inference_service.get_text_vector, services.inference_service.get_bert_vector
+        query_vector_name, rerank_vector_name = services.db_context.IMG_VECTOR, services.db_context.TEXT_VECTOR
+    # All the prompts are submitted concurrently, so they will be inferred in as few batches as possible
+    *vectors, extra_prompt_vector = await asyncio.gather(*[embed(t) for t in model.criteria + model.negative_criteria],
+                                                         extra_embed(model.extra_prompt))
+    request = services.db_context.get_combined_request(extra_prompt_vector,
+                                                       query_vector_name=query_vector_name,
+                                                       rerank_vector_name=rerank_vector_name,
+                                                       positive_vectors=vectors[:len(model.criteria)],
+                                                       negative_vectors=vectors[len(model.criteria):],
+                                                       mode=model.mode,
+                                                       filter_param=filter_param,
+                                                       top_k=paging.count,
+                                                       skip=paging.skip,
+                                                       payload_fields=payload_fields)
+    return await services.db_context.query_request(request), request
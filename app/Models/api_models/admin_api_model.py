@@ -1,4 +1,5 @@
 from typing import Optional
+from uuid import UUID
 
 from pydantic import BaseModel, Field
 
@@ -13,3 +14,7 @@ class ImageOptUpdateModel(BaseModel):
 
     def empty(self) -> bool:
         return self.starred is None and self.categories is None
+
+
+class UploadStatusQueryModel(BaseModel):
+    image_ids: list[UUID] = Field(max_length=1000, description="The ids of the uploaded images.")
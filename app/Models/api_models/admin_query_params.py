@@ -23,3 +23,14 @@ class UploadImageModel:
         self.skip_ocr = skip_ocr
         if not self.url and not self.local:
             raise HTTPException(422, "A correspond url must be provided for a non-local image.")
+
+
+class BulkUploadImageModel:
+    def __init__(self,
+                 categories: Optional[str] = Query(None,
+                                                   description="The categories of the images. The entries should be seperated by comma."),
+                 starred: bool = Query(False, description="If the images are starred."),
+                 skip_ocr: bool = Query(False, description="Whether to skip the OCR process.")):
+        self.categories = [t.strip() for t in categories.split(',') if t.strip()] if categories else None
+        self.starred = starred
+        self.skip_ocr = skip_ocr
@@ -1,4 +1,6 @@
 from enum import Enum
+from typing import Annotated, Literal, Union
+from uuid import UUID
 
 from pydantic import BaseModel, Field
 
@@ -28,3 +30,33 @@ class AdvancedSearchModel(BaseModel):
 class CombinedSearchModel(AdvancedSearchModel):
     extra_prompt: str = Field(max_length=100,
                               description="The secondary prompt used for filtering the image.")
+
+
+class BatchSearchQueryBase(BaseModel):
+    basis: SearchBasisEnum = Field(SearchBasisEnum.vision, description="The basis used to search the image.")
+    count: int = Field(10, ge=1, le=100, description="The number of results you want to get.")
+    skip: int = Field(0, ge=0, description="The number of results you want to skip.")
+
+
+class BatchTextSearchQuery(BatchSearchQueryBase):
+    type: Literal["text"]
+    prompt: str = Field(max_length=100, description="The image prompt text you want to search.")
+
+
+class BatchSimilarSearchQuery(BatchSearchQueryBase):
+    type: Literal["similar"]
+    image_id: UUID = Field(description="The id of the image you want to search.")
+
+
+class BatchAdvancedSearchQuery(BatchSearchQueryBase, AdvancedSearchModel):
+    type: Literal["advanced"]
+
+
+BatchSearchQuery = Annotated[Union[BatchTextSearchQuery, BatchSimilarSearchQuery, BatchAdvancedSearchQuery],
+                             Field(discriminator="type")]
+
+
+class BatchSearchModel(BaseModel):
+    queries: list[BatchSearchQuery] = Field(min_length=1, max_length=32,
+                                            description="The queries you want to search with. The filters and the "
+                                                        "fields selection in the query string apply to all of them.")
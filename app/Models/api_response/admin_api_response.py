@@ -1,11 +1,41 @@
 from uuid import UUID
 
+from pydantic import BaseModel
+
 from .base import NekoProtocol
+from ..upload_job import UploadJobStatus
+
+
+class CacheStatistics(BaseModel):
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    evictions: int
 
 
 class ServerInfoResponse(NekoProtocol):
     image_count: int
+    text_embedding_cache: CacheStatistics
 
 
 class ImageUploadResponse(NekoProtocol):
     image_id: UUID
+
+
+class BulkImageUploadResponse(NekoProtocol):
+    image_ids: list[UUID]
+    duplicates: list[UUID]
+    already_queued: list[UUID]
+    invalid_files: list[str]
+
+
+class UploadStatusResponse(NekoProtocol):
+    status: UploadJobStatus
+    queue_length: int
+
+
+class UploadBatchStatusResponse(NekoProtocol):
+    statuses: list[UploadJobStatus]
+    not_found: list[UUID]
+    queue_length: int
@@ -6,3 +6,8 @@ from uuid import UUID
 class SearchApiResponse(NekoProtocol):
     query_id: UUID
     result: list[SearchResult]
+    next_cursor: str | None = None
+
+
+class BatchSearchApiResponse(NekoProtocol):
+    results: list[SearchApiResponse]
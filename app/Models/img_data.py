@@ -3,7 +3,8 @@ from typing import Optional
 from uuid import UUID
 
 from numpy import ndarray
-from pydantic import BaseModel, Field, computed_field, ConfigDict
+from pydantic import BaseModel, Field, computed_field, ConfigDict, model_serializer, SerializationInfo,\
+    SerializerFunctionWrapHandler
 
 
 class ImageData(BaseModel):
@@ -31,6 +32,14 @@ class ImageData(BaseModel):
             return None
         return self.ocr_text.lower()
 
+    @model_serializer(mode='wrap')
+    def _serialize(self, handler: SerializerFunctionWrapHandler, info: SerializationInfo):
+        result = handler(self)
+        # The search responses leave out the fields which are not selected, see PayloadFieldsParams
+        if info.exclude_unset and 'ocr_text' not in self.model_fields_set:
+            result.pop('ocr_text_lower', None)
+        return result
+
     @property
     def payload(self):
         result = self.model_dump(exclude={'id', 'index_date'})
@@ -41,11 +50,11 @@ class ImageData(BaseModel):
     @classmethod
     def from_payload(cls, id: str, payload: dict,
                      image_vector: Optional[ndarray] = None, text_contain_vector: Optional[ndarray] = None):
-        # Convert the datetime string back to datetime object
-        index_date = datetime.fromisoformat(payload['index_date'])
-        del payload['index_date']
-        return cls(id=UUID(id),
-                   index_date=index_date,
-                   **payload,
-                   image_vector=image_vector if image_vector is not None else None,
-                   text_contain_vector=text_contain_vector if text_contain_vector is not None else None)
+        # Validate everything in a single call, which leaves the given payload unmodified. A trusted path, which only
+        # parses the id and the index_date and then calls model_construct, is several times slower than this, since
+        # the validation runs in pydantic-core while the trusted path runs in Python. See
+        # tests/benchmark/bench_img_data.py.
+        return cls.model_validate({**payload,
+                                   'id': id,
+                                   'image_vector': image_vector,
+                                   'text_contain_vector': text_contain_vector})
@@ -1,7 +1,10 @@
 from typing import Annotated
 
+from fastapi import HTTPException
 from fastapi.params import Query
 
+from app.Models.img_data import ImageData
+
 
 class SearchPagingParams:
     def __init__(
@@ -54,3 +57,29 @@ class FilterParams:
         if self.preferred_ratio is None:
             return None
         return self.preferred_ratio * (1 + self.ratio_tolerance)
+
+
+class PayloadFieldsParams:
+    # The OCR text can be several KBs per image, which isn't needed by listing views
+    DEFAULT_EXCLUDED_FIELDS = ['ocr_text', 'ocr_text_lower']
+    # index_date is required by ImageData, local and format are needed to sign the urls of local images
+    REQUIRED_FIELDS = ['index_date', 'local', 'format']
+    AVAILABLE_FIELDS = set(ImageData.model_fields) - {'id', 'image_vector', 'text_contain_vector'}
+
+    def __init__(
+            self,
+            fields: Annotated[str | None, Query(
+                description="The fields of the images you want to get, seperated by comma. Use `all` to get all the "
+                            "fields. By default, all the fields except `ocr_text` are returned. The fields which are "
+                            "not returned are left out of the results.",
+                examples=["url, thumbnail_url, width, height"])] = None
+    ):
+        self.include: list[str] | None = None
+        self.exclude: list[str] | None = None
+        if fields is None:
+            self.exclude = self.DEFAULT_EXCLUDED_FIELDS
+        elif fields.strip().lower() != 'all':
+            include = [t.strip() for t in fields.split(',') if t.strip()]
+            if unknown_fields := set(include) - self.AVAILABLE_FIELDS:
+                raise HTTPException(422, f"Unknown fields: {', '.join(sorted(unknown_fields))}")
+            self.include = list(dict.fromkeys(include + self.REQUIRED_FIELDS))
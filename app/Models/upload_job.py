@@ -0,0 +1,27 @@
+from datetime import datetime
+from enum import Enum
+from uuid import UUID
+
+from pydantic import BaseModel, Field
+
+
+class UploadJobState(str, Enum):
+    queued = "queued"
+    indexing = "indexing"
+    storing = "storing"
+    done = "done"
+    failed = "failed"
+
+
+class UploadJobStatus(BaseModel):
+    image_id: UUID
+    state: UploadJobState
+    queued_at: datetime
+    updated_at: datetime
+    stage_durations: dict[UploadJobState, float] = Field(
+        default_factory=dict, description="The seconds spent in each finished stage (queued, indexing, storing).")
+    error: str | None = Field(None, description="The error message if the job failed.")
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (UploadJobState.done, UploadJobState.failed)
@@ -1,7 +1,9 @@
+import threading
+
 from PIL import Image
-from fastapi.concurrency import run_in_threadpool
 
 from app.Models.img_data import ImageData
+from app.Services.inference_service import InferenceService
 from app.Services.ocr_services import OCRService
 from app.Services.transformers_service import TransformersService
 from app.Services.vector_db_context import VectorDbContext
@@ -13,27 +15,51 @@ class PointDuplicateError(ValueError):
 
 
 class IndexService:
-    def __init__(self, ocr_service: OCRService, transformers_service: TransformersService, db_context: VectorDbContext):
+    def __init__(self, ocr_service: OCRService, transformers_service: TransformersService,
+                 inference_service: InferenceService, db_context: VectorDbContext):
         self._ocr_service = ocr_service
         self._transformers_service = transformers_service
+        self._inference_service = inference_service
         self._db_context = db_context
+        # The OCR modules aren't known to be thread-safe, and several upload workers may index images at the same time
+        self._ocr_lock = threading.Lock()
 
-    def _prepare_image(self, image: Image.Image, image_data: ImageData, skip_ocr=False):
-        image_data.width = image.width
-        image_data.height = image.height
-        image_data.aspect_ratio = float(image.width) / image.height
+    def prepare_image_vectors(self, images: list[Image.Image], image_data: list[ImageData],
+                              batch_size: int | None = None):
+        """
+        Infer the CLIP vectors of the given RGB images in batch.
+        :param batch_size: The maximum inference batch size, config.inference.max_batch_size by default.
+        """
+        for data, vector in zip(image_data, self._transformers_service.get_image_vectors(images, batch_size)):
+            data.image_vector = vector
 
-        if image.mode != 'RGB':
-            image = image.convert('RGB')  # to reduce convert in next steps
-        else:
-            image = image.copy()
-        image_data.image_vector = self._transformers_service.get_image_vector(image)
+    def prepare_ocr_texts(self, images: list[Image.Image], image_data: list[ImageData], batch_size: int | None = None):
+        """
+        Recognize the texts of the given RGB images, then infer the BERT vectors of the texts in batch.
+        :param batch_size: The maximum inference batch size, config.inference.max_batch_size by default.
+        """
+        for image, data in zip(images, image_data):
+            data.ocr_text = self._ocr_service.ocr_interface(image) or None
+        ocr_image_data = [t for t in image_data if t.ocr_text is not None]
+        if ocr_image_data:
+            text_vectors = self._transformers_service.get_bert_vectors([t.ocr_text for t in ocr_image_data],
+                                                                      batch_size)
+            for data, vector in zip(ocr_image_data, text_vectors):
+                data.text_contain_vector = vector
+
+    def _prepare_images(self, images: list[Image.Image], image_data: list[ImageData], skip_ocr=False):
+        rgb_images = []
+        for image, data in zip(images, image_data):
+            data.width = image.width
+            data.height = image.height
+            data.aspect_ratio = float(image.width) / image.height
+            # to reduce convert in next steps
+            rgb_images.append(image.convert('RGB') if image.mode != 'RGB' else image.copy())
+
+        self.prepare_image_vectors(rgb_images, image_data)
         if not skip_ocr and config.ocr_search.enable:
-            image_data.ocr_text = self._ocr_service.ocr_interface(image)
-            if image_data.ocr_text != "":
-                image_data.text_contain_vector = self._transformers_service.get_bert_vector(image_data.ocr_text)
-            else:
-                image_data.ocr_text = None
+            with self._ocr_lock:
+                self.prepare_ocr_texts(rgb_images, image_data)
 
     # currently, here only need just a simple check
     async def _is_point_duplicate(self, image_data: list[ImageData]) -> bool:
@@ -47,16 +73,20 @@ class IndexService:
             raise PointDuplicateError("The uploaded points are contained in the database!")
 
         if background:
-            await run_in_threadpool(self._prepare_image, image, image_data, skip_ocr)
+            await self._inference_service.run_in_executor(self._prepare_images, [image], [image_data], skip_ocr)
         else:
-            self._prepare_image(image, image_data, skip_ocr)
+            self._prepare_images([image], [image_data], skip_ocr)
 
         await self._db_context.insertItems([image_data])
 
     async def index_image_batch(self, image: list[Image.Image], image_data: list[ImageData],
-                                skip_ocr=False, allow_overwrite=False):
+                                skip_ocr=False, allow_overwrite=False, background=False):
         if not allow_overwrite and (await self._is_point_duplicate(image_data)):
             raise PointDuplicateError("The uploaded points are contained in the database!")
-        for img, img_data in zip(image, image_data):
-            self._prepare_image(img, img_data, skip_ocr)
+
+        if background:
+            await self._inference_service.run_in_executor(self._prepare_images, image, image_data, skip_ocr)
+        else:
+            self._prepare_images(image, image_data, skip_ocr)
+
         await self._db_context.insertItems(image_data)
@@ -0,0 +1,98 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Coroutine, TypeVar
+
+from PIL import Image
+from loguru import logger
+from numpy import ndarray
+
+from app.Services.transformers_service import TransformersService
+from app.config import config
+from app.util.lru_cache import LRUCache
+from app.util.micro_batch_scheduler import MicroBatchScheduler
+
+T = TypeVar('T')
+
+
+class InferenceQueueFullError(RuntimeError):
+    pass
+
+
+class InferenceService:
+    """
+    Async facade of TransformersService. Concurrent requests are merged into batched forward passes, which are run on a
+    bounded pool of worker threads so that the event loop is never blocked by model inference.
+    Text prompt embeddings are cached, so repeated queries skip model inference entirely.
+    Once max_queue_depth requests are in flight, new ones are rejected with InferenceQueueFullError instead of piling
+    up latency for everyone.
+    """
+
+    def __init__(self, transformers_service: TransformersService):
+        self._transformers_service = transformers_service
+        # A single worker thread is the default: torch already parallelizes one forward pass across cores, and
+        # serializing the batches gives the pending requests more time to gather into the next batch.
+        self._executor = ThreadPoolExecutor(max_workers=max(1, config.inference.max_concurrency),
+                                            thread_name_prefix="inference")
+        self._max_queue_depth = config.inference.max_queue_depth
+        self._in_flight = 0
+        window = config.inference.batch_window_ms / 1000
+        max_batch_size = config.inference.max_batch_size
+        self._text_scheduler = MicroBatchScheduler(transformers_service.get_text_vectors, self._executor,
+                                                   window, max_batch_size)
+        self._image_scheduler = MicroBatchScheduler(transformers_service.get_image_vectors, self._executor,
+                                                    window, max_batch_size)
+        self._bert_scheduler = MicroBatchScheduler(transformers_service.get_bert_vectors, self._executor,
+                                                   window, max_batch_size)
+        self.text_embedding_cache: LRUCache[tuple[str, str, str], ndarray] = LRUCache(
+            config.inference.text_embedding_cache_size, config.inference.text_embedding_cache_ttl)
+
+    @property
+    def in_flight_count(self) -> int:
+        return self._in_flight
+
+    async def run_in_executor(self, func: Callable[..., T], *args) -> T:
+        """
+        Run other blocking model inference, e.g. the indexing of uploaded images, on the same bounded worker threads,
+        so that it is capped by config.inference.max_concurrency along with the searches.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def shutdown(self):
+        """Stop the worker threads. The batches being inferred are finished, and the waiting ones are cancelled."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _admit(self, job: Coroutine[Any, Any, T]) -> T:
+        if self._in_flight >= self._max_queue_depth:
+            job.close()
+            logger.warning("Inference queue is full ({} requests in flight). Request rejected.", self._in_flight)
+            raise InferenceQueueFullError("Too many inference requests in progress.")
+        self._in_flight += 1
+        try:
+            return await job
+        finally:
+            self._in_flight -= 1
+
+    @staticmethod
+    def _normalize_prompt(text: str) -> str:
+        # Both CLIP and BERT tokenizers are case-insensitive and collapse whitespaces
+        return " ".join(text.split()).lower()
+
+    async def _get_cached_text_embedding(self, model_name: str, basis: str, text: str,
+                                         scheduler: MicroBatchScheduler[str, ndarray]) -> ndarray:
+        key = (model_name, basis, self._normalize_prompt(text))
+        vector = self.text_embedding_cache.get(key)
+        if vector is None:
+            # Copy the row out of the batch result, so that the cache won't keep the whole batch alive
+            vector = (await self._admit(scheduler.submit(text))).copy()
+            self.text_embedding_cache.put(key, vector)
+        # Callers (e.g. qdrant local mode) may modify the vector in place, so never hand out the cached one
+        return vector.copy()
+
+    async def get_text_vector(self, text: str) -> ndarray:
+        return await self._get_cached_text_embedding(config.model.clip, "vision", text, self._text_scheduler)
+
+    async def get_image_vector(self, image: Image.Image) -> ndarray:
+        return await self._admit(self._image_scheduler.submit(image))
+
+    async def get_bert_vector(self, text: str) -> ndarray:
+        return await self._get_cached_text_embedding(config.model.bert, "ocr", text, self._bert_scheduler)
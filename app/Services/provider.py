@@ -1,6 +1,8 @@
 from loguru import logger
 
 from .index_service import IndexService
+from .inference_service import InferenceService
+from .query_cache_service import QueryCacheService
 from .storage import StorageService
 from .transformers_service import TransformersService
 from .upload_service import UploadService
@@ -11,7 +13,9 @@ from ..config import config, environment
 class ServiceProvider:
     def __init__(self):
         self.transformers_service = TransformersService()
+        self.inference_service = InferenceService(self.transformers_service)
         self.db_context = VectorDbContext()
+        self.query_cache_service = QueryCacheService(self.db_context)
         self.ocr_service = None
 
         if environment.local_indexing or config.admin_api_enable:
@@ -36,7 +40,8 @@ class ServiceProvider:
             self.ocr_service = DisabledOCRService()
         logger.info(f"OCR service '{type(self.ocr_service).__name__}' initialized.")
 
-        self.index_service = IndexService(self.ocr_service, self.transformers_service, self.db_context)
+        self.index_service = IndexService(self.ocr_service, self.transformers_service, self.inference_service,
+                                          self.db_context)
         self.storage_service = StorageService()
         logger.info(f"Storage service '{type(self.storage_service.active_storage).__name__}' initialized.")
 
@@ -47,3 +52,9 @@ class ServiceProvider:
 
     async def onload(self):
         await self.db_context.onload()
+
+    async def onexit(self):
+        try:
+            await self.db_context.flush()
+        finally:
+            self.inference_service.shutdown()
@@ -0,0 +1,170 @@
+import base64
+import binascii
+from uuid import UUID, uuid4
+
+from loguru import logger
+from qdrant_client.http import models
+
+from app.Models.query_params import PayloadFieldsParams
+from app.Models.search_result import SearchResult
+from app.Services.vector_db_context import VectorDbContext
+from app.config import config
+from app.util.lru_cache import LRUCache
+
+
+class QueryNotFoundError(ValueError):
+    def __init__(self, query_id: UUID):
+        self.query_id = query_id
+        super().__init__(f"Query {query_id} not found or expired.")
+
+
+class CachedQuery:
+    """A search query, along with its first page of results and a window of its ranked candidates."""
+
+    def __init__(self,
+                 request: models.SearchRequest | models.RecommendRequest | models.QueryRequest | models.ScrollRequest
+                 | None,
+                 payload_fields: PayloadFieldsParams | None, page: list[tuple[str, float]], skip: int, count: int):
+        self.request = request  # None if the results can't be paged, e.g. unseeded random picks
+        self.payload_fields = payload_fields
+        self.page = page
+        self.skip = skip
+        self.count = count
+        self.has_next = request is not None and len(page) == count
+        self.candidates = page
+        self.start = skip  # The rank of the first cached candidate
+        self.exhausted = not self.has_next  # Whether there are no more candidates after the cached ones
+
+    @property
+    def memory_size(self) -> int:
+        """A rough estimation of the memory usage in bytes, dominated by the query vectors and the candidates."""
+        vectors = []
+        if isinstance(self.request, models.SearchRequest):
+            vectors = [self.request.vector.vector if isinstance(self.request.vector, models.NamedVector)
+                       else self.request.vector]
+        elif isinstance(self.request, models.RecommendRequest):
+            vectors = self.request.positive + (self.request.negative or [])
+        elif isinstance(self.request, models.QueryRequest):
+            prefetches = self.request.prefetch if isinstance(self.request.prefetch, list) else [self.request.prefetch]
+            vectors = [self.request.query]
+            for prefetch in prefetches:
+                if isinstance(prefetch.query, models.RecommendQuery):
+                    vectors += (prefetch.query.recommend.positive or []) + (prefetch.query.recommend.negative or [])
+                elif isinstance(prefetch.query, models.SparseVector):
+                    vectors += [prefetch.query.indices, prefetch.query.values]
+                else:
+                    vectors.append(prefetch.query)
+        floats = sum(len(t) for t in vectors if isinstance(t, list))
+        # Every float in a list takes a pointer and a float object, and every candidate takes a tuple, an ID string and
+        # a float object
+        return 1024 + 32 * floats + 200 * (len(self.page) + len(self.candidates))
+
+
+class QueryCacheService:
+    """
+    Caches the recent search queries by their query_id, along with their first page of results and a window of their
+    ranked candidates (IDs and scores). Only the IDs are cached, the items are always retrieved again, so the results
+    are never stale. A recalled query is served without inferring or searching again.
+    The next pages of a query are fetched by an opaque cursor. The pages inside the window are retrieved by ID directly,
+    and once a cursor goes beyond the window, the next window is fetched by a single ranking-only query. So the deep
+    pages neither infer the query again, nor search all the previous pages for every page.
+    """
+
+    def __init__(self, db_context: VectorDbContext):
+        self._db_context = db_context
+        self._queries: LRUCache[UUID, CachedQuery] = LRUCache(config.query_cache.size, config.query_cache.ttl,
+                                                              config.query_cache.max_memory_mb * 1024 * 1024,
+                                                              lambda t: t.memory_size)
+
+    @staticmethod
+    def encode_cursor(query_id: UUID, offset: int, count: int) -> str:
+        return base64.urlsafe_b64encode(f"{query_id.hex}.{offset}.{count}".encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple[UUID, int, int]:
+        """
+        Decode a cursor returned by encode_cursor.
+        :return: The query_id, and the offset and count of the page.
+        :raises ValueError: If the cursor is malformed, or its offset is beyond config.query_cache.max_offset.
+        """
+        try:
+            query_id, offset, count = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('.')
+            query_id, offset, count = UUID(query_id), int(offset), int(count)
+        except (binascii.Error, UnicodeDecodeError, ValueError) as ex:
+            raise ValueError("Invalid cursor.") from ex
+        if offset < 0 or not 1 <= count <= 100:
+            raise ValueError("Invalid cursor.")
+        if offset > config.query_cache.max_offset:
+            raise ValueError(f"The cursor can't page beyond {config.query_cache.max_offset} results.")
+        return query_id, offset, count
+
+    def _next_cursor(self, query_id: UUID, offset: int, count: int, has_next: bool) -> str | None:
+        if not has_next or offset > config.query_cache.max_offset:
+            return None
+        return self.encode_cursor(query_id, offset, count)
+
+    def add_query(self, results: list[SearchResult], skip: int, count: int,
+                  payload_fields: PayloadFieldsParams | None = None,
+                  request: models.SearchRequest | models.RecommendRequest | models.QueryRequest | models.ScrollRequest
+                  | None = None
+                  ) -> tuple[UUID, str | None]:
+        """
+        Cache a query whose page of results has just been searched.
+        :param results: The results of the page.
+        :param skip: The number of results skipped before the page.
+        :param count: The requested number of results of the page.
+        :param payload_fields: The payload fields selection of the query.
+        :param request: The request equivalent to the query, built by get_search_request, get_similar_request,
+                        get_combined_request, get_hybrid_request or get_random_request. None if the query can't be
+                        paged.
+        :return: The query_id, and the cursor of the next page. The cursor is None if there are no more results, the
+                 query can't be paged, or the cache is disabled.
+        """
+        query_id = uuid4()
+        if self._queries.max_size <= 0:
+            return query_id, None
+        query = CachedQuery(request, payload_fields, [(str(t.img.id), t.score) for t in results], skip, count)
+        self._queries.put(query_id, query)
+        return query_id, self._next_cursor(query_id, skip + count, count, query.has_next)
+
+    async def recall(self, query_id: UUID) -> tuple[list[SearchResult], str | None]:
+        """
+        Get the first page of results of a cached query again.
+        :param query_id: The query_id returned by add_query.
+        :return: The results of the page, and the cursor of the next page (None if there isn't one).
+        :raises QueryNotFoundError: If the query isn't cached, e.g. it has expired.
+        """
+        query = self._queries.get(query_id)
+        if query is None:
+            raise QueryNotFoundError(query_id)
+        logger.info("Recalling query {} from the cache.", query_id)
+        results = await self._db_context.retrieve_search_results(query.page, query.payload_fields)
+        return results, self._next_cursor(query_id, query.skip + query.count, query.count, query.has_next)
+
+    async def get_page(self, cursor: str) -> tuple[UUID, list[SearchResult], str | None]:
+        """
+        Get the page of results of a cached query pointed by the cursor.
+        :param cursor: The cursor returned by add_query or a previous get_page.
+        :return: The query_id, the results of the page, and the cursor of the next page (None if there isn't one).
+        :raises QueryNotFoundError: If the query isn't cached, e.g. it has expired.
+        :raises ValueError: If the cursor is malformed.
+        """
+        query_id, offset, count = self.decode_cursor(cursor)
+        query = self._queries.get(query_id)
+        if query is None:
+            raise QueryNotFoundError(query_id)
+        if query.request is None:
+            raise ValueError("The query can't be paged.")
+        end = query.start + len(query.candidates)
+        if not (query.start <= offset and (offset + count <= end or query.exhausted)):
+            limit = max(count, config.query_cache.candidate_window)
+            candidates = await self._db_context.query_candidates(query.request, offset, limit)
+            query.candidates, query.start, query.exhausted = candidates, offset, len(candidates) < limit
+            end = offset + len(candidates)
+            self._queries.put(query_id, query)  # Update the memory usage of the query
+        else:
+            logger.info("Serving page at offset {} of query {} from the cached candidates.", offset, query_id)
+        page = query.candidates[offset - query.start:offset - query.start + count]
+        results = await self._db_context.retrieve_search_results(page, query.payload_fields)
+        has_next = not query.exhausted or offset + count < end
+        return query_id, results, self._next_cursor(query_id, offset + count, count, has_next)
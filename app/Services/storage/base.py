@@ -1,8 +1,12 @@
 import abc
+import asyncio
 import os
+from time import monotonic
 from typing import TypeVar, Generic, TypeAlias, Optional, AsyncGenerator
 
 from app.Models.img_data import ImageData
+from app.config import config
+from app.util.lru_cache import LRUCache
 
 FileMetaDataT = TypeVar('FileMetaDataT')
 
@@ -14,11 +18,17 @@ RemoteFileMetaDataType: TypeAlias = FileMetaDataT
 
 
 class BaseStorage(abc.ABC, Generic[FileMetaDataT]):
+    # A presigned URL is reused for this fraction of its validity, so a cached URL is still valid for a while
+    PRESIGN_CACHE_RATIO = 0.5
+
     def __init__(self):
         self.static_dir: os.PathLike
         self.thumbnails_dir: os.PathLike
         self.deleted_dir: os.PathLike
         self.file_metadata: FileMetaDataT
+        self._presign_cache: LRUCache[tuple[str, int], tuple[float, str]] = LRUCache(
+            config.storage.presign_cache_size)
+        self._presign_semaphore = asyncio.Semaphore(max(1, config.storage.presign_concurrency))
 
     @abc.abstractmethod
     def pre_check(self):
@@ -67,6 +77,29 @@ class BaseStorage(abc.ABC, Generic[FileMetaDataT]):
         """
         raise NotImplementedError
 
+    async def presign_urls(self,
+                           remote_files: list[RemoteFilePathType],
+                           expire_second: int = 3600) -> list[str]:
+        """
+        Get the presign URLs of several files in static_dir concurrently.
+        The URLs are cached per file for a part of their validity.
+        :param remote_files: The file paths relative to static_dir
+        :param expire_second: Valid time for presign urls
+        :return: files' "presign URL", in the same order
+        """
+
+        async def presign(remote_file: RemoteFilePathType) -> str:
+            key = (str(remote_file), expire_second)
+            cached = self._presign_cache.get(key)
+            if cached is not None and cached[0] > monotonic():
+                return cached[1]
+            async with self._presign_semaphore:
+                url = await self.presign_url(remote_file, expire_second)
+            self._presign_cache.put(key, (monotonic() + expire_second * self.PRESIGN_CACHE_RATIO, url))
+            return url
+
+        return list(await asyncio.gather(*[presign(t) for t in remote_files]))
+
     @abc.abstractmethod
     async def fetch(self,
                     remote_file: RemoteFilePathType) -> bytes:
@@ -78,6 +78,12 @@ class LocalStorage(BaseStorage[FileMetaDataT: None]):
                           expire_second: int = 3600) -> str:
         return f"/static/{str(remote_file)}"
 
+    async def presign_urls(self,
+                           remote_files: list["RemoteFilePathType"],
+                           expire_second: int = 3600) -> list[str]:
+        # Local files don't need to be signed
+        return [f"/static/{str(t)}" for t in remote_files]
+
     @transform_exception("remote")
     async def fetch(self,
                     remote_file: "RemoteFilePathType") -> bytes:
@@ -1,4 +1,5 @@
 from time import time
+from typing import Callable
 
 import numpy as np
 import torch
@@ -28,42 +29,76 @@ class TransformersService:
         else:
             logger.info("OCR search is disabled. Skipping OCR and BERT model loading.")
 
-    @no_grad()
     def get_image_vector(self, image: Image.Image) -> ndarray:
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        logger.info("Processing image...")
+        return self.get_image_vectors([image])[0]
+
+    def get_text_vector(self, text: str) -> ndarray:
+        return self.get_text_vectors([text])[0]
+
+    def get_bert_vector(self, text: str) -> ndarray:
+        return self.get_bert_vectors([text])[0]
+
+    @staticmethod
+    def _batched(items: list, infer: Callable[[list], ndarray], batch_size: int | None, dim: int,
+                 sort_key: Callable | None = None) -> ndarray:
+        """
+        Split items into sub-batches of at most batch_size and infer them one sub-batch after another.
+        If sort_key is given, items are grouped by it, so that inputs of similar length are padded together.
+        :param dim: The dimension of the vectors returned by infer, which is the shape of the result of no items.
+        """
+        if not items:
+            return np.empty((0, dim), dtype=np.float32)
+        batch_size = batch_size or config.inference.max_batch_size
+        order = sorted(range(len(items)), key=lambda i: sort_key(items[i])) if sort_key else list(range(len(items)))
+        results = [infer([items[i] for i in order[start:start + batch_size]])
+                   for start in range(0, len(order), batch_size)]
+        vectors = np.empty((len(items), results[0].shape[-1]), dtype=results[0].dtype)
+        vectors[order] = np.concatenate(results)
+        return vectors
+
+    def get_image_vectors(self, images: list[Image.Image], batch_size: int | None = None) -> ndarray:
+        return self._batched(images, self._infer_image_vectors, batch_size, self._clip_model.config.projection_dim)
+
+    def get_text_vectors(self, texts: list[str], batch_size: int | None = None) -> ndarray:
+        return self._batched(texts, self._infer_text_vectors, batch_size, self._clip_model.config.projection_dim,
+                             sort_key=len)
+
+    def get_bert_vectors(self, texts: list[str], batch_size: int | None = None) -> ndarray:
+        return self._batched(texts, self._infer_bert_vectors, batch_size, self._bert_model.config.hidden_size,
+                             sort_key=len)
+
+    @no_grad()
+    def _infer_image_vectors(self, images: list[Image.Image]) -> ndarray:
+        images = [t if t.mode == "RGB" else t.convert("RGB") for t in images]
+        logger.info("Processing {} image(s)...", len(images))
         start_time = time()
-        inputs = self._clip_processor(images=image, return_tensors="pt").to(self.device)
+        inputs = self._clip_processor(images=images, return_tensors="pt").to(self.device)
         logger.success("Image processed, now Inferring with CLIP model...")
         outputs: FloatTensor = self._clip_model.get_image_features(**inputs)
         logger.success("Inference done. Time elapsed: {:.2f}s", time() - start_time)
         outputs /= outputs.norm(dim=-1, keepdim=True)
-        return outputs.numpy(force=True).reshape(-1)
+        return outputs.numpy(force=True)
 
     @no_grad()
-    def get_text_vector(self, text: str) -> ndarray:
-        logger.info("Processing text...")
+    def _infer_text_vectors(self, texts: list[str]) -> ndarray:
+        logger.info("Processing {} text(s)...", len(texts))
         start_time = time()
-        inputs = self._clip_processor(text=text, return_tensors="pt").to(self.device)
+        inputs = self._clip_processor(text=texts, padding=True, truncation=True, return_tensors="pt").to(self.device)
         logger.success("Text processed, now Inferring with CLIP model...")
         outputs: FloatTensor = self._clip_model.get_text_features(**inputs)
         logger.success("Inference done. Time elapsed: {:.2f}s", time() - start_time)
         outputs /= outputs.norm(dim=-1, keepdim=True)
-        return outputs.numpy(force=True).reshape(-1)
+        return outputs.numpy(force=True)
 
     @no_grad()
-    def get_bert_vector(self, text: str) -> ndarray:
+    def _infer_bert_vectors(self, texts: list[str]) -> ndarray:
         start_time = time()
-        logger.info("Inferring with BERT model...")
-        inputs = self._bert_tokenizer(text.strip().lower(), return_tensors="pt").to(self.device)
+        logger.info("Inferring {} text(s) with BERT model...", len(texts))
+        inputs = self._bert_tokenizer([t.strip().lower() for t in texts], padding=True, truncation=True,
+                                      return_tensors="pt").to(self.device)
         outputs = self._bert_model(**inputs)
-        vector = outputs.last_hidden_state.mean(dim=1).squeeze()
+        # Mean pooling over the real tokens only, so that padding doesn't affect the result
+        mask = inputs['attention_mask'].unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+        vectors = (outputs.last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1)
         logger.success("BERT inference done. Time elapsed: {:.2f}s", time() - start_time)
-        return vector.cpu().numpy()
-
-    @staticmethod
-    def get_random_vector() -> ndarray:
-        vec = np.random.rand(768)
-        vec -= vec.mean()
-        return vec
+        return vectors.cpu().numpy()
@@ -1,70 +1,381 @@
 import asyncio
 import gc
+import itertools
+import json
+import os
+import tarfile
+import zipfile
+from contextlib import ExitStack
+from datetime import datetime
 from io import BytesIO
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Collection, IO
+from uuid import UUID, uuid4
 
 from PIL import Image
 from loguru import logger
 
 from app.Models.img_data import ImageData
+from app.Models.upload_job import UploadJobState, UploadJobStatus
 from app.Services.index_service import IndexService
 from app.Services.storage import StorageService
 from app.Services.vector_db_context import VectorDbContext
+from app.config import config
+from app.util.archive import iter_archive_files
+from app.util.generate_uuid import UUIDHasher, HASH_CHUNK_SIZE
+from app.util.lru_cache import LRUCache
+
+
+class UploadQueueFullError(RuntimeError):
+    pass
+
+
+class TooManyUploadFilesError(ValueError):
+    pass
+
+
+def _try_lock_file(lock_file: IO) -> bool:
+    """Try to take an exclusive lock of an open file without blocking. The lock is released when the file is closed."""
+    try:
+        if os.name == 'nt':
+            import msvcrt
+
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
 
 
 class UploadService:
+    """
+    Index and store the uploaded images in background.
+    The uploaded images are spooled to disk, along with a small JSON journal entry of their metadata, so the memory
+    usage doesn't depend on the queue length, and the queued images survive a restart: unfinished jobs are replayed on
+    startup. Every server process spools into its own locked subdirectory, see _claim_spool_dir.
+    The queue itself only holds the image IDs, bounded by config.upload.queue_size. The waiting IDs are taken by a
+    worker in batches of up to config.upload.batch_size, which are indexed together and written to the database in one
+    upsert.
+    The state and per-stage timing of every job is tracked, and the finished ones are kept for a while so that clients
+    can poll them.
+    """
+
     def __init__(self, storage_service: StorageService, db_context: VectorDbContext, index_service: IndexService):
         self._storage_service = storage_service
         self._db_context = db_context
         self._index_service = index_service
 
-        self._queue = asyncio.Queue(200)
-        self._upload_worker_task = asyncio.create_task(self._upload_worker())
+        self._spool_dir = self._claim_spool_dir()
+        self._clean_spool_dir()
+
+        self._queue = asyncio.Queue(config.upload.queue_size)
+        self._active_jobs: dict[str, UploadJobStatus] = {}
+        self._finished_jobs: LRUCache[str, UploadJobStatus] = LRUCache(config.upload.status_history_size,
+                                                                         config.upload.status_history_ttl)
+        self._upload_worker_tasks = [asyncio.create_task(self._upload_worker())
+                                     for _ in range(max(1, config.upload.workers))]
+        self._replay_task = asyncio.create_task(self._replay_journal())
 
         self._processed_count = 0
 
+    @property
+    def queue_length(self) -> int:
+        return self._queue.qsize()
+
+    def get_job_status(self, image_id: UUID | str) -> UploadJobStatus | None:
+        image_id = str(image_id)
+        return self._active_jobs.get(image_id) or self._finished_jobs.get(image_id)
+
+    def _update_job(self, image_id: UUID | str, state: UploadJobState, error: str | None = None):
+        image_id = str(image_id)
+        now = datetime.now()
+        job = self._active_jobs.get(image_id)
+        if job is None:
+            self._finished_jobs.pop(image_id)  # The image is uploaded again, e.g. after a failure
+            job = self._active_jobs[image_id] = UploadJobStatus(image_id=image_id, state=state, queued_at=now,
+                                                                updated_at=now)
+        else:
+            job.stage_durations[job.state] = (now - job.updated_at).total_seconds()
+            job.state = state
+            job.updated_at = now
+        job.error = error
+        if job.finished:
+            del self._active_jobs[image_id]
+            self._finished_jobs.put(image_id, job)
+
+    def _journal_path(self, image_id: UUID | str) -> Path:
+        return self._spool_dir / f"{image_id}.json"
+
+    def _claim_spool_dir(self) -> Path:
+        """
+        Several server processes may share the spool path, so every process takes the first subdirectory whose lock
+        file isn't held by another running process. The files of the other processes are never cleaned or replayed,
+        and the unfinished jobs of a stopped process are replayed by the process which takes its subdirectory next.
+        """
+        for i in itertools.count():
+            spool_dir = Path(config.upload.spool_path) / f"worker-{i}"
+            spool_dir.mkdir(parents=True, exist_ok=True)
+            lock_file = open(spool_dir / ".lock", 'a+b')
+            if _try_lock_file(lock_file):
+                self._spool_lock_file = lock_file  # Held until the process exits
+                logger.info("Upload spool directory: {}", spool_dir)
+                return spool_dir
+            lock_file.close()
+
+    def _clean_spool_dir(self):
+        """Remove the files left by an interrupted receiving, which have no journal entry."""
+        queued_ids = {t.stem for t in self._spool_dir.glob("*.json")}
+        for spool_file in self._spool_dir.iterdir():
+            if spool_file.name.startswith('.'):  # The lock file
+                continue
+            if spool_file.is_file() and spool_file.name.split('.')[0] not in queued_ids:
+                logger.warning("Removing orphan spool file {}", spool_file)
+                spool_file.unlink()
+
+    async def _replay_journal(self):
+        journal_entries = sorted(self._spool_dir.glob("*.json"), key=lambda t: t.stat().st_mtime)
+        if not journal_entries:
+            return
+        logger.warning("Found {} unfinished uploads in the spool directory, replaying...", len(journal_entries))
+        for entry in journal_entries:
+            self._update_job(entry.stem, UploadJobState.queued)
+        for entry in journal_entries:
+            await self._queue.put(entry.stem)
+
     async def _upload_worker(self):
         while True:
-            img, img_data, img_bytes, skip_ocr = await self._queue.get()
+            image_ids = [await self._queue.get()]
+            # Take the waiting images into the batch, whether they were uploaded together or one by one
+            while not self._queue.empty() and len(image_ids) < config.upload.batch_size:
+                image_ids.append(self._queue.get_nowait())
             try:
-                await self._upload_task(img, img_data, img_bytes, skip_ocr)
-                logger.success("Image {} uploaded and indexed. Queue Length: {} [-1]", img_data.id, self._queue.qsize())
+                await self._upload_task(image_ids)
+                logger.success("{} images uploaded and indexed. Queue Length: {} [-1]",
+                               len(image_ids), self._queue.qsize())
             except Exception as ex:
-                logger.error("Error occurred while uploading image {}", img_data.id)
+                for image_id in image_ids:
+                    if image_id in self._active_jobs:
+                        self._update_job(image_id, UploadJobState.failed, error=str(ex) or type(ex).__name__)
+                logger.error("Error occurred while uploading images {}", image_ids)
                 logger.exception(ex)
             finally:
-                self._queue.task_done()
-                self._processed_count += 1
-                if self._processed_count % 50 == 0:
+                for image_id in image_ids:
+                    self._discard_job(image_id)
+                for _ in image_ids:
+                    self._queue.task_done()
+                self._processed_count += len(image_ids)
+                if self._processed_count >= 50:
+                    self._processed_count = 0
                     gc.collect()
 
-    async def _upload_task(self, img: Image.Image, img_data: ImageData, img_bytes: bytes, skip_ocr: bool):
-        logger.info('Start indexing image {}. Local: {}. Size: {}', img_data.id, img_data.local, len(img_bytes))
-        file_name = f"{img_data.id}.{img_data.format}"
-        thumb_path = f"thumbnails/{img_data.id}.webp"
-        img_thumb = None
-        if img_data.local:
-            img_data.url = await self._storage_service.active_storage.url(file_name)
-            if len(img_bytes) > 1024 * 500:
-                img_data.thumbnail_url = await self._storage_service.active_storage.url(
-                    f"thumbnails/{img_data.id}.webp")
-
-        await self._index_service.index_image(img, img_data, skip_ocr=skip_ocr,
-                                              background=True)  # The img might be modified after calling this
-        logger.success("Image {} indexed.", img_data.id)
-
-        if img_data.local:
-            logger.info("Start uploading image {} to local storage.", img_data.id)
-            await self._storage_service.active_storage.upload(img_bytes, file_name)
-            logger.success("Image {} uploaded to local storage.", img_data.id)
-            if len(img_bytes) > 1024 * 500:
-                img.thumbnail((256, 256), resample=Image.Resampling.LANCZOS)
-                img_byte_arr = BytesIO()
-                img.save(img_byte_arr, 'WebP')
-                await self._storage_service.active_storage.upload(img_byte_arr.getvalue(), thumb_path)
-                logger.success("Thumbnail for {} generated and uploaded!", img_data.id)
-
-        img.close()
-
-    async def upload_image(self, img: Image.Image, img_data: ImageData, img_bytes: bytes, skip_ocr: bool):
-        await self._queue.put((img, img_data, img_bytes, skip_ocr))
-        logger.info("Image {} added to upload queue. Queue Length: {} [+1]", img_data.id, self._queue.qsize())
+    def _load_job(self, image_id: str) -> tuple[ImageData, Path, bool]:
+        with open(self._journal_path(image_id), encoding='utf-8') as f:
+            job = json.load(f)
+        img_data = ImageData.from_payload(image_id, job['payload'])
+        return img_data, self._spool_dir / f"{image_id}.{img_data.format}", job['skip_ocr']
+
+    def _discard_job(self, image_id: UUID | str):
+        self._journal_path(image_id).unlink(missing_ok=True)
+        for spool_file in self._spool_dir.glob(f"{image_id}.*"):
+            spool_file.unlink(missing_ok=True)
+
+    async def _upload_task(self, image_ids: list[str]):
+        jobs: list[tuple[ImageData, Path, bool]] = []
+        for image_id in image_ids:
+            self._update_job(image_id, UploadJobState.indexing)
+            try:
+                jobs.append(await asyncio.to_thread(self._load_job, image_id))
+            except (OSError, ValueError) as ex:
+                self._update_job(image_id, UploadJobState.failed, error=str(ex))
+                logger.error("Cannot load the upload job of image {}: {}", image_id, ex)
+
+        # The duplicates of the whole batch are checked in a single query
+        duplicate_ids = set(await self._db_context.validate_ids([str(t[0].id) for t in jobs]))
+        for img_data, _, _ in jobs:
+            if str(img_data.id) in duplicate_ids:
+                self._update_job(img_data.id, UploadJobState.failed,
+                                 error="The image is already contained in the database.")
+        jobs = [t for t in jobs if str(t[0].id) not in duplicate_ids]
+
+        for skip_ocr in (False, True):
+            group = [t for t in jobs if t[2] == skip_ocr]
+            if not group:
+                continue
+            # The groups are indexed separately, so a failed group doesn't fail the other one
+            try:
+                await self._upload_group([(t[0], t[1]) for t in group], skip_ocr)
+            except Exception as ex:
+                for img_data, _, _ in group:
+                    if str(img_data.id) in self._active_jobs:
+                        self._update_job(img_data.id, UploadJobState.failed, error=str(ex) or type(ex).__name__)
+                logger.error("Error occurred while indexing images {}", [str(t[0].id) for t in group])
+                logger.exception(ex)
+
+    async def _upload_group(self, jobs: list[tuple[ImageData, Path]], skip_ocr: bool):
+        with ExitStack() as stack:
+            images: list[Image.Image] = []
+            image_data: list[ImageData] = []
+            for img_data, spool_file in jobs:
+                try:
+                    images.append(stack.enter_context(Image.open(spool_file)))
+                except OSError as ex:
+                    self._update_job(img_data.id, UploadJobState.failed, error=str(ex))
+                    continue
+                image_data.append(img_data)
+                if img_data.local:
+                    img_data.url = await self._storage_service.active_storage.url(f"{img_data.id}.{img_data.format}")
+                    if spool_file.stat().st_size > 1024 * 500:
+                        img_data.thumbnail_url = await self._storage_service.active_storage.url(
+                            f"thumbnails/{img_data.id}.webp")
+            if not image_data:
+                return
+            logger.info('Start indexing {} images.', len(image_data))
+            # The duplicates have already been filtered out by the caller
+            await self._index_service.index_image_batch(images, image_data, skip_ocr=skip_ocr, allow_overwrite=True,
+                                                        background=True)
+            # The inserts may be buffered, make sure they are written before the spooled images are discarded
+            await self._db_context.flush()
+            logger.success("{} images indexed.", len(image_data))
+
+            for img, img_data in zip(images, image_data):
+                self._update_job(img_data.id, UploadJobState.storing)
+                try:
+                    await self._store_image(img, img_data)
+                except Exception as ex:
+                    self._update_job(img_data.id, UploadJobState.failed, error=str(ex) or type(ex).__name__)
+                    logger.error("Error occurred while storing image {}", img_data.id)
+                    logger.exception(ex)
+                    continue
+                self._update_job(img_data.id, UploadJobState.done)
+
+    async def _store_image(self, img: Image.Image, img_data: ImageData):
+        if not img_data.local:
+            return
+        spool_file = self._spool_dir / f"{img_data.id}.{img_data.format}"
+        logger.info("Start uploading image {} to local storage.", img_data.id)
+        await self._storage_service.active_storage.upload(spool_file, f"{img_data.id}.{img_data.format}")
+        logger.success("Image {} uploaded to local storage.", img_data.id)
+        if img_data.thumbnail_url is not None:
+            thumbnail_bytes = await asyncio.to_thread(self._generate_thumbnail, img)
+            await self._storage_service.active_storage.upload(thumbnail_bytes, f"thumbnails/{img_data.id}.webp")
+            logger.success("Thumbnail for {} generated and uploaded!", img_data.id)
+
+    @staticmethod
+    def _generate_thumbnail(img: Image.Image) -> bytes:
+        img.thumbnail((256, 256), resample=Image.Resampling.LANCZOS)
+        img_byte_arr = BytesIO()
+        img.save(img_byte_arr, 'WebP')
+        return img_byte_arr.getvalue()
+
+    def _spool_stream(self, stream: BinaryIO, img_format: str) -> tuple[UUID, Path]:
+        hasher = UUIDHasher()
+        temp_file = self._spool_dir / f"receiving-{uuid4()}.tmp"
+        try:
+            with open(temp_file, 'wb') as f:
+                while chunk := stream.read(HASH_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            temp_file.unlink(missing_ok=True)
+            raise
+        image_id = hasher.uuid
+        spooled_file = self._spool_dir / f"{image_id}.{img_format}"
+        if self._journal_path(image_id).exists():
+            # The same image is already queued, keep the queued one untouched
+            temp_file.unlink()
+        else:
+            os.replace(temp_file, spooled_file)
+        return image_id, spooled_file
+
+    async def spool_file(self, stream: BinaryIO, img_format: str) -> tuple[UUID, Path]:
+        """
+        Write the uploaded file to the spool directory, hashing it while it is being copied.
+        :param stream: The uploaded file.
+        :param img_format: The format (extension) of the image.
+        :return: The ID of the image and the path of the spooled file.
+        """
+        return await asyncio.to_thread(self._spool_stream, stream, img_format)
+
+    def _spool_archive_files(self, archive: BinaryIO, allowed_formats: Collection[str], max_files: int,
+                             spooled: list[tuple[str, UUID, Path]], skipped: list[str]):
+        for name, member in iter_archive_files(archive):
+            img_format = PurePosixPath(name).suffix.lower()[1:]
+            if img_format not in allowed_formats:
+                skipped.append(name)
+                continue
+            if len(spooled) >= max_files:
+                raise TooManyUploadFilesError(f"Too many images. At most {max_files} more images can be uploaded.")
+            spooled.append((name, *self._spool_stream(member, img_format)))
+
+    async def spool_archive(self, archive: BinaryIO, allowed_formats: Collection[str],
+                            max_files: int) -> tuple[list[tuple[str, UUID, Path]], list[str]]:
+        """
+        Spool the images in a zip or tar archive, one by one, without extracting the archive.
+        :param archive: The uploaded archive.
+        :param allowed_formats: The accepted image extensions. Other files in the archive are skipped.
+        :param max_files: The maximum number of images in the archive.
+        :return: The (name, ID, spooled file) of the images, and the names of the skipped files.
+        :raises TooManyUploadFilesError: If the archive contains more than max_files images. Nothing is spooled then.
+        :raises ValueError: If the archive is not supported. Nothing is spooled then.
+        """
+        spooled: list[tuple[str, UUID, Path]] = []
+        skipped: list[str] = []
+        try:
+            await asyncio.to_thread(self._spool_archive_files, archive, allowed_formats, max_files, spooled, skipped)
+        except (ValueError, OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as ex:
+            for _, _, spooled_file in spooled:
+                self.discard_spooled_file(spooled_file)
+            if isinstance(ex, TooManyUploadFilesError):
+                raise
+            raise ValueError(str(ex)) from ex
+        return spooled, skipped
+
+    def discard_spooled_file(self, spooled_file: Path):
+        """Remove a spooled file which won't be uploaded, e.g. a duplicated one."""
+        if not self._journal_path(spooled_file.stem).exists():
+            spooled_file.unlink(missing_ok=True)
+
+    def _write_journal(self, img_data: ImageData, skip_ocr: bool):
+        journal_path = self._journal_path(img_data.id)
+        temp_journal_path = journal_path.with_suffix('.json.tmp')
+        with open(temp_journal_path, 'w', encoding='utf-8') as f:
+            json.dump({'payload': img_data.payload, 'skip_ocr': skip_ocr}, f)
+        os.replace(temp_journal_path, journal_path)  # Atomic, so that a half-written entry is never replayed
+
+    async def upload_images(self, image_data: list[ImageData], skip_ocr: bool) -> list[UUID]:
+        """
+        Add spooled images to the upload queue. They are indexed in batches of config.upload.batch_size.
+        This never waits for the queue: if there isn't enough room for all the images, the spooled images are
+        discarded and UploadQueueFullError is raised.
+        :return: The IDs of the images added to the queue, without the ones which are already queued.
+        """
+        # Nothing is awaited below, so concurrent uploads of the same image can't both pass the check
+        new_images = {}
+        for img_data in image_data:
+            if self._journal_path(img_data.id).exists() or str(img_data.id) in new_images:
+                logger.warning("Image {} is already in the upload queue.", img_data.id)
+                continue
+            new_images[str(img_data.id)] = img_data
+        if not new_images:
+            return []
+        if self._queue.maxsize > 0 and self._queue.maxsize - self._queue.qsize() < len(new_images):
+            for img_data in new_images.values():
+                self.discard_spooled_file(self._spool_dir / f"{img_data.id}.{img_data.format}")
+            logger.warning("Upload queue is full. {} images rejected.", len(new_images))
+            raise UploadQueueFullError("The upload queue is full.")
+
+        for image_id, img_data in new_images.items():
+            self._write_journal(img_data, skip_ocr)
+            self._update_job(image_id, UploadJobState.queued)
+        for image_id in new_images:
+            self._queue.put_nowait(image_id)
+        logger.info("{} images added to upload queue. Queue Length: {} [+{}]",
+                    len(new_images), self._queue.qsize(), len(new_images))
+        return [t.id for t in new_images.values()]
+
+    async def upload_image(self, img_data: ImageData, skip_ocr: bool):
+        """Add a spooled image to the upload queue. See upload_images."""
+        await self.upload_images([img_data], skip_ocr)
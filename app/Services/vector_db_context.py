@@ -1,18 +1,26 @@
-from typing import Optional
+import asyncio
+import hashlib
+import random
+from typing import NamedTuple, Optional
+from uuid import UUID
 
 import numpy
+from grpc import StatusCode
 from grpc.aio import AioRpcError
 from httpx import HTTPError
 from loguru import logger
 from qdrant_client import AsyncQdrantClient
 from qdrant_client.http import models
+from qdrant_client.http.exceptions import UnexpectedResponse
 from qdrant_client.models import RecommendStrategy
 
 from app.Models.api_models.search_api_model import SearchModelEnum, SearchBasisEnum
 from app.Models.img_data import ImageData
-from app.Models.query_params import FilterParams
+from app.Models.query_params import FilterParams, PayloadFieldsParams
 from app.Models.search_result import SearchResult
-from app.config import config, QdrantMode
+from app.config import config, QdrantMode, QdrantQuantization
+from app.util import bm25
+from app.util.lru_cache import LRUCache
 from app.util.retry_deco_async import wrap_object, retry_async
 
 
@@ -22,9 +30,20 @@ class PointNotFoundError(ValueError):
         super().__init__(f"Point {point_id} not found.")
 
 
+class RandomWalkPosition(NamedTuple):
+    """Where a seeded random walk stopped, see VectorDbContext.get_random_request."""
+    bucket_bits: int  # The ID space is split into 2 ** bucket_bits buckets
+    bucket_rank: int  # The number of buckets already visited
+    index: int  # The number of points already taken from the current bucket
+
+
 class VectorDbContext:
     IMG_VECTOR = "image_vector"
     TEXT_VECTOR = "text_contain_vector"
+    OCR_SPARSE_VECTOR = "ocr_text_sparse_vector"
+    # The expected number of points in a bucket of a seeded random walk, see get_random_request
+    RANDOM_BUCKET_SIZE = 1000
+    RANDOM_BUCKET_CACHE_SIZE = 64
     AVAILABLE_POINT_TYPES = models.Record | models.ScoredPoint | models.PointStruct
 
     def __init__(self):
@@ -46,11 +65,33 @@ class VectorDbContext:
             case _:
                 raise ValueError("Invalid Qdrant mode.")
         self.collection_name = config.qdrant.coll
+        self._search_params = self._get_search_params()
+        # Whether the collection has the sparse vector of the OCR text, see check_hybrid_search
+        self.hybrid_search_enabled = False
+        # Write-behind buffer of the point inserts and payload updates, see _buffer_write
+        self._pending_writes: list[models.UpdateOperation] = []
+        self._pending_ids: set[str] = set()
+        self._flushing_ids: set[str] = set()  # The point IDs of the flush in progress
+        self._pending_count = 0
+        self._flush_lock = asyncio.Lock()
+        self._flush_timer: asyncio.TimerHandle | None = None
+        self._flush_tasks: set[asyncio.Task] = set()
+        # Where the seeded random walks stopped, so that the next page resumes there, see _scroll_random
+        self._random_walks: LRUCache[tuple, RandomWalkPosition] = LRUCache(config.query_cache.size,
+                                                                           config.query_cache.ttl)
+        self._random_buckets: LRUCache[tuple, list[str]] = LRUCache(self.RANDOM_BUCKET_CACHE_SIZE,
+                                                                    config.query_cache.ttl)
+        # Qdrant servers older than 1.11 can't sample natively, see queryRandom
+        self._sample_query_supported = True
 
     async def onload(self):
         if not await self.check_collection():
             logger.warning("Collection not found. Initializing...")
             await self.initialize_collection()
+        elif not self._local and (missing_indexes := await self.get_missing_payload_indexes()):
+            logger.warning("Payload indexes of {} are missing, filtered searches will be slow. "
+                           "Run `python main.py --migrate-db <version>` to create them.", ", ".join(missing_indexes))
+        await self.check_hybrid_search()
 
     async def retrieve_by_id(self, image_id: str, with_vectors=False) -> ImageData:
         """
@@ -59,6 +100,8 @@ class VectorDbContext:
         :param with_vectors: Whether to retrieve vectors.
         :return: The retrieved item.
         """
+        if self._is_unwritten(image_id):
+            await self.flush()
         logger.info("Retrieving item {} from database...", image_id)
         result = await self._client.retrieve(collection_name=self.collection_name,
                                              ids=[image_id],
@@ -77,6 +120,8 @@ class VectorDbContext:
         :param with_vectors: Whether to retrieve vectors.
         :return: The list of retrieved items.
         """
+        if any(self._is_unwritten(t) for t in image_id):
+            await self.flush()
         logger.info("Retrieving {} items from database...", len(image_id))
         result = await self._client.retrieve(collection_name=self.collection_name,
                                              ids=image_id,
@@ -96,23 +141,28 @@ class VectorDbContext:
         :return: The list of valid IDs.
         """
         logger.info("Validating {} items from database...", len(image_id))
+        # The buffered inserts aren't in the database yet, but they will be
+        pending_ids = [t for t in image_id if self._is_unwritten(t)]
+        image_id = [t for t in image_id if not self._is_unwritten(t)] if pending_ids else image_id
         result = await self._client.retrieve(collection_name=self.collection_name,
                                              ids=image_id,
                                              with_payload=False,
-                                             with_vectors=False)
-        return [t.id for t in result]
+                                             with_vectors=False) if image_id else []
+        return [t.id for t in result] + pending_ids
 
     async def querySearch(self, query_vector, query_vector_name: str = IMG_VECTOR,
-                          top_k=10, skip=0, filter_param: FilterParams | None = None) -> list[SearchResult]:
+                          top_k=10, skip=0, filter_param: FilterParams | None = None,
+                          payload_fields: PayloadFieldsParams | None = None) -> list[SearchResult]:
         logger.info("Querying Qdrant... top_k = {}", top_k)
         result = await self._client.search(collection_name=self.collection_name,
                                            query_vector=(query_vector_name, query_vector),
                                            query_filter=self._get_filters_by_filter_param(filter_param),
+                                           search_params=self._search_params,
                                            limit=top_k,
                                            offset=skip,
-                                           with_payload=True)
+                                           with_payload=self._get_payload_selector(payload_fields))
         logger.success("Query completed!")
-        return [self._get_search_result_from_scored_point(t) for t in result]
+        return self._get_search_results_from_scored_points(result)
 
     async def querySimilar(self,
                            query_vector_name: str = IMG_VECTOR,
@@ -123,9 +173,10 @@ class VectorDbContext:
                            with_vectors: bool = False,
                            filter_param: FilterParams | None = None,
                            top_k: int = 10,
-                           skip: int = 0) -> list[SearchResult]:
-        _positive_vectors = [t.tolist() for t in positive_vectors] if positive_vectors is not None else [search_id]
-        _negative_vectors = [t.tolist() for t in negative_vectors] if negative_vectors is not None else None
+                           skip: int = 0,
+                           payload_fields: PayloadFieldsParams | None = None) -> list[SearchResult]:
+        _positive_vectors = self._vectors_to_lists(positive_vectors) if positive_vectors is not None else [search_id]
+        _negative_vectors = self._vectors_to_lists(negative_vectors) if negative_vectors is not None else None
         _strategy = None if mode is None else (RecommendStrategy.AVERAGE_VECTOR if
                                                mode == SearchModelEnum.average else RecommendStrategy.BEST_SCORE)
         # since only combined_search need return vectors, We can define _combined_search_need_vectors like below
@@ -139,24 +190,376 @@ class VectorDbContext:
                                               strategy=_strategy,
                                               with_vectors=_combined_search_need_vectors,
                                               query_filter=self._get_filters_by_filter_param(filter_param),
+                                              search_params=self._search_params,
                                               limit=top_k,
                                               offset=skip,
-                                              with_payload=True)
+                                              with_payload=self._get_payload_selector(payload_fields))
         logger.success("Query completed!")
 
-        return [self._get_search_result_from_scored_point(t) for t in result]
+        return self._get_search_results_from_scored_points(result)
+
+    def get_search_request(self, query_vector, query_vector_name: str = IMG_VECTOR,
+                           top_k=10, skip=0, filter_param: FilterParams | None = None,
+                           payload_fields: PayloadFieldsParams | None = None) -> models.SearchRequest:
+        """Build a request for query_batch, which is equivalent to querySearch with the same arguments."""
+        vector = models.NamedVector(name=query_vector_name, vector=numpy.asarray(query_vector).tolist())
+        return models.SearchRequest(vector=vector,
+                                    filter=self._get_filters_by_filter_param(filter_param),
+                                    params=self._search_params,
+                                    limit=top_k,
+                                    offset=skip,
+                                    with_payload=self._get_payload_selector(payload_fields))
+
+    def get_similar_request(self,
+                            query_vector_name: str = IMG_VECTOR,
+                            search_id: Optional[str] = None,
+                            positive_vectors: Optional[list[numpy.ndarray]] = None,
+                            negative_vectors: Optional[list[numpy.ndarray]] = None,
+                            mode: Optional[SearchModelEnum] = None,
+                            filter_param: FilterParams | None = None,
+                            top_k: int = 10,
+                            skip: int = 0,
+                            payload_fields: PayloadFieldsParams | None = None) -> models.RecommendRequest:
+        """Build a request for query_batch, which is equivalent to querySimilar with the same arguments."""
+        _positive_vectors = self._vectors_to_lists(positive_vectors) if positive_vectors is not None else [search_id]
+        _negative_vectors = self._vectors_to_lists(negative_vectors) if negative_vectors is not None else None
+        _strategy = None if mode is None else (RecommendStrategy.AVERAGE_VECTOR if
+                                               mode == SearchModelEnum.average else RecommendStrategy.BEST_SCORE)
+        return models.RecommendRequest(positive=_positive_vectors,
+                                       negative=_negative_vectors,
+                                       strategy=_strategy,
+                                       using=query_vector_name,
+                                       filter=self._get_filters_by_filter_param(filter_param),
+                                       params=self._search_params,
+                                       limit=top_k,
+                                       offset=skip,
+                                       with_payload=self._get_payload_selector(payload_fields))
+
+    async def queryCombined(self,
+                            rerank_vector: numpy.ndarray,
+                            query_vector_name: str = IMG_VECTOR,
+                            rerank_vector_name: str = TEXT_VECTOR,
+                            positive_vectors: Optional[list[numpy.ndarray]] = None,
+                            negative_vectors: Optional[list[numpy.ndarray]] = None,
+                            mode: Optional[SearchModelEnum] = None,
+                            filter_param: FilterParams | None = None,
+                            top_k: int = 10,
+                            skip: int = 0,
+                            payload_fields: PayloadFieldsParams | None = None) -> list[SearchResult]:
+        return await self.query_request(self.get_combined_request(rerank_vector, query_vector_name, rerank_vector_name,
+                                                                  positive_vectors, negative_vectors, mode,
+                                                                  filter_param, top_k, skip, payload_fields))
+
+    def get_combined_request(self,
+                             rerank_vector: numpy.ndarray,
+                             query_vector_name: str = IMG_VECTOR,
+                             rerank_vector_name: str = TEXT_VECTOR,
+                             positive_vectors: Optional[list[numpy.ndarray]] = None,
+                             negative_vectors: Optional[list[numpy.ndarray]] = None,
+                             mode: Optional[SearchModelEnum] = None,
+                             filter_param: FilterParams | None = None,
+                             top_k: int = 10,
+                             skip: int = 0,
+                             payload_fields: PayloadFieldsParams | None = None) -> models.QueryRequest:
+        """
+        Build the request of a combined search, which is equivalent to queryCombined with the same arguments.
+        The candidates are found by the criteria vectors on query_vector_name, then ranked by their similarity to the
+        rerank_vector on rerank_vector_name, which is the score of the results. The criteria search runs once, and
+        everything runs inside Qdrant, so that no vectors are transferred.
+        """
+        _strategy = None if mode is None else (RecommendStrategy.AVERAGE_VECTOR if
+                                               mode == SearchModelEnum.average else RecommendStrategy.BEST_SCORE)
+        recommend = models.RecommendInput(positive=self._vectors_to_lists(positive_vectors or []),
+                                          negative=self._vectors_to_lists(negative_vectors or []),
+                                          strategy=_strategy)
+        criteria_prefetch = models.Prefetch(query=models.RecommendQuery(recommend=recommend),
+                                            using=query_vector_name,
+                                            filter=self._get_filters_by_filter_param(filter_param),
+                                            params=self._search_params,
+                                            limit=max(config.qdrant.combined_search_prefetch, skip + top_k))
+        return models.QueryRequest(prefetch=criteria_prefetch,
+                                   query=numpy.asarray(rerank_vector).tolist(),
+                                   using=rerank_vector_name,
+                                   limit=top_k,
+                                   offset=skip,
+                                   with_payload=self._get_payload_selector(payload_fields))
+
+    async def queryHybrid(self,
+                          prompt: str,
+                          text_vector: numpy.ndarray,
+                          filter_param: FilterParams | None = None,
+                          top_k: int = 10,
+                          skip: int = 0,
+                          payload_fields: PayloadFieldsParams | None = None) -> list[SearchResult]:
+        return await self.query_request(self.get_hybrid_request(prompt, text_vector, filter_param, top_k, skip,
+                                                                payload_fields))
+
+    def get_hybrid_request(self,
+                           prompt: str,
+                           text_vector: numpy.ndarray,
+                           filter_param: FilterParams | None = None,
+                           top_k: int = 10,
+                           skip: int = 0,
+                           payload_fields: PayloadFieldsParams | None = None) -> models.QueryRequest:
+        """
+        Build the request of a hybrid OCR search, which is equivalent to queryHybrid with the same arguments.
+        The candidates are found by both the BERT vector of the prompt and the lexical sparse vector of its terms, then
+        fused by their ranks (RRF) in a single query. Only available if hybrid_search_enabled.
+        """
+        _filter = self._get_filters_by_filter_param(filter_param)
+        limit = max(config.qdrant.hybrid_search_prefetch, skip + top_k)
+        indices, values = bm25.query_vector(prompt)
+        prefetch = [models.Prefetch(query=numpy.asarray(text_vector).tolist(),
+                                    using=self.TEXT_VECTOR,
+                                    filter=_filter,
+                                    params=self._search_params,
+                                    limit=limit),
+                    models.Prefetch(query=models.SparseVector(indices=indices, values=values),
+                                    using=self.OCR_SPARSE_VECTOR,
+                                    filter=_filter,
+                                    limit=limit)]
+        return models.QueryRequest(prefetch=prefetch,
+                                   query=models.FusionQuery(fusion=models.Fusion.RRF),
+                                   limit=top_k,
+                                   offset=skip,
+                                   with_payload=self._get_payload_selector(payload_fields))
+
+    async def queryRandom(self,
+                          seed: int | None = None,
+                          filter_param: FilterParams | None = None,
+                          top_k: int = 10,
+                          skip: int = 0,
+                          payload_fields: PayloadFieldsParams | None = None) -> list[SearchResult]:
+        """
+        Get random items. Without a seed, the items are sampled by Qdrant natively, which can't be paged, so skip must
+        be 0. Native sampling needs Qdrant 1.11 or later, on older servers a seeded walk with a random seed is used
+        instead. With a seed, the items are taken along the seeded walk of get_random_request, so the same seed gives
+        the same pages. The scores of the results are meaningless.
+        :raises ValueError: If skip is given without a seed.
+        """
+        if seed is None and skip:
+            raise ValueError("Random items without a seed can't be paged.")
+        if seed is None and self._sample_query_supported:
+            logger.info("Sampling Qdrant... top_k = {}", top_k)
+            try:
+                result = await self._client.query_points(collection_name=self.collection_name,
+                                                         query=models.SampleQuery(sample=models.Sample.RANDOM),
+                                                         query_filter=self._get_filters_by_filter_param(filter_param),
+                                                         limit=top_k,
+                                                         with_payload=self._get_payload_selector(payload_fields))
+                logger.success("Query completed!")
+                return self._get_search_results_from_scored_points(result.points)
+            except (UnexpectedResponse, AioRpcError) as ex:
+                if not self._is_unsupported_query_error(ex):
+                    raise
+                logger.warning("The Qdrant server can't sample random points, which needs Qdrant 1.11 or later. "
+                               "Falling back to seeded random walks.")
+                self._sample_query_supported = False
+        request = self.get_random_request(seed if seed is not None else random.getrandbits(64), filter_param)
+        return await self.retrieve_search_results(await self.query_candidates(request, skip, top_k), payload_fields)
 
-    async def insertItems(self, items: list[ImageData]):
-        logger.info("Inserting {} items into Qdrant...", len(items))
+    @staticmethod
+    def _is_unsupported_query_error(ex: UnexpectedResponse | AioRpcError) -> bool:
+        if isinstance(ex, UnexpectedResponse):
+            return ex.status_code in (400, 422)
+        return ex.code() in (StatusCode.INVALID_ARGUMENT, StatusCode.UNIMPLEMENTED)
+
+    def get_random_request(self, seed: int, filter_param: FilterParams | None = None) -> models.ScrollRequest:
+        """
+        Build the request of a seeded random pick, see queryRandom.
+        The point IDs are hashes of the image contents, so they are uniformly distributed. A seeded walk splits the ID
+        space into buckets of about RANDOM_BUCKET_SIZE points, visits the buckets in an order derived from the seed,
+        and the points of every bucket in the order of a seeded hash of their IDs. So every seed gives its own order,
+        while only one bucket of IDs is scrolled at a time, without a random vector or a stored random field.
+        The key of the seed is kept as the offset of the request. Where a page stopped is remembered, so the next page
+        resumes the walk from there instead of skipping the previous pages again.
+        """
+        seed_key = UUID(int=random.Random(seed).getrandbits(128))
+        return models.ScrollRequest(offset=str(seed_key), filter=self._get_filters_by_filter_param(filter_param),
+                                    with_payload=False, with_vector=False)
+
+    async def _scroll_random(self, request: models.ScrollRequest, offset: int, limit: int) -> list[tuple[str, float]]:
+        walk_key = (request.offset, request.filter.model_dump_json() if request.filter is not None else None)
+        # The next page usually starts where the previous one stopped, resume from there instead of skipping again
+        if (position := self._random_walks.get((*walk_key, offset))) is not None:
+            skip = 0
+        else:
+            skip = offset
+            # The number of buckets is kept along with the walk, so that its pages are consistent
+            if (position := self._random_walks.get((*walk_key, 0))) is None:
+                count = await self.get_counts(exact=False)
+                position = RandomWalkPosition(((count - 1) // self.RANDOM_BUCKET_SIZE).bit_length() if count else 0,
+                                              0, 0)
+                self._random_walks.put((*walk_key, 0), position)
+        logger.info("Walking Qdrant for random candidates... offset = {}, limit = {}, skip = {}",
+                    offset, limit, skip)
+        point_ids, position = await self._walk_random(request, position, skip + limit)
+        self._random_walks.put((*walk_key, offset + limit), position)
+        return [(t, 0.0) for t in point_ids[skip:]]
+
+    async def _walk_random(self, request: models.ScrollRequest, position: RandomWalkPosition,
+                           count: int) -> tuple[list[str], RandomWalkPosition]:
+        """Take count point IDs along the seeded walk from the position."""
+        bucket_bits, bucket_rank, index = position
+        point_ids = []
+        while len(point_ids) < count and bucket_rank < 1 << bucket_bits:
+            bucket_ids = await self._get_random_bucket(request, bucket_bits, bucket_rank)
+            taken = bucket_ids[index:index + count - len(point_ids)]
+            point_ids += taken
+            index += len(taken)
+            if index >= len(bucket_ids):
+                bucket_rank, index = bucket_rank + 1, 0
+        return point_ids, RandomWalkPosition(bucket_bits, bucket_rank, index)
+
+    async def _get_random_bucket(self, request: models.ScrollRequest, bucket_bits: int, bucket_rank: int) -> list[str]:
+        """Get the point IDs of the bucket visited at bucket_rank by the seeded walk, in the seeded order."""
+        seed_key = UUID(request.offset)
+        # An odd multiplier makes the affine map a permutation of the buckets
+        bucket = (((seed_key.int >> 64) | 1) * bucket_rank + (seed_key.int & ((1 << 64) - 1))) % (1 << bucket_bits)
+        cache_key = (request.offset, request.filter.model_dump_json() if request.filter is not None else None,
+                     bucket_bits, bucket)
+        if (point_ids := self._random_buckets.get(cache_key)) is not None:
+            return point_ids
+        lower, upper = bucket << (128 - bucket_bits), (bucket + 1) << (128 - bucket_bits)
+        point_ids = []
+        next_id = str(UUID(int=lower))
+        while next_id is not None and UUID(str(next_id)).int < upper:
+            points, next_id = await self._client.scroll(collection_name=self.collection_name,
+                                                        scroll_filter=request.filter,
+                                                        offset=next_id,
+                                                        limit=self.RANDOM_BUCKET_SIZE,
+                                                        with_payload=False,
+                                                        with_vectors=False)
+            point_ids += [str(t.id) for t in points if UUID(str(t.id)).int < upper]
+        point_ids.sort(key=lambda t: hashlib.blake2b(UUID(t).bytes, key=seed_key.bytes, digest_size=8).digest())
+        self._random_buckets.put(cache_key, point_ids)
+        return point_ids
+
+    async def query_request(self, request: models.SearchRequest | models.RecommendRequest | models.QueryRequest
+                            ) -> list[SearchResult]:
+        """
+        Run a request built by get_search_request, get_similar_request, get_combined_request or get_hybrid_request, so
+        that the same request can be run and then cached for paging.
+        """
+        return (await self.query_batch([request]))[0]
 
-        points = [self._get_point_from_img_data(t) for t in items]
+    async def query_batch(self, requests: list[models.SearchRequest | models.RecommendRequest | models.QueryRequest]
+                          ) -> list[list[SearchResult]]:
+        """
+        Run several search and similar requests in as few round trips as possible: all the search requests are sent
+        in one search_batch call, all the similar requests in one recommend_batch call, and all the hybrid requests in
+        one query_batch_points call, concurrently.
+        :param requests: The requests built by get_search_request, get_similar_request and get_hybrid_request.
+        :return: The results of every request, in the same order.
+        """
+        search_indexes = [i for i, t in enumerate(requests) if isinstance(t, models.SearchRequest)]
+        recommend_indexes = [i for i, t in enumerate(requests) if isinstance(t, models.RecommendRequest)]
+        query_indexes = [i for i, t in enumerate(requests) if isinstance(t, models.QueryRequest)]
+        logger.info("Querying Qdrant in batch... {} search requests, {} recommend requests, {} query requests",
+                    len(search_indexes), len(recommend_indexes), len(query_indexes))
+
+        async def search_batch():
+            if not search_indexes:
+                return []
+            return await self._client.search_batch(collection_name=self.collection_name,
+                                                   requests=[requests[i] for i in search_indexes])
+
+        async def recommend_batch():
+            if not recommend_indexes:
+                return []
+            return await self._client.recommend_batch(collection_name=self.collection_name,
+                                                      requests=[requests[i] for i in recommend_indexes])
+
+        async def query_batch_points():
+            if not query_indexes:
+                return []
+            responses = await self._client.query_batch_points(collection_name=self.collection_name,
+                                                              requests=[requests[i] for i in query_indexes])
+            return [t.points for t in responses]
+
+        search_results, recommend_results, query_results = await asyncio.gather(search_batch(), recommend_batch(),
+                                                                                query_batch_points())
+        logger.success("Query completed!")
+        results: list[list[SearchResult]] = [[] for _ in requests]
+        for i, points in zip(search_indexes + recommend_indexes + query_indexes,
+                             search_results + recommend_results + query_results):
+            results[i] = self._get_search_results_from_scored_points(points)
+        return results
+
+    async def query_candidates(self, request: models.SearchRequest | models.RecommendRequest | models.QueryRequest |
+                               models.ScrollRequest, offset: int, limit: int) -> list[tuple[str, float]]:
+        """
+        Run a request built by get_search_request, get_similar_request, get_combined_request, get_hybrid_request or
+        get_random_request for the ranked IDs and scores only.
+        :param request: The request to run. Its offset, limit and payload selection are ignored, except the start point
+                        of a random request.
+        :param offset: The number of candidates to skip.
+        :param limit: The maximum number of candidates to return.
+        :return: The list of (id, score) of the candidates, ranked by score.
+        """
+        if isinstance(request, models.ScrollRequest):
+            return await self._scroll_random(request, offset, limit)
+        update = {'offset': offset, 'limit': limit, 'with_payload': False, 'with_vector': False}
+        if isinstance(request, models.QueryRequest) and request.prefetch is not None:
+            # The prefetches must find enough candidates for the deep pages too
+            update['prefetch'] = self._raise_prefetch_limits(request.prefetch, offset + limit)
+        request = request.model_copy(update=update)
+        logger.info("Querying Qdrant for candidates... offset = {}, limit = {}", offset, limit)
+        if isinstance(request, models.QueryRequest):
+            result = (await self._client.query_batch_points(collection_name=self.collection_name,
+                                                            requests=[request]))[0].points
+        else:
+            query = self._client.search_batch if isinstance(request, models.SearchRequest) \
+                else self._client.recommend_batch
+            result = (await query(collection_name=self.collection_name, requests=[request]))[0]
+        return [(t.id, t.score) for t in result]
 
+    @classmethod
+    def _raise_prefetch_limits(cls, prefetch: models.Prefetch | list[models.Prefetch], min_limit: int
+                               ) -> models.Prefetch | list[models.Prefetch]:
+        """Copy the (nested) prefetches, with their limits raised to at least min_limit."""
+        if isinstance(prefetch, list):
+            return [cls._raise_prefetch_limits(t, min_limit) for t in prefetch]
+        update = {'limit': max(prefetch.limit or 0, min_limit)}
+        if prefetch.prefetch is not None:
+            update['prefetch'] = cls._raise_prefetch_limits(prefetch.prefetch, min_limit)
+        return prefetch.model_copy(update=update)
+
+    async def retrieve_search_results(self, candidates: list[tuple[str, float]],
+                                      payload_fields: PayloadFieldsParams | None = None) -> list[SearchResult]:
+        """
+        Retrieve the items of the given candidates as search results, in the same order.
+        The candidates no longer in the database (e.g. deleted since they were found) are skipped.
+        :param candidates: The list of (id, score) returned by query_candidates.
+        :param payload_fields: The payload fields to retrieve.
+        :return: The search results.
+        """
+        if not candidates:
+            return []
+        result = await self._client.retrieve(collection_name=self.collection_name,
+                                             ids=[t[0] for t in candidates],
+                                             with_payload=self._get_payload_selector(payload_fields),
+                                             with_vectors=False)
+        points = {t.id: t for t in result}
+        return [SearchResult(img=self._get_img_data_from_point(points[point_id]), score=score)
+                for point_id, score in candidates if point_id in points]
+
+    async def insertItems(self, items: list[ImageData]):
+        points = self._get_points_from_img_data(items, with_sparse=self.hybrid_search_enabled)
+        if config.qdrant.write_buffer_size > 0:
+            await self._buffer_write(models.UpsertOperation(upsert=models.PointsList(points=points)),
+                                     [t.id for t in points])
+            return
+
+        logger.info("Inserting {} items into Qdrant...", len(items))
         response = await self._client.upsert(collection_name=self.collection_name,
                                              wait=True,
                                              points=points)
         logger.success("Insert completed! Status: {}", response.status)
 
     async def deleteItems(self, ids: list[str]):
+        # Keep the order of the writes, so that a buffered insert won't bring the deleted items back
+        await self._flush_writes(wait=False)
         logger.info("Deleting {} items from Qdrant...", len(ids))
         response = await self._client.delete(collection_name=self.collection_name,
                                              points_selector=models.PointIdsList(
@@ -171,6 +574,10 @@ class VectorDbContext:
         Warning: This method will not update the vector of the item.
         :param new_data: The new data to update.
         """
+        if config.qdrant.write_buffer_size > 0:
+            await self._buffer_write(models.SetPayloadOperation(set_payload=models.SetPayload(
+                payload=new_data.payload, points=[str(new_data.id)])), [str(new_data.id)])
+            return
         response = await self._client.set_payload(collection_name=self.collection_name,
                                                   payload=new_data.payload,
                                                   points=[str(new_data.id)],
@@ -178,11 +585,86 @@ class VectorDbContext:
         logger.success("Update completed! Status: {}", response.status)
 
     async def updateVectors(self, new_points: list[ImageData]):
+        await self._flush_writes(wait=False)
         resp = await self._client.update_vectors(collection_name=self.collection_name,
-                                                 points=[self._get_vector_from_img_data(t) for t in new_points],
+                                                 points=self._get_point_vectors_from_img_data(
+                                                     new_points, with_sparse=self.hybrid_search_enabled),
                                                  )
         logger.success("Update vectors completed! Status: {}", resp.status)
 
+    async def flush(self):
+        """
+        Write all the buffered writes to the database, and wait until they are applied.
+        Should be called before exiting, otherwise the buffered writes are lost.
+        """
+        await self._flush_writes(wait=True)
+
+    async def _buffer_write(self, operation: models.UpdateOperation, point_ids: list[str]):
+        """
+        Add a write to the write-behind buffer. The buffer is flushed without waiting for Qdrant to apply the writes,
+        once write_buffer_size points are buffered or write_buffer_interval seconds after the first buffered write.
+        The callers which must know that the write is durable (e.g. before removing its source) should call flush.
+        """
+        last = self._pending_writes[-1] if self._pending_writes else None
+        if isinstance(operation, models.UpsertOperation) and isinstance(last, models.UpsertOperation):
+            # Coalesce the consecutive inserts into a single upsert
+            last.upsert.points.extend(operation.upsert.points)
+        else:
+            self._pending_writes.append(operation)
+        self._pending_ids.update(point_ids)
+        self._pending_count += len(point_ids)
+        if self._pending_count >= config.qdrant.write_buffer_size:
+            await self._flush_writes(wait=False)
+        else:
+            self._schedule_flush()
+
+    def _is_unwritten(self, point_id: str) -> bool:
+        """Whether the point has buffered writes which aren't written to the database yet."""
+        return point_id in self._pending_ids or point_id in self._flushing_ids
+
+    def _schedule_flush(self):
+        if self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(config.qdrant.write_buffer_interval,
+                                                                      self._on_flush_timer)
+
+    def _on_flush_timer(self):
+        self._flush_timer = None
+        task = asyncio.create_task(self._flush_writes_background())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush_writes_background(self):
+        try:
+            await self._flush_writes(wait=False)
+        except Exception as ex:
+            logger.exception("Failed to flush the buffered writes to Qdrant, will retry later: {}", ex)
+            self._schedule_flush()
+
+    async def _flush_writes(self, wait: bool):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        # The lock keeps the flushes in order
+        async with self._flush_lock:
+            if not self._pending_writes:
+                return
+            operations, self._flushing_ids, count = self._pending_writes, self._pending_ids, self._pending_count
+            self._pending_writes, self._pending_ids, self._pending_count = [], set(), 0
+            logger.info("Flushing {} buffered writes into Qdrant...", count)
+            try:
+                await self._client.batch_update_points(collection_name=self.collection_name,
+                                                       update_operations=operations,
+                                                       wait=wait)
+            except BaseException:
+                # Put the writes back before the ones buffered meanwhile, so the next flush retries them in order
+                self._pending_writes = operations + self._pending_writes
+                self._pending_ids |= self._flushing_ids
+                self._pending_count += count
+                raise
+            finally:
+                self._flushing_ids = set()
+            logger.success("Flush completed!")
+
     async def scroll_points(self,
                             from_id: str | None = None,
                             count=50,
@@ -193,7 +675,7 @@ class VectorDbContext:
                                                   with_vectors=with_vectors
                                                   )
 
-        return [self._get_img_data_from_point(t) for t in resp], next_id
+        return self._get_img_data_from_points(resp), next_id
 
     async def get_counts(self, exact: bool) -> int:
         resp = await self._client.count(collection_name=self.collection_name, exact=exact)
@@ -210,49 +692,186 @@ class VectorDbContext:
             return
         logger.info("Initializing database, collection name: {}", self.collection_name)
         vectors_config = {
-            self.IMG_VECTOR: models.VectorParams(size=768, distance=models.Distance.COSINE),
-            self.TEXT_VECTOR: models.VectorParams(size=768, distance=models.Distance.COSINE)
+            self.IMG_VECTOR: models.VectorParams(size=768, distance=models.Distance.COSINE,
+                                                 on_disk=config.qdrant.vectors_on_disk),
+            self.TEXT_VECTOR: models.VectorParams(size=768, distance=models.Distance.COSINE,
+                                                  on_disk=config.qdrant.vectors_on_disk)
         }
+        sparse_vectors_config = {
+            self.OCR_SPARSE_VECTOR: models.SparseVectorParams(
+                index=models.SparseIndexParams(on_disk=config.qdrant.vectors_on_disk),
+                modifier=models.Modifier.IDF)
+        } if config.ocr_search.hybrid_search else None
         await self._client.create_collection(collection_name=self.collection_name,
-                                             vectors_config=vectors_config)
+                                             vectors_config=vectors_config,
+                                             sparse_vectors_config=sparse_vectors_config,
+                                             on_disk_payload=config.qdrant.payload_on_disk,
+                                             hnsw_config=self._get_hnsw_config(),
+                                             quantization_config=self._get_quantization_config())
         logger.success("Collection created!")
+        await self.create_payload_indexes()
+
+    async def check_hybrid_search(self):
+        """Enable the hybrid OCR search if it's enabled in config and the collection has the sparse vector for it."""
+        self.hybrid_search_enabled = False
+        if not (config.ocr_search.enable and config.ocr_search.hybrid_search):
+            return
+        collection = await self._client.get_collection(collection_name=self.collection_name)
+        if self.OCR_SPARSE_VECTOR not in (collection.config.params.sparse_vectors or {}):
+            logger.warning("The collection has no lexical vector of the OCR text, so the hybrid OCR search is "
+                           "disabled. Re-create the collection and index the images again to enable it.")
+            return
+        self.hybrid_search_enabled = True
+
+    @staticmethod
+    def _get_payload_indexes() -> dict[str, models.PayloadSchemaType | models.TextIndexParams]:
+        """The payload indexes of all the fields used by _get_filters_by_filter_param."""
+        return {
+            "width": models.PayloadSchemaType.INTEGER,
+            "height": models.PayloadSchemaType.INTEGER,
+            "aspect_ratio": models.PayloadSchemaType.FLOAT,
+            "starred": models.PayloadSchemaType.BOOL,
+            "categories": models.PayloadSchemaType.KEYWORD,
+            "ocr_text_lower": models.TextIndexParams(type=models.TextIndexType.TEXT,
+                                                     tokenizer=models.TokenizerType(config.qdrant.ocr_text_tokenizer),
+                                                     min_token_len=config.qdrant.ocr_text_min_token_len,
+                                                     max_token_len=config.qdrant.ocr_text_max_token_len,
+                                                     lowercase=True),
+        }
+
+    async def get_missing_payload_indexes(self) -> list[str]:
+        collection = await self._client.get_collection(collection_name=self.collection_name)
+        return [t for t in self._get_payload_indexes() if t not in collection.payload_schema]
+
+    async def create_payload_indexes(self):
+        """Create the missing payload indexes. Existing indexes are kept untouched."""
+        if self._local:
+            logger.info("Payload indexes are not supported by the local Qdrant. Skipped.")
+            return
+        for field_name in await self.get_missing_payload_indexes():
+            logger.info("Creating payload index of {}...", field_name)
+            await self._client.create_payload_index(collection_name=self.collection_name,
+                                                    field_name=field_name,
+                                                    field_schema=self._get_payload_indexes()[field_name],
+                                                    wait=True)
+        logger.success("Payload indexes created!")
+
+    async def update_collection_config(self):
+        """
+        Apply the storage options in config (quantization, on-disk storage and HNSW parameters) to the existing
+        collection. Qdrant rebuilds the affected indexes in background.
+        """
+        logger.info("Updating the config of collection {}...", self.collection_name)
+        vector_config_diff = models.VectorParamsDiff(on_disk=config.qdrant.vectors_on_disk)
+        await self._client.update_collection(collection_name=self.collection_name,
+                                             vectors_config={self.IMG_VECTOR: vector_config_diff,
+                                                             self.TEXT_VECTOR: vector_config_diff},
+                                             collection_params=models.CollectionParamsDiff(
+                                                 on_disk_payload=config.qdrant.payload_on_disk),
+                                             hnsw_config=self._get_hnsw_config(),
+                                             quantization_config=self._get_quantization_config()
+                                             or models.Disabled.DISABLED)
+        logger.success("Collection config updated!")
+
+    @staticmethod
+    def _get_hnsw_config() -> models.HnswConfigDiff:
+        return models.HnswConfigDiff(m=config.qdrant.hnsw_m,
+                                     ef_construct=config.qdrant.hnsw_ef_construct,
+                                     on_disk=config.qdrant.hnsw_on_disk)
+
+    @staticmethod
+    def _get_quantization_config() -> models.QuantizationConfig | None:
+        always_ram = config.qdrant.quantization_always_ram
+        match config.qdrant.quantization:
+            case QdrantQuantization.NONE:
+                return None
+            case QdrantQuantization.SCALAR:
+                return models.ScalarQuantization(
+                    scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, always_ram=always_ram))
+            case QdrantQuantization.PRODUCT:
+                return models.ProductQuantization(
+                    product=models.ProductQuantizationConfig(
+                        compression=models.CompressionRatio(config.qdrant.product_quantization_compression),
+                        always_ram=always_ram))
+            case QdrantQuantization.BINARY:
+                return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=always_ram))
+            case _:
+                raise ValueError("Invalid quantization mode.")
+
+    @staticmethod
+    def _get_search_params() -> models.SearchParams | None:
+        quantization = None
+        if config.qdrant.quantization != QdrantQuantization.NONE:
+            # Oversampling fetches more candidates with the quantized vectors, then rescoring re-ranks them with the
+            # original vectors, which recovers most of the accuracy lost by quantization.
+            quantization = models.QuantizationSearchParams(rescore=config.qdrant.search_rescore,
+                                                           oversampling=config.qdrant.search_oversampling)
+        if quantization is None and config.qdrant.search_hnsw_ef is None:
+            return None
+        return models.SearchParams(hnsw_ef=config.qdrant.search_hnsw_ef, quantization=quantization)
+
+    @staticmethod
+    def _vectors_to_lists(vectors: list[numpy.ndarray | None]) -> list[list[float] | None]:
+        """
+        Convert a batch of vectors to the float lists accepted by the client, with a single vectorized call.
+        The client validates the vectors as lists of floats, so ndarrays can't be handed over directly.
+        """
+        indexes = [i for i, t in enumerate(vectors) if t is not None]
+        result: list[list[float] | None] = [None] * len(vectors)
+        if indexes:
+            stacked = numpy.stack([vectors[i] for i in indexes]).astype(numpy.float32, copy=False)
+            for i, row in zip(indexes, stacked.tolist()):
+                result[i] = row
+        return result
 
     @classmethod
-    def _get_vector_from_img_data(cls, img_data: ImageData) -> models.PointVectors:
-        vector = {}
-        if img_data.image_vector is not None:
-            vector[cls.IMG_VECTOR] = img_data.image_vector.tolist()
-        if img_data.text_contain_vector is not None:
-            vector[cls.TEXT_VECTOR] = img_data.text_contain_vector.tolist()
-        return models.PointVectors(
-            id=str(img_data.id),
-            vector=vector
-        )
+    def _get_vectors_from_img_data(cls, items: list[ImageData], with_sparse: bool = False
+                                   ) -> list[dict[str, list[float] | models.SparseVector]]:
+        """
+        :param with_sparse: Whether to include the lexical sparse vector of the OCR text, see check_hybrid_search.
+        """
+        img_vectors = cls._vectors_to_lists([t.image_vector for t in items])
+        text_vectors = cls._vectors_to_lists([t.text_contain_vector for t in items])
+        result = []
+        for item, img_vector, text_vector in zip(items, img_vectors, text_vectors):
+            vector = {}
+            if img_vector is not None:
+                vector[cls.IMG_VECTOR] = img_vector
+            if text_vector is not None:
+                vector[cls.TEXT_VECTOR] = text_vector
+            if with_sparse and item.ocr_text:
+                indices, values = bm25.document_vector(item.ocr_text)
+                if indices:
+                    vector[cls.OCR_SPARSE_VECTOR] = models.SparseVector(indices=indices, values=values)
+            result.append(vector)
+        return result
 
     @classmethod
-    def _get_point_from_img_data(cls, img_data: ImageData) -> models.PointStruct:
-        return models.PointStruct(
-            id=str(img_data.id),
-            payload=img_data.payload,
-            vector=cls._get_vector_from_img_data(img_data).vector
-        )
+    def _get_point_vectors_from_img_data(cls, items: list[ImageData], with_sparse: bool = False
+                                         ) -> list[models.PointVectors]:
+        # The ids and vectors are already well-formed, so skip re-validating every float of every vector
+        return [models.PointVectors.model_construct(id=str(img_data.id), vector=vector)
+                for img_data, vector in zip(items, cls._get_vectors_from_img_data(items, with_sparse))]
+
+    @classmethod
+    def _get_points_from_img_data(cls, items: list[ImageData], with_sparse: bool = False) -> list[models.PointStruct]:
+        return [models.PointStruct.model_construct(id=str(img_data.id), payload=img_data.payload, vector=vector)
+                for img_data, vector in zip(items, cls._get_vectors_from_img_data(items, with_sparse))]
 
     def _get_img_data_from_point(self, point: AVAILABLE_POINT_TYPES) -> ImageData:
-        return (ImageData
-                .from_payload(point.id,
-                              # workaround: https://github.com/qdrant/qdrant-client/issues/624
-                              point.payload.copy() if self._local else point.payload,
-                              image_vector=numpy.array(point.vector[self.IMG_VECTOR], dtype=numpy.float32)
-                              if point.vector and self.IMG_VECTOR in point.vector else None,
-                              text_contain_vector=numpy.array(point.vector[self.TEXT_VECTOR], dtype=numpy.float32)
-                              if point.vector and self.TEXT_VECTOR in point.vector else None
-                              ))
+        return ImageData.from_payload(point.id,
+                                      point.payload,
+                                      image_vector=numpy.array(point.vector[self.IMG_VECTOR], dtype=numpy.float32)
+                                      if point.vector and self.IMG_VECTOR in point.vector else None,
+                                      text_contain_vector=numpy.array(point.vector[self.TEXT_VECTOR],
+                                                                      dtype=numpy.float32)
+                                      if point.vector and self.TEXT_VECTOR in point.vector else None)
 
     def _get_img_data_from_points(self, points: list[AVAILABLE_POINT_TYPES]) -> list[ImageData]:
         return [self._get_img_data_from_point(t) for t in points]
 
-    def _get_search_result_from_scored_point(self, point: models.ScoredPoint) -> SearchResult:
-        return SearchResult(img=self._get_img_data_from_point(point), score=point.score)
+    def _get_search_results_from_scored_points(self, points: list[models.ScoredPoint]) -> list[SearchResult]:
+        return [SearchResult(img=self._get_img_data_from_point(t), score=t.score) for t in points]
 
     @classmethod
     def getVectorByBasis(cls, basis: SearchBasisEnum) -> str:
@@ -264,6 +883,16 @@ class VectorDbContext:
             case _:
                 raise ValueError("Invalid basis")
 
+    @staticmethod
+    def _get_payload_selector(payload_fields: PayloadFieldsParams | None) -> bool | models.PayloadSelector:
+        if payload_fields is None:
+            return True
+        if payload_fields.include is not None:
+            return models.PayloadSelectorInclude(include=payload_fields.include)
+        if payload_fields.exclude is not None:
+            return models.PayloadSelectorExclude(exclude=payload_fields.exclude)
+        return True
+
     @staticmethod
     def _get_filters_by_filter_param(filter_param: FilterParams | None) -> models.Filter | None:
         if filter_param is None:
@@ -14,6 +14,13 @@ class QdrantMode(str, Enum):
     MEMORY = 'memory'
 
 
+class QdrantQuantization(str, Enum):
+    NONE = 'none'
+    SCALAR = 'scalar'
+    PRODUCT = 'product'
+    BINARY = 'binary'
+
+
 class QdrantSettings(BaseModel):
     mode: QdrantMode = QdrantMode.SERVER
 
@@ -26,6 +33,31 @@ class QdrantSettings(BaseModel):
 
     local_path: str = './images_metadata'
 
+    # Collection storage and payload index options, applied on collection creation and by --migrate-db
+    quantization: QdrantQuantization = QdrantQuantization.NONE
+    quantization_always_ram: bool = True
+    product_quantization_compression: str = 'x16'
+    vectors_on_disk: bool = False
+    payload_on_disk: bool = False
+    hnsw_m: int | None = None
+    hnsw_ef_construct: int | None = None
+    hnsw_on_disk: bool = False
+    # Full-text index of the OCR text, used by the exact OCR search
+    ocr_text_tokenizer: str = 'multilingual'
+    ocr_text_min_token_len: int | None = None
+    ocr_text_max_token_len: int | None = None
+
+    # Query options
+    search_hnsw_ef: int | None = None
+    search_oversampling: float | None = None
+    search_rescore: bool = True
+    combined_search_prefetch: int = 1000
+    hybrid_search_prefetch: int = 100
+
+    # Write-behind buffer of point inserts and payload updates, 0 to write through
+    write_buffer_size: int = 0
+    write_buffer_interval: float = 1.0
+
 
 class ModelsSettings(BaseModel):
     clip: str = 'openai/clip-vit-large-patch14'
@@ -33,11 +65,29 @@ class ModelsSettings(BaseModel):
     easypaddleocr: str | None = None
 
 
+class InferenceSettings(BaseModel):
+    batch_window_ms: float = 10
+    max_batch_size: int = 16
+    max_concurrency: int = 1
+    max_queue_depth: int = 64
+    text_embedding_cache_size: int = 1024
+    text_embedding_cache_ttl: int = 3600
+
+
+class QueryCacheSettings(BaseModel):
+    size: int = 1000
+    ttl: int = 1800
+    candidate_window: int = 100
+    max_memory_mb: int = 64
+    max_offset: int = 10000
+
+
 class OCRSearchSettings(BaseModel):
     enable: bool = True
     ocr_module: str = 'easypaddleocr'
     ocr_language: list[str] = ['ch_sim', 'en']
     ocr_min_confidence: float = 1e-2
+    hybrid_search: bool = True
 
 
 class S3StorageSettings(BaseModel):
@@ -68,6 +118,19 @@ class StorageSettings(BaseModel):
     method: StorageMode = StorageMode.LOCAL
     s3: S3StorageSettings = S3StorageSettings()
     local: LocalStorageSettings = LocalStorageSettings()
+    presign_concurrency: int = 16
+    presign_cache_size: int = 10000
+
+
+class UploadSettings(BaseModel):
+    workers: int = 2
+    queue_size: int = 1000
+    retry_after: int = 10
+    spool_path: str = './upload_spool'
+    batch_size: int = 16
+    bulk_max_files: int = 1000
+    status_history_size: int = 10000
+    status_history_ttl: int = 86400
 
 
 # [Deprecated]
@@ -80,8 +143,11 @@ class Config(BaseSettings):
     qdrant: QdrantSettings = QdrantSettings()
     model: ModelsSettings = ModelsSettings()
     ocr_search: OCRSearchSettings = OCRSearchSettings()
+    inference: InferenceSettings = InferenceSettings()
+    query_cache: QueryCacheSettings = QueryCacheSettings()
     static_file: StaticFileSettings = StaticFileSettings()  # [Deprecated]
     storage: StorageSettings = StorageSettings()
+    upload: UploadSettings = UploadSettings()
 
     device: str = 'auto'
     cors_origins: set[str] = {'*'}
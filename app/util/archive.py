@@ -0,0 +1,36 @@
+import tarfile
+import zipfile
+from pathlib import PurePosixPath
+from typing import BinaryIO, Iterator
+
+
+def _is_hidden(name: str) -> bool:
+    # Skip the metadata entries added by some archivers, e.g. __MACOSX/._image.jpg
+    return any(part.startswith(('.', '__MACOSX')) for part in PurePosixPath(name).parts)
+
+
+def iter_archive_files(file: BinaryIO) -> Iterator[tuple[str, BinaryIO]]:
+    """
+    Iterate the regular files in a zip or tar (optionally compressed) archive, without extracting it to disk.
+    :param file: A seekable binary file of the archive.
+    :return: An iterator of (name, file) pairs. A file is only readable until the next one is yielded.
+    :raises ValueError: If the file isn't a supported archive.
+    """
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        with zipfile.ZipFile(file) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and not _is_hidden(info.filename):
+                    with archive.open(info) as member:
+                        yield info.filename, member
+        return
+
+    file.seek(0)
+    try:
+        archive = tarfile.open(fileobj=file, mode='r:*')
+    except tarfile.TarError as ex:
+        raise ValueError("Unsupported archive format. Only zip and tar archives are supported.") from ex
+    with archive:
+        for info in archive:
+            if info.isfile() and not _is_hidden(info.name):
+                yield info.name, archive.extractfile(info)
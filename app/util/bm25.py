@@ -0,0 +1,63 @@
+import re
+import zlib
+from collections import Counter
+
+# Words and numbers. CJK characters have no spaces between words, so their runs are split further
+_TOKEN_PATTERN = re.compile(r'[^\W_]+')
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯]+')
+
+# BM25 parameters. The IDF part is calculated by Qdrant with the IDF modifier of the sparse vector.
+K1 = 1.2
+B = 0.75
+AVERAGE_DOCUMENT_LENGTH = 32
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split a text into lowercase terms. Latin words are kept whole, and the runs of CJK characters are split into
+    single characters and bigrams of adjacent characters, so that Chinese keywords match without a word segmenter.
+    """
+    tokens = []
+    for word in _TOKEN_PATTERN.findall(text.lower()):
+        position = 0
+        for cjk in _CJK_PATTERN.finditer(word):
+            if cjk.start() > position:
+                tokens.append(word[position:cjk.start()])
+            chars = cjk.group()
+            tokens += list(chars)
+            tokens += [chars[i:i + 2] for i in range(len(chars) - 1)]
+            position = cjk.end()
+        if position < len(word):
+            tokens.append(word[position:])
+    return tokens
+
+
+def term_index(term: str) -> int:
+    """A stable index of the term in the sparse vector, by feature hashing, so no vocabulary has to be stored."""
+    return zlib.crc32(term.encode())
+
+
+def _count_terms(text: str) -> tuple[Counter[int], int]:
+    tokens = tokenize(text)
+    return Counter(term_index(t) for t in tokens), len(tokens)
+
+
+def document_vector(text: str) -> tuple[list[int], list[float]]:
+    """
+    Get the sparse vector of a document, weighted by the BM25 term frequency saturation and length normalization.
+    :return: The indices and values of the sparse vector.
+    """
+    counts, length = _count_terms(text)
+    norm = K1 * (1 - B + B * length / AVERAGE_DOCUMENT_LENGTH)
+    indices = sorted(counts)
+    return indices, [counts[i] * (K1 + 1) / (counts[i] + norm) for i in indices]
+
+
+def query_vector(text: str) -> tuple[list[int], list[float]]:
+    """
+    Get the sparse vector of a query, in which every distinct term weighs 1.
+    :return: The indices and values of the sparse vector.
+    """
+    counts, _ = _count_terms(text)
+    indices = sorted(counts)
+    return indices, [1.0] * len(indices)
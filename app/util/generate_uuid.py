@@ -1,22 +1,53 @@
 import hashlib
 import io
+import mmap
 import pathlib
+from typing import BinaryIO
 from uuid import UUID, uuid5, NAMESPACE_DNS
 
 NAMESPACE_STR = 'github.com/hv0905/NekoImageGallery'
 namespace_uuid = uuid5(NAMESPACE_DNS, NAMESPACE_STR)
 
+HASH_CHUNK_SIZE = 1024 * 1024
 
-def generate_uuid(file_input: pathlib.Path | io.BytesIO | bytes) -> UUID:
+
+class UUIDHasher:
+    """
+    Incrementally compute the UUID of a file, so that a file can be hashed chunk by chunk while it is being received.
+    The result is identical to generate_uuid on the whole content.
+    """
+
+    def __init__(self):
+        self._hash = hashlib.sha1()
+
+    def update(self, chunk: bytes | bytearray | memoryview):
+        self._hash.update(chunk)
+
+    @property
+    def uuid(self) -> UUID:
+        return uuid5(namespace_uuid, self._hash.hexdigest())
+
+
+def generate_uuid(file_input: pathlib.Path | io.BytesIO | BinaryIO | bytes) -> UUID:
+    """
+    Generate the UUID of a file from its content.
+    Paths are hashed through mmap and file-like objects are hashed in chunks, so the content is never fully copied
+    into memory.
+    """
+    hasher = UUIDHasher()
     if isinstance(file_input, pathlib.Path):
         with open(file_input, 'rb') as f:
-            file_content = f.read()
-    elif isinstance(file_input, io.BytesIO):
-        file_input.seek(0)
-        file_content = file_input.read()
+            if file_input.stat().st_size == 0:  # mmap can't map an empty file
+                return hasher.uuid
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hasher.update(mapped)
     elif isinstance(file_input, bytes):
-        file_content = file_input
+        hasher.update(file_input)
+    elif hasattr(file_input, 'read') and hasattr(file_input, 'seek'):
+        file_input.seek(0)
+        while chunk := file_input.read(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+        file_input.seek(0)
     else:
-        raise ValueError("Unsupported file type. Must be pathlib.Path or io.BytesIO.")
-    file_hash = hashlib.sha1(file_content).hexdigest()
-    return uuid5(namespace_uuid, file_hash)
+        raise ValueError("Unsupported file type. Must be pathlib.Path, bytes or a binary file-like object.")
+    return hasher.uuid
@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, Generic, Hashable, TypeVar
+
+KeyT = TypeVar('KeyT', bound=Hashable)
+ValueT = TypeVar('ValueT')
+
+
+class LRUCache(Generic[KeyT, ValueT]):
+    """
+    A bounded LRU cache with optional TTL, which also counts its hits, misses and evictions.
+    """
+
+    def __init__(self, max_size: int, ttl: float | None = None, max_weight: int | None = None,
+                 weigher: Callable[[ValueT], int] | None = None):
+        """
+        :param max_size: Maximum number of entries. A non-positive value disables the cache.
+        :param ttl: Seconds an entry stays valid after it was put. None or non-positive means never expire.
+        :param max_weight: Maximum total weight of the entries, e.g. their estimated memory usage in bytes.
+                           None or non-positive means unlimited.
+        :param weigher: Calculates the weight of a value. Required by max_weight.
+        """
+        self.max_size = max_size
+        self.ttl = ttl if ttl is not None and ttl > 0 else None
+        self.max_weight = max_weight if max_weight is not None and max_weight > 0 else None
+        if self.max_weight is not None and weigher is None:
+            raise ValueError("A weigher is required by max_weight.")
+        self._weigher = weigher
+        self._data: OrderedDict[KeyT, tuple[float, int, ValueT]] = OrderedDict()
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: KeyT) -> bool:
+        return key in self._data and not self._expired(self._data[key][0])
+
+    def _expired(self, put_time: float) -> bool:
+        return self.ttl is not None and monotonic() - put_time > self.ttl
+
+    def _remove(self, key: KeyT) -> tuple[float, int, ValueT] | None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[1]
+        return entry
+
+    def get(self, key: KeyT, default: ValueT | None = None) -> ValueT | None:
+        entry = self._data.get(key)
+        if entry is None or self._expired(entry[0]):
+            if entry is not None:
+                self._remove(key)
+                self.evictions += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key: KeyT, value: ValueT):
+        if self.max_size <= 0:
+            return
+        self._remove(key)
+        weight = self._weigher(value) if self._weigher is not None else 0
+        self._data[key] = (monotonic(), weight, value)
+        self.weight += weight
+        while len(self._data) > self.max_size or (self.max_weight is not None and self.weight > self.max_weight):
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def pop(self, key: KeyT, default: ValueT | None = None) -> ValueT | None:
+        entry = self._remove(key)
+        return default if entry is None else entry[2]
+
+    def clear(self):
+        self._data.clear()
+        self.weight = 0
@@ -0,0 +1,77 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Callable, Generic, Sequence, TypeVar
+
+from loguru import logger
+
+InputT = TypeVar('InputT')
+OutputT = TypeVar('OutputT')
+
+
+class MicroBatchScheduler(Generic[InputT, OutputT]):
+    """
+    Collect concurrent requests over a short time window (or until max_batch_size is reached), then run them through
+    batch_fn as one batch on the given executor. Every caller gets back its own element of the batch result.
+    """
+
+    def __init__(self,
+                 batch_fn: Callable[[list[InputT]], Sequence[OutputT]],
+                 executor: Executor,
+                 window: float = 0.01,
+                 max_batch_size: int = 16):
+        """
+        :param batch_fn: A blocking function that maps a list of inputs to a sequence of outputs in the same order.
+        :param executor: The executor batch_fn will be run on.
+        :param window: Seconds to wait for more requests after the first one of a batch arrived.
+        :param max_batch_size: The batch is dispatched immediately once this many requests are pending.
+        """
+        self._batch_fn = batch_fn
+        self._executor = executor
+        self._window = window
+        self._max_batch_size = max(1, max_batch_size)
+        self._pending: list[tuple[InputT, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._running_tasks: set[asyncio.Task] = set()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def submit(self, item: InputT) -> OutputT:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self._max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self._max_batch_size]
+            self._pending = self._pending[self._max_batch_size:]
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running_tasks.add(task)
+            task.add_done_callback(self._running_tasks.discard)
+
+    async def _run_batch(self, batch: list[tuple[InputT, asyncio.Future]]):
+        # Requests cancelled while waiting for the window don't need to be computed
+        batch = [t for t in batch if not t[1].done()]
+        if not batch:
+            return
+        logger.debug("Dispatching a batch of {} request(s).", len(batch))
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, self._batch_fn,
+                                                                       [t[0] for t in batch])
+        except Exception as ex:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(ex)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
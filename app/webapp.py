@@ -6,11 +6,13 @@ from typing import Annotated
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.params import Depends
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 
 import app.Controllers.admin as admin_controller
 import app.Controllers.search as search_controller
 from app.Services.authentication import permissive_access_token_verify, permissive_admin_token_verify
+from app.Services.inference_service import InferenceQueueFullError
 from app.Services.provider import ServiceProvider
 from app.config import config
 from .Models.api_response.base import WelcomeApiResponse, WelcomeApiAuthenticationResponse, \
@@ -27,6 +29,8 @@ async def lifespan(_: FastAPI):
     admin_controller.services = provider
     yield
 
+    await provider.onexit()
+
 
 app = FastAPI(lifespan=lifespan)
 init_logging()
@@ -39,6 +43,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.exception_handler(InferenceQueueFullError)
+async def inference_queue_full_handler(_: Request, exc: InferenceQueueFullError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+
 app.include_router(search_controller.search_router, prefix="/search")
 if config.admin_api_enable:
     app.include_router(admin_controller.admin_router, prefix="/admin")
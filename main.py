@@ -18,8 +18,10 @@ def parse_args():
                               "config.py. When this flag is set, will not"
                               "start the server.")
     actions.add_argument('--migrate-db', dest="migrate_from_version", type=int,
-                         help="Migrate qdrant database using connection settings in config from version specified."
-                              "When this flag is set, will not start the server.")
+                         help="Migrate qdrant database using connection settings in config from version specified, "
+                              "apply the collection storage options in config (quantization, on-disk storage, HNSW) "
+                              "to the existing collection, and create the missing payload indexes. When this flag is "
+                              "set, will not start the server.")
     actions.add_argument('--local-index', dest="local_index_target_dir", type=str,
                          help="Index all the images in this directory and copy them to "
                               "static folder set in config.py. When this flag is set, "
@@ -36,6 +38,31 @@ def parse_args():
                                 help="Root path of the server if your server is deployed behind a reverse proxy. "
                                      "See https://fastapi.tiangolo.com/advanced/behind-a-proxy/ for detail.")
 
+    local_index_options = parser.add_argument_group("Local Indexing Options")
+
+    local_index_options.add_argument('--decode-workers', type=int, default=None,
+                                     help="Number of processes used to hash and decode images while local indexing, "
+                                          "default is the number of CPU cores.")
+    local_index_options.add_argument('--ocr-workers', type=int, default=1,
+                                     help="Number of threads running OCR while local indexing, default is 1. Only "
+                                          "raise it if your OCR module is thread-safe.")
+    local_index_options.add_argument('--batch-size', type=int, default=None,
+                                     help="Number of images inferred in one batch while local indexing, default is "
+                                          "the max_batch_size in inference config.")
+    local_index_options.add_argument('--upsert-batch-size', type=int, default=256,
+                                     help="Number of images written to the database in one request while local "
+                                          "indexing, default is 256.")
+
+    local_index_options.add_argument('--journal', type=str, default=None,
+                                     help="Path of the checkpoint journal used to resume an interrupted local "
+                                          "indexing, default is local_index_journal.db next to the static folder.")
+    local_index_options.add_argument('--no-journal', action='store_true',
+                                     help="Don't use the checkpoint journal while local indexing.")
+    local_index_options.add_argument('--rescan', action='store_true',
+                                     help="Check the files recorded as indexed in the checkpoint journal against the "
+                                          "database again, and index the ones deleted from it. The recorded UUIDs "
+                                          "are reused, so the files are not hashed again.")
+
     parser.add_argument('--version', action='version', version='%(prog)s 1.0.0')
     return parser.parse_args()
 
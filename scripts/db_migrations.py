@@ -21,12 +21,15 @@ async def migrate_v1_v2():
                 # v2 migrate to a more strict approach
                 point.local = True
             await services.db_context.updatePayload(point)  # This will also store ocr_text_lower field, if present
-            if point.ocr_text is not None:
-                point.text_contain_vector = services.transformers_service.get_bert_vector(point.ocr_text_lower)
 
         logger.info("Updating vectors...")
-        # Update vectors for this group of points
-        await services.db_context.updateVectors([t for t in points if t.text_contain_vector is not None])
+        # Update vectors for this group of points, all the OCR texts are inferred in batch
+        ocr_points = [t for t in points if t.ocr_text is not None]
+        if ocr_points:
+            text_vectors = services.transformers_service.get_bert_vectors([t.ocr_text_lower for t in ocr_points])
+            for point, vector in zip(ocr_points, text_vectors):
+                point.text_contain_vector = vector
+            await services.db_context.updateVectors(ocr_points)
         if next_id is None:
             break
 
@@ -42,3 +45,8 @@ async def migrate(from_version: int):
             logger.info("Already up to date.")
         case _:
             raise ValueError(f"Unknown version {from_version}")
+    # The collection storage options (quantization, on-disk storage, HNSW) may be changed in config at any time, so
+    # they are applied on every migration, along with the payload indexes missing in older databases.
+    await services.db_context.update_collection_config()
+    await services.db_context.create_payload_indexes()
+    await services.onexit()
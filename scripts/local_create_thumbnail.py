@@ -53,4 +53,5 @@ async def main():
         await services.db_context.updatePayload(imgdata)
         logger.success("Payload for {} updated!", image_id)
 
+    await services.onexit()
     logger.success("OK. Updated {} items.", count)
@@ -0,0 +1,56 @@
+import os
+import sqlite3
+from pathlib import Path
+
+from loguru import logger
+
+
+class LocalIndexJournal:
+    """
+    A persistent checkpoint journal of local indexing, stored in a SQLite database.
+    It records the path, mtime, size, UUID and indexed status of every file, so that a restarted indexing can skip the
+    finished files (and reuse the UUIDs of the hashed ones) without reading them again.
+    An entry is only trusted if the mtime and size of the file are unchanged.
+    """
+
+    def __init__(self, journal_path: Path):
+        self._conn = sqlite3.connect(journal_path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS files ("
+                           "path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, "
+                           "uuid TEXT NOT NULL, indexed INTEGER NOT NULL DEFAULT 0)")
+        self._conn.commit()
+        logger.info("Local indexing journal opened at {}", journal_path)
+
+    @staticmethod
+    def _key(file_path: Path) -> str:
+        return str(file_path.absolute())
+
+    def lookup(self, file_path: Path, stat: os.stat_result) -> tuple[str, bool] | None:
+        """
+        Look up a file in the journal.
+        :return: (uuid, indexed) if the file is recorded and has not been modified since then, None otherwise.
+        """
+        row = self._conn.execute("SELECT mtime_ns, size, uuid, indexed FROM files WHERE path = ?",
+                                 (self._key(file_path),)).fetchone()
+        if row is None or row[0] != stat.st_mtime_ns or row[1] != stat.st_size:
+            return None
+        return row[2], bool(row[3])
+
+    def record_hashed(self, entries: list[tuple[Path, os.stat_result, str]]):
+        self._conn.executemany("INSERT OR REPLACE INTO files (path, mtime_ns, size, uuid, indexed) "
+                               "VALUES (?, ?, ?, ?, 0)",
+                               [(self._key(p), s.st_mtime_ns, s.st_size, u) for p, s, u in entries])
+        self._conn.commit()
+
+    def mark_indexed(self, file_paths: list[Path]):
+        self._conn.executemany("UPDATE files SET indexed = 1 WHERE path = ?",
+                               [(self._key(t),) for t in file_paths])
+        self._conn.commit()
+
+    def reset_indexed(self):
+        """Forget the indexed status of all files, while keeping their UUIDs."""
+        self._conn.execute("UPDATE files SET indexed = 0")
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
@@ -1,6 +1,10 @@
-import uuid
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import partial
 from pathlib import Path
+from typing import Awaitable, Callable
 
 import PIL
 from PIL import Image
@@ -8,77 +12,212 @@ from loguru import logger
 
 from app.Models.img_data import ImageData
 from app.Services.provider import ServiceProvider
-from app.util.generate_uuid import generate_uuid
-from .local_utility import fetch_path_uuid_list
+from app.config import config
+from .local_index_journal import LocalIndexJournal
+from .local_utility import calculate_uuid
+
+# The local indexing runs as a pipeline of stages connected by bounded queues:
+#   list files -> hash & decode (process pool) -> CLIP -> OCR & BERT -> batched upsert & copy
+# Every stage works on a different batch at the same time, so all the cores can be kept busy.
+# `None` is put into a queue to mark the end of the stream. If a stage fails, the other stages are cancelled.
 
 overall_count = 0
+skipped_count = 0
 
 services: ServiceProvider | None = None
+journal: LocalIndexJournal | None = None
+
+IndexItem = tuple[Path, Image.Image | None, ImageData]
 
 
-async def copy_and_index(file_path: Path, uuid_str: str = None):
-    global overall_count
-    overall_count += 1
-    logger.info("[{}] Indexing {}", str(overall_count), str(file_path))
+def _decode_image(file_path: Path) -> Image.Image | None:
+    """Runs in the worker processes. Fully decode the image and convert it to RGB for the inference stages."""
     try:
-        img = Image.open(file_path)
-    except PIL.UnidentifiedImageError as e:
+        with Image.open(file_path) as img:
+            img.load()
+            return img.convert('RGB') if img.mode != 'RGB' else img.copy()
+    except (PIL.UnidentifiedImageError, OSError) as e:
         logger.error("Error when opening image {}: {}", file_path, e)
-        return
-    image_id = uuid.UUID(uuid_str) if uuid_str else generate_uuid(file_path)
-    img_ext = file_path.suffix
-    imgdata = ImageData(id=image_id,
-                        url=await services.storage_service.active_storage.url(f'{image_id}{img_ext}'),
-                        index_date=datetime.now(),
-                        format=img_ext[1:],
-                        local=True)
+        return None
+
+
+async def _run_stage(in_queue: asyncio.Queue, out_queue: asyncio.Queue | None,
+                     handler: Callable[[list], Awaitable[list | None]], workers: int = 1):
+    async def worker():
+        while (batch := await in_queue.get()) is not None:
+            result = await handler(batch)
+            if result and out_queue is not None:
+                await out_queue.put(result)
+        await in_queue.put(None)  # Let the other workers of this stage see the end of the stream
+
+    await asyncio.gather(*[worker() for _ in range(workers)])
+    if out_queue is not None:
+        await out_queue.put(None)
+
+
+async def _run_pipeline(*stages: Awaitable):
+    """Run all the stages. Once a stage fails, cancel the others, which would otherwise wait on their queues forever."""
+    tasks = [asyncio.ensure_future(t) for t in stages]
     try:
-        # This has already been checked for duplicated, so there's no need to double-check.
-        await services.index_service.index_image(img, imgdata, skip_duplicate_check=True)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _run_with_fallback(items: list[IndexItem], func: Callable[[list[Image.Image], list[ImageData]], None],
+                             stage: str) -> list[IndexItem]:
+    """Run func on the batch in a worker thread. If the batch fails, retry one by one and drop the broken images."""
+    try:
+        await asyncio.to_thread(func, [t[1] for t in items], [t[2] for t in items])
+        return items
     except Exception as e:
-        logger.error("Error when processing image {}: {}", file_path, e)
-        return
-    # copy to static
-    await services.storage_service.active_storage.upload(file_path, f'{image_id}{img_ext}')
+        if len(items) == 1:
+            logger.error("Error when processing image {} in {} stage: {}", items[0][0], stage, e)
+            return []
+        logger.warning("Error when processing a batch of {} images in {} stage: {}. Retry one by one.",
+                       len(items), stage, e)
+    return [itm for item in items for itm in await _run_with_fallback([item], func, stage)]
+
+
+async def _list_files(root: Path, out_queue: asyncio.Queue, batch_size: int):
+    async for itm in services.storage_service.local_storage.list_files(root, batch_max_files=batch_size):
+        await out_queue.put(itm)
+    await out_queue.put(None)
+
 
+async def _hash_and_decode(file_paths: list[Path], pool: ProcessPoolExecutor,
+                           check_duplicate: bool) -> list[IndexItem]:
+    global overall_count, skipped_count
+    loop = asyncio.get_running_loop()
+    uuids = {}
+    to_hash = []
+    for file_path in file_paths:
+        stat = file_path.stat()
+        if journal is not None and (recorded := journal.lookup(file_path, stat)) is not None:
+            if recorded[1]:  # Already indexed, skip it without reading the file
+                skipped_count += 1
+                continue
+            uuids[file_path] = recorded[0]
+        else:
+            to_hash.append((file_path, stat))
+    if to_hash:
+        hashed = await asyncio.gather(*[loop.run_in_executor(pool, calculate_uuid, t[0]) for t in to_hash])
+        if journal is not None:
+            journal.record_hashed([(p, st, u) for (p, st), u in zip(to_hash, hashed)])
+        uuids.update((p, u) for (p, _), u in zip(to_hash, hashed))
+    if check_duplicate and uuids:
+        duplicate_uuids = set(await services.db_context.validate_ids(list(uuids.values())))
+        if duplicate_uuids:
+            logger.info("Found {} duplicate points in the database. The remaining {} points will be indexed.",
+                        len(duplicate_uuids), len(uuids) - len(duplicate_uuids))
+            if journal is not None:
+                journal.mark_indexed([p for p, u in uuids.items() if u in duplicate_uuids])
+            uuids = {p: u for p, u in uuids.items() if u not in duplicate_uuids}
+    images = await asyncio.gather(*[loop.run_in_executor(pool, _decode_image, t) for t in uuids])
+    items = []
+    for (file_path, image_id), img in zip(uuids.items(), images):
+        if img is None:
+            continue
+        overall_count += 1
+        logger.info("[{}] Indexing {}", str(overall_count), str(file_path))
+        items.append((file_path, img, ImageData(id=image_id,
+                                                url=await services.storage_service.active_storage.url(
+                                                    f'{image_id}{file_path.suffix}'),
+                                                index_date=datetime.now(),
+                                                format=file_path.suffix[1:],
+                                                width=img.width,
+                                                height=img.height,
+                                                aspect_ratio=float(img.width) / img.height,
+                                                local=True)))
+    return items
 
-async def copy_and_index_batch(file_path_list: list[tuple[Path, str]]):
-    for file_path_uuid_tuple in file_path_list:
-        await copy_and_index(file_path_uuid_tuple[0], uuid_str=file_path_uuid_tuple[1])
+
+async def _clip_stage(items: list[IndexItem], batch_size: int) -> list[IndexItem]:
+    return await _run_with_fallback(items, partial(services.index_service.prepare_image_vectors,
+                                                   batch_size=batch_size), "CLIP")
+
+
+async def _ocr_stage(items: list[IndexItem], batch_size: int) -> list[IndexItem]:
+    if config.ocr_search.enable:
+        items = await _run_with_fallback(items, partial(services.index_service.prepare_ocr_texts,
+                                                        batch_size=batch_size), "OCR")
+    # The decoded images are no longer needed, release them as early as possible
+    return [(file_path, None, imgdata) for file_path, _, imgdata in items]
+
+
+async def _upsert_stage(in_queue: asyncio.Queue, upsert_batch_size: int):
+    pending: list[IndexItem] = []
+
+    async def flush():
+        # This has already been checked for duplicated, so there's no need to double-check.
+        await services.db_context.insertItems([t[2] for t in pending])
+        # The inserts may be buffered, make sure they are written before marking them as indexed
+        await services.db_context.flush()
+        # copy to static
+        for file_path, _, imgdata in pending:
+            await services.storage_service.active_storage.upload(file_path, f'{imgdata.id}{file_path.suffix}')
+        if journal is not None:
+            journal.mark_indexed([t[0] for t in pending])
+        pending.clear()
+
+    while (batch := await in_queue.get()) is not None:
+        pending += batch
+        if len(pending) >= upsert_batch_size:
+            await flush()
+    if pending:
+        await flush()
 
 
 @logger.catch()
 async def main(args):
-    global services
+    global services, journal
     services = ServiceProvider()
     await services.onload()
     root = Path(args.local_index_target_dir)
+    batch_size = args.batch_size or config.inference.max_batch_size
+    decode_workers = args.decode_workers or os.cpu_count() or 1
+    logger.info("Local indexing with {} decode workers, {} OCR workers, batch size {}, upsert batch size {}.",
+                decode_workers, args.ocr_workers, batch_size, args.upsert_batch_size)
+
     # First, check if the database is empty
     item_number = await services.db_context.get_counts(exact=False)
     if item_number == 0:
-        # database is empty, do as usual
         logger.warning("The database is empty, Will not check for duplicate points.")
-        async for item in services.storage_service.local_storage.list_files(root, batch_max_files=1):
-            await copy_and_index(item[0])
     else:
-        # database is not empty, check for duplicate points
         logger.warning("The database is not empty, Will check for duplicate points.")
-        async for itm in services.storage_service.local_storage.list_files(root, batch_max_files=5000):
-            local_file_path_with_uuid_list = fetch_path_uuid_list(itm)
-            local_file_uuid_list = [itm[1] for itm in local_file_path_with_uuid_list]
-            duplicate_uuid_list = await services.db_context.validate_ids(local_file_uuid_list)
-            if len(duplicate_uuid_list) > 0:
-                duplicate_uuid_list = set(duplicate_uuid_list)
-                local_file_path_with_uuid_list = [item for item in local_file_path_with_uuid_list
-                                                  if item[1] not in duplicate_uuid_list]
-                logger.info("Found {} duplicate points, of which {} are duplicates in the database. "
-                            "The remaining {} points will be indexed.",
-                            len(itm) - len(local_file_path_with_uuid_list), len(duplicate_uuid_list),
-                            len(local_file_path_with_uuid_list))
-            else:
-                logger.info("Found {} duplicate points, of which {} are duplicates in the database."
-                            " The remaining {} points will be indexed.",
-                            0, 0, len(local_file_path_with_uuid_list))
-            await copy_and_index_batch(local_file_path_with_uuid_list)
-
-    logger.success("Indexing completed! {} images indexed", overall_count)
+
+    if not args.no_journal:
+        journal_path = Path(args.journal) if args.journal \
+            else Path(config.storage.local.path).absolute().parent / 'local_index_journal.db'
+        journal = LocalIndexJournal(journal_path)
+        if item_number == 0 or args.rescan:
+            # The journal doesn't belong to this database, or some indexed images may have been deleted from it. The
+            # recorded UUIDs are still valid, and the duplicate check will find the images which are still indexed.
+            journal.reset_indexed()
+
+    # Bounded queues, so that the decoded images waiting for inference won't grow without limit
+    decode_concurrency = max(decode_workers // batch_size, 1) + 1
+    file_queue = asyncio.Queue(2 * decode_concurrency)
+    decoded_queue = asyncio.Queue(2)
+    clip_queue = asyncio.Queue(2 * args.ocr_workers)
+    ocr_queue = asyncio.Queue(2)
+    try:
+        with ProcessPoolExecutor(max_workers=decode_workers) as pool:
+            async def decode(file_paths: list[Path]):
+                return await _hash_and_decode(file_paths, pool, item_number != 0)
+
+            await _run_pipeline(
+                _list_files(root, file_queue, batch_size),
+                # Several batches are decoded at the same time to keep all the decode workers busy
+                _run_stage(file_queue, decoded_queue, decode, workers=decode_concurrency),
+                _run_stage(decoded_queue, clip_queue, partial(_clip_stage, batch_size=batch_size)),
+                _run_stage(clip_queue, ocr_queue, partial(_ocr_stage, batch_size=batch_size), workers=args.ocr_workers),
+                _upsert_stage(ocr_queue, args.upsert_batch_size))
+    finally:
+        await services.onexit()
+        if journal is not None:
+            journal.close()
+    logger.success("Indexing completed! {} images indexed, {} images skipped as already indexed.",
+                   overall_count, skipped_count)
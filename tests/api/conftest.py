@@ -18,6 +18,7 @@ config.config.storage.method = config.StorageMode.LOCAL
 def test_client(tmp_path_factory) -> TestClient:
     # Modify the configuration for testing
     config.config.storage.local.path = tmp_path_factory.mktemp("static_files")
+    config.config.upload.spool_path = tmp_path_factory.mktemp("upload_spool")
 
     from app.webapp import app
     # Start the application
@@ -31,12 +31,24 @@ async def test_integrate(test_client):
 
     print('Waiting for images to be processed...')
 
+    all_ids = [img_id for ids in img_ids.values() for img_id in ids]
     while True:
-        resp = test_client.get('/admin/server_info', headers=credentials)
-        if resp.json()['image_count'] >= 7:
+        resp = test_client.post('/admin/upload/status', json={'image_ids': all_ids}, headers=credentials)
+        assert resp.status_code == 200
+        assert not resp.json()['not_found']
+        states = [t['state'] for t in resp.json()['statuses']]
+        assert 'failed' not in states
+        if all(t == 'done' for t in states):
             break
         await asyncio.sleep(1)
 
+    resp = test_client.get(f"/admin/upload/status/{all_ids[0]}", headers=credentials)
+    assert resp.status_code == 200
+    assert set(resp.json()['status']['stage_durations']) == {'queued', 'indexing', 'storing'}
+
+    resp = test_client.get('/admin/server_info', headers=credentials)
+    assert resp.json()['image_count'] == 7
+
     resp = test_client.get('/search/text/hatsune+miku',
                            headers=credentials)
     assert resp.status_code == 200
@@ -66,3 +78,71 @@ async def test_integrate(test_client):
     resp = test_client.get(f"/search/text/cat", params={'starred': True}, headers=credentials)
     assert resp.status_code == 200
     assert resp.json()['result'][0]['img']['id'] in img_ids['bsn']
+
+    resp = test_client.get(f"/search/text/cat", params={'starred': True, 'fields': 'url, width'}, headers=credentials)
+    assert resp.status_code == 200
+    img = resp.json()['result'][0]['img']
+    assert img['url'] is not None and img['width'] is not None
+    # The fields which are not selected are left out, instead of being returned as their defaults
+    assert not {'height', 'starred', 'categories', 'ocr_text', 'ocr_text_lower'} & set(img)
+
+    resp = test_client.get(f"/search/text/cat", params={'fields': 'vector'}, headers=credentials)
+    assert resp.status_code == 422
+
+    resp = test_client.post('/search/batch', json={'queries': [
+        {'type': 'text', 'prompt': 'hatsune miku'},
+        {'type': 'similar', 'image_id': img_ids['bsn'][0]},
+        {'type': 'advanced', 'criteria': ['cat']}]}, headers=credentials)
+    assert resp.status_code == 200
+    results = [t['result'] for t in resp.json()['results']]
+    assert results[0][0]['img']['id'] in img_ids['cg']
+    assert results[1][0]['img']['id'] in img_ids['bsn']
+    assert len(results[2]) > 0
+
+    # Page through all the images with the cursors, the pages should match the full ranking
+    resp = test_client.get('/search/text/cat', params={'count': 10, 'fields': 'url'}, headers=credentials)
+    assert resp.status_code == 200
+    assert resp.json()['next_cursor'] is None
+    full_ranking = [t['img']['id'] for t in resp.json()['result']]
+    resp = test_client.get('/search/text/cat', params={'count': 3, 'fields': 'url'}, headers=credentials)
+    paged_ranking = [t['img']['id'] for t in resp.json()['result']]
+    while cursor := resp.json()['next_cursor']:
+        resp = test_client.get(f'/search/cursor/{cursor}', headers=credentials)
+        assert resp.status_code == 200
+        paged_ranking += [t['img']['id'] for t in resp.json()['result']]
+        assert all('height' not in t['img'] for t in resp.json()['result'])
+    assert paged_ranking == full_ranking
+
+    resp = test_client.get('/search/cursor/invalid', headers=credentials)
+    assert resp.status_code == 422
+
+    resp = test_client.get('/search/text/cat', params={'count': 3}, headers=credentials)
+    first_page = resp.json()
+    resp = test_client.get(f"/search/recall/{first_page['query_id']}", headers=credentials)
+    assert resp.status_code == 200
+    assert resp.json()['result'] == first_page['result']
+    assert resp.json()['next_cursor'] == first_page['next_cursor']
+    resp = test_client.get('/search/recall/00000000-0000-0000-0000-000000000000', headers=credentials)
+    assert resp.status_code == 404
+
+    resp = test_client.post('/search/combined', json={'criteria': ['cat'], 'extra_prompt': 'cat'},
+                            params={'count': 3}, headers=credentials)
+    assert resp.status_code == 200
+    scores = [t['score'] for t in resp.json()['result']]
+    assert len(scores) == 3 and scores == sorted(scores, reverse=True)
+    assert resp.json()['next_cursor'] is not None
+    resp = test_client.get(f"/search/cursor/{resp.json()['next_cursor']}", headers=credentials)
+    assert resp.status_code == 200
+
+    resp = test_client.get('/search/random', params={'count': 3}, headers=credentials)
+    assert resp.status_code == 200
+    assert len(resp.json()['result']) == 3 and resp.json()['next_cursor'] is None
+    # A seeded random pick gives the same pages, which can be paged by the cursors
+    resp = test_client.get('/search/random', params={'count': 3, 'seed': 42}, headers=credentials)
+    random_ids = [t['img']['id'] for t in resp.json()['result']]
+    while cursor := resp.json()['next_cursor']:
+        resp = test_client.get(f'/search/cursor/{cursor}', headers=credentials)
+        random_ids += [t['img']['id'] for t in resp.json()['result']]
+    assert sorted(random_ids) == sorted(full_ranking)
+    resp = test_client.get('/search/random', params={'count': 3, 'seed': 42, 'skip': 3}, headers=credentials)
+    assert [t['img']['id'] for t in resp.json()['result']] == random_ids[3:6]
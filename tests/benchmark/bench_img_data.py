@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of building ImageData from the payloads and vectors returned by Qdrant. It compares the previous
+from_payload, the current one (a single model_validate), and the trusted path asked for by the performance review:
+only the id and the index_date are parsed and the rest is taken by model_construct. The vectors are converted by
+numpy.array, and by numpy.frombuffer over an array.array, since the client returns them as lists of floats.
+Run with `python -m tests.benchmark.bench_img_data`. The timings are noisy, run it several times.
+"""
+import array
+import timeit
+from datetime import datetime
+from uuid import UUID, uuid4
+
+import numpy
+
+from app.Models.img_data import ImageData
+
+POINT_COUNT = 100
+REPEAT = 50
+
+
+def _make_points() -> list[tuple[str, dict, list[float]]]:
+    rng = numpy.random.default_rng(0)
+    points = []
+    for _ in range(POINT_COUNT):
+        img_data = ImageData(id=uuid4(), url='/static/test.jpg', ocr_text='Some OCR text ' * 50, width=1920,
+                             height=1080, aspect_ratio=1920 / 1080, categories=['cg', 'stickers'],
+                             index_date=datetime.now(), local=True, format='jpg')
+        points.append((str(img_data.id), img_data.payload, rng.random(768, dtype=numpy.float32).tolist()))
+    return points
+
+
+def _baseline(point_id: str, payload: dict) -> ImageData:
+    """The previous from_payload, which had to be given a copy of the payload, since it modified it."""
+    payload = payload.copy()
+    index_date = datetime.fromisoformat(payload['index_date'])
+    del payload['index_date']
+    return ImageData(id=UUID(point_id), index_date=index_date, **payload)
+
+
+def _trusted(point_id: str, payload: dict) -> ImageData:
+    """Parse only the id and the index_date, and take the rest of the payload written by the application as it is."""
+    values = {k: v for k, v in payload.items() if k in ImageData.model_fields}
+    values['index_date'] = datetime.fromisoformat(values['index_date'])
+    return ImageData.model_construct(id=UUID(point_id), **values)
+
+
+def _measure(func, points) -> float:
+    return min(timeit.repeat(lambda: [func(*t) for t in points], number=REPEAT, repeat=5)) / REPEAT
+
+
+def main():
+    points = _make_points()
+    payloads = [t[:2] for t in points]
+    expected = [_baseline(*t).model_dump() for t in payloads]
+    assert [ImageData.from_payload(*t).model_dump() for t in payloads] == expected
+    assert [_trusted(*t).model_dump() for t in payloads] == expected
+
+    baseline_time = _measure(_baseline, payloads)
+    for name, func in (("model_validate (current)", ImageData.from_payload), ("trusted model_construct", _trusted)):
+        func_time = _measure(func, payloads)
+        print(f"{POINT_COUNT} payloads, {name}: {func_time * 1000:.3f} ms ({baseline_time / func_time:.2f}x of "
+              f"the previous {baseline_time * 1000:.3f} ms)")
+
+    vectors = [(t[2],) for t in points]
+    array_time = _measure(lambda t: numpy.array(t, dtype=numpy.float32), vectors)
+    buffer_time = _measure(lambda t: numpy.frombuffer(array.array('f', t), dtype=numpy.float32), vectors)
+    print(f"{POINT_COUNT} vectors, numpy.array (current): {array_time * 1000:.3f} ms, "
+          f"numpy.frombuffer: {buffer_time * 1000:.3f} ms ({array_time / buffer_time:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
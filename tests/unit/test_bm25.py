@@ -0,0 +1,24 @@
+from app.util.bm25 import tokenize, term_index, document_vector, query_vector
+
+
+class TestBM25:
+    def test_tokenize(self):
+        assert tokenize("Hello, World_2024!") == ['hello', 'world', '2024']
+        # The CJK runs are split into characters and bigrams, even when mixed with latin characters
+        assert tokenize("初音ミクv4") == ['初', '音', 'ミ', 'ク', '初音', '音ミ', 'ミク', 'v4']
+        assert tokenize("") == []
+
+    def test_document_vector(self):
+        indices, values = document_vector("cat cat dog")
+        assert indices == sorted([term_index('cat'), term_index('dog')])
+        weights = dict(zip(indices, values))
+        # The term frequency is saturated, a repeated term weighs more but less than twice
+        assert weights[term_index('dog')] < weights[term_index('cat')] < 2 * weights[term_index('dog')]
+        # A term weighs less in a longer document
+        long_indices, long_values = document_vector("dog " + " ".join(f"word{i}" for i in range(50)))
+        assert dict(zip(long_indices, long_values))[term_index('dog')] < weights[term_index('dog')]
+
+    def test_query_vector(self):
+        indices, values = query_vector("Cat cat DOG")
+        assert indices == sorted([term_index('cat'), term_index('dog')])
+        assert values == [1.0, 1.0]
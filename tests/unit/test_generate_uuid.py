@@ -0,0 +1,29 @@
+import hashlib
+import io
+from pathlib import Path
+from uuid import uuid5
+
+from app.util.generate_uuid import generate_uuid, namespace_uuid, UUIDHasher
+
+assets_path = Path(__file__).parent / '..' / 'assets' / 'test_images'
+
+
+class TestGenerateUUID:
+    def test_uuid_identical_for_all_inputs(self):
+        file_path = assets_path / 'cg_1.png'
+        content = file_path.read_bytes()
+        expected = uuid5(namespace_uuid, hashlib.sha1(content).hexdigest())
+        assert generate_uuid(file_path) == expected
+        assert generate_uuid(content) == expected
+        assert generate_uuid(io.BytesIO(content)) == expected
+        with open(file_path, 'rb') as f:
+            assert generate_uuid(f) == expected
+        hasher = UUIDHasher()
+        for i in range(0, len(content), 4096):
+            hasher.update(content[i:i + 4096])
+        assert hasher.uuid == expected
+
+    def test_empty_file(self, tmp_path):
+        empty_file = tmp_path / 'empty.jpg'
+        empty_file.touch()
+        assert generate_uuid(empty_file) == generate_uuid(b'')
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from app.Services.inference_service import InferenceService, InferenceQueueFullError
+from app.config import config
+
+
+class FakeTransformersService:
+    def __init__(self):
+        self.inferred_texts = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def get_text_vectors(self, texts: list[str]) -> np.ndarray:
+        self.release.wait()
+        self.inferred_texts += texts
+        return np.ones((len(texts), 768), dtype=np.float32)
+
+    get_bert_vectors = get_text_vectors
+
+    def get_image_vectors(self, images) -> np.ndarray:
+        return self.get_text_vectors(images)
+
+
+class TestInferenceService:
+    @pytest.mark.asyncio
+    async def test_text_embedding_cache(self):
+        transformers_service = FakeTransformersService()
+        service = InferenceService(transformers_service)
+        vector = await service.get_text_vector('1girl')
+        assert vector.shape == (768,)
+        vector[0] = 0  # The caller may modify the returned vector, which should not affect the cache
+        assert (await service.get_text_vector('  1GIRL ') == 1).all()
+        await service.get_bert_vector('1girl')
+        assert transformers_service.inferred_texts == ['1girl', '1girl']
+        cache = service.text_embedding_cache
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    @pytest.mark.asyncio
+    async def test_reject_when_saturated(self, monkeypatch):
+        monkeypatch.setattr(config.inference, 'max_queue_depth', 2)
+        transformers_service = FakeTransformersService()
+        transformers_service.release.clear()
+        service = InferenceService(transformers_service)
+        pending = [asyncio.create_task(service.get_text_vector(t)) for t in ('a', 'b')]
+        await asyncio.sleep(0)
+        assert service.in_flight_count == 2
+        with pytest.raises(InferenceQueueFullError):
+            await service.get_text_vector('c')
+        transformers_service.release.set()
+        await asyncio.gather(*pending)
+        assert service.in_flight_count == 0
+
+    @pytest.mark.asyncio
+    async def test_shutdown(self):
+        service = InferenceService(FakeTransformersService())
+        await service.get_text_vector('a')
+        service.shutdown()
+        with pytest.raises(RuntimeError):
+            await service.get_text_vector('b')
@@ -0,0 +1,44 @@
+from time import sleep
+
+from app.util.lru_cache import LRUCache
+
+
+class TestLRUCache:
+    def test_lru_eviction(self):
+        cache = LRUCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1  # 'b' is now the least recently used one
+        cache.put('c', 3)
+        assert 'b' not in cache
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert cache.get('b') is None
+        assert (cache.hits, cache.misses, cache.evictions) == (3, 1, 1)
+
+    def test_ttl(self):
+        cache = LRUCache(max_size=2, ttl=0.05)
+        cache.put('a', 1)
+        assert cache.get('a') == 1
+        sleep(0.1)
+        assert cache.get('a') is None
+        assert len(cache) == 0
+        assert cache.evictions == 1
+
+    def test_disabled(self):
+        cache = LRUCache(max_size=0)
+        cache.put('a', 1)
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+    def test_max_weight(self):
+        cache = LRUCache(max_size=10, max_weight=10, weigher=len)
+        cache.put('a', 'x' * 4)
+        cache.put('b', 'x' * 4)
+        cache.put('a', 'x' * 2)  # Replacing an entry updates the total weight
+        assert cache.weight == 6
+        cache.put('c', 'x' * 5)
+        assert 'b' not in cache and 'a' in cache
+        assert cache.weight == 7
+        cache.put('d', 'x' * 11)  # Heavier than the whole cache
+        assert len(cache) == 0 and cache.weight == 0
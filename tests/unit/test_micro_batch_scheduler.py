@@ -0,0 +1,42 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.util.micro_batch_scheduler import MicroBatchScheduler
+
+
+class TestMicroBatchScheduler:
+    def setup_method(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batches = []
+
+    def teardown_method(self):
+        self.executor.shutdown()
+
+    def batch_fn(self, items: list[int]) -> list[int]:
+        self.batches.append(items)
+        return [t * 2 for t in items]
+
+    @pytest.mark.asyncio
+    async def test_requests_in_window_are_batched(self):
+        scheduler = MicroBatchScheduler(self.batch_fn, self.executor, window=0.05, max_batch_size=16)
+        results = await asyncio.gather(*[scheduler.submit(i) for i in range(5)])
+        assert results == [0, 2, 4, 6, 8]
+        assert self.batches == [[0, 1, 2, 3, 4]]
+
+    @pytest.mark.asyncio
+    async def test_max_batch_size(self):
+        scheduler = MicroBatchScheduler(self.batch_fn, self.executor, window=10, max_batch_size=2)
+        results = await asyncio.wait_for(asyncio.gather(*[scheduler.submit(i) for i in range(4)]), 1)
+        assert results == [0, 2, 4, 6]
+        assert self.batches == [[0, 1], [2, 3]]
+
+    @pytest.mark.asyncio
+    async def test_exception_propagated(self):
+        def failing_batch_fn(_):
+            raise RuntimeError("inference failed")
+
+        scheduler = MicroBatchScheduler(failing_batch_fn, self.executor, window=0.01)
+        with pytest.raises(RuntimeError):
+            await scheduler.submit(1)
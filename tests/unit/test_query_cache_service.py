@@ -0,0 +1,102 @@
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from qdrant_client.http import models
+
+from app.Models.img_data import ImageData
+from app.Models.search_result import SearchResult
+from app.Services.query_cache_service import QueryCacheService, QueryNotFoundError
+from app.config import config
+
+
+class FakeDbContext:
+    def __init__(self, count: int):
+        self.ranking = [(str(uuid4()), 1 - i / count) for i in range(count)]
+        self.candidate_queries = []
+
+    async def query_candidates(self, request, offset, limit):
+        self.candidate_queries.append((offset, limit))
+        return self.ranking[offset:offset + limit]
+
+    async def retrieve_search_results(self, candidates, payload_fields=None):
+        return [SearchResult(img=ImageData(id=t[0], local=False, index_date=datetime.now()), score=t[1])
+                for t in candidates]
+
+
+class TestQueryCacheService:
+    @pytest.fixture(autouse=True)
+    def candidate_window(self, monkeypatch):
+        monkeypatch.setattr(config.query_cache, 'candidate_window', 4)
+
+    @staticmethod
+    async def _first_page(service: QueryCacheService, db_context: FakeDbContext, count: int):
+        request = models.SearchRequest(vector=[1.0], limit=count)
+        results = await db_context.retrieve_search_results(db_context.ranking[:count])
+        return service.add_query(results, 0, count, request=request)
+
+    @pytest.mark.asyncio
+    async def test_paging(self):
+        db_context = FakeDbContext(11)
+        service = QueryCacheService(db_context)
+        query_id, cursor = await self._first_page(service, db_context, 3)
+        pages = []
+        while cursor is not None:
+            page_query_id, results, cursor = await service.get_page(cursor)
+            assert page_query_id == query_id
+            pages.append([(str(t.img.id), t.score) for t in results])
+        assert [len(t) for t in pages] == [3, 3, 2]
+        assert [t for page in pages for t in page] == db_context.ranking[3:]
+        # A window of 4 candidates serves a page of 3, the last window is exhausted
+        assert db_context.candidate_queries == [(3, 4), (6, 4), (9, 4)]
+
+    @pytest.mark.asyncio
+    async def test_invalid_cursor(self):
+        service = QueryCacheService(FakeDbContext(3))
+        with pytest.raises(ValueError):
+            await service.get_page('invalid')
+        with pytest.raises(QueryNotFoundError):
+            await service.get_page(service.encode_cursor(uuid4(), 3, 3))
+        query_id, cursor = await self._first_page(service, FakeDbContext(2), 3)
+        assert cursor is None
+
+    @pytest.mark.asyncio
+    async def test_max_offset(self, monkeypatch):
+        monkeypatch.setattr(config.query_cache, 'max_offset', 5)
+        db_context = FakeDbContext(10)
+        service = QueryCacheService(db_context)
+        query_id, cursor = await self._first_page(service, db_context, 3)
+        _, _, cursor = await service.get_page(cursor)
+        # The page at offset 6 is beyond the limit, so there is no cursor to it, and a crafted one is rejected
+        assert cursor is None
+        with pytest.raises(ValueError):
+            await service.get_page(service.encode_cursor(query_id, 10 ** 9, 3))
+        assert len(db_context.candidate_queries) == 1
+
+    @pytest.mark.asyncio
+    async def test_recall(self):
+        db_context = FakeDbContext(5)
+        service = QueryCacheService(db_context)
+        query_id, cursor = await self._first_page(service, db_context, 3)
+        await service.get_page(cursor)
+        results, recall_cursor = await service.recall(query_id)
+        assert [(str(t.img.id), t.score) for t in results] == db_context.ranking[:3]
+        assert recall_cursor == cursor
+
+        # A re-ranked query can be recalled, but not paged
+        query_id, cursor = service.add_query(results[::-1], 0, 3)
+        assert cursor is None
+        assert [t.img.id for t in (await service.recall(query_id))[0]] == [t.img.id for t in results[::-1]]
+        with pytest.raises(ValueError):
+            await service.get_page(service.encode_cursor(query_id, 3, 3))
+        with pytest.raises(QueryNotFoundError):
+            await service.recall(uuid4())
+
+    def test_memory_limit(self, monkeypatch):
+        monkeypatch.setattr(config.query_cache, 'max_memory_mb', 1)
+        service = QueryCacheService(FakeDbContext(0))
+        request = models.SearchRequest(vector=models.NamedVector(name='image_vector', vector=[0.5] * 768), limit=10)
+        query_ids = [service.add_query([], 0, 10, request=request)[0] for _ in range(100)]
+        # Every query takes about 25KB for its vector
+        assert 30 < len(service._queries) < 50
+        assert query_ids[-1] in service._queries and query_ids[0] not in service._queries
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from app.Services.storage.base import BaseStorage
+from app.Services.storage.local_storage import LocalStorage
+from app.config import config
+
+
+class PresignCountingStorage(LocalStorage):
+    def __init__(self):
+        super().__init__()
+        self.presign_calls = 0
+        self.running = 0
+        self.max_running = 0
+
+    async def presign_url(self, remote_file, expire_second=3600):
+        self.presign_calls += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return f"https://example.com/{remote_file}?expires={expire_second}"
+
+    # Use the generic implementation instead of the local one, which skips signing
+    presign_urls = BaseStorage.presign_urls
+
+
+class TestStorage:
+    @pytest.mark.asyncio
+    async def test_presign_urls(self, monkeypatch):
+        monkeypatch.setattr(config.storage, 'presign_concurrency', 4)
+        storage = PresignCountingStorage()
+        files = [f'{i}.jpg' for i in range(10)]
+        urls = await storage.presign_urls(files)
+        assert urls == [f"https://example.com/{t}?expires=3600" for t in files]
+        assert storage.max_running == 4
+
+        # The cached urls are reused, until half of their validity has passed
+        new_urls = await storage.presign_urls(files[:5] + ['new.jpg'])
+        assert new_urls == urls[:5] + ["https://example.com/new.jpg?expires=3600"]
+        assert storage.presign_calls == 11
+        await storage.presign_urls(files[:1], expire_second=0)
+        await storage.presign_urls(files[:1], expire_second=0)
+        assert storage.presign_calls == 13
+
+    @pytest.mark.asyncio
+    async def test_local_presign_urls(self):
+        assert await LocalStorage().presign_urls(['a.jpg', 'thumbnails/a.webp']) == ['/static/a.jpg',
+                                                                                    '/static/thumbnails/a.webp']
@@ -32,3 +32,24 @@ class TestTransformersService:
         assert vector1.shape == (768,)
         assert vector2.shape == (768,)
         assert calculate_vectors_cosine(vector1, vector2) > 0.8
+
+    def test_batch_vectors_match_single(self):
+        texts = ['a cat sitting on the sofa', '1girl', 'hatsune miku']
+        vectors = self.transformers_service.get_text_vectors(texts, batch_size=2)
+        assert vectors.shape == (3, 768)
+        for text, vector in zip(texts, vectors):
+            assert calculate_vectors_cosine(vector, self.transformers_service.get_text_vector(text)) > 0.999
+        vectors = self.transformers_service.get_bert_vectors(texts, batch_size=2)
+        assert vectors.shape == (3, 768)
+        for text, vector in zip(texts, vectors):
+            assert calculate_vectors_cosine(vector, self.transformers_service.get_bert_vector(text)) > 0.999
+
+    def test_empty_batch(self):
+        assert self.transformers_service.get_image_vectors([]).shape == (0, 768)
+        assert self.transformers_service.get_bert_vectors([]).shape == (0, 768)
+
+    def test_get_image_vectors(self):
+        images = [Image.open(self.assets_root / 'test_images' / t) for t in ('cat_0.jpg', 'cg_1.png', 'cat_1.jpg')]
+        vectors = self.transformers_service.get_image_vectors(images, batch_size=2)
+        assert vectors.shape == (3, 768)
+        assert calculate_vectors_cosine(vectors[0], vectors[2]) > 0.8
@@ -0,0 +1,166 @@
+import zipfile
+from datetime import datetime
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from app.Models.img_data import ImageData
+from app.Models.upload_job import UploadJobState
+from app.Services.upload_service import UploadService, UploadQueueFullError, TooManyUploadFilesError
+from app.config import config
+
+
+class FakeIndexService:
+    def __init__(self, fail: bool = False, fail_ocr: bool = False):
+        self.fail = fail
+        self.fail_ocr = fail_ocr
+        self.indexed_batches = []
+
+    async def index_image_batch(self, images, image_data, skip_ocr=False, allow_overwrite=False, background=False):
+        if self.fail or (self.fail_ocr and not skip_ocr):
+            raise ValueError("Broken image")
+        self.indexed_batches.append([t.id for t in image_data])
+
+
+class FakeDbContext:
+    def __init__(self, existing_ids=()):
+        self.existing_ids = set(existing_ids)
+        self.validate_calls = 0
+
+    async def validate_ids(self, image_ids):
+        self.validate_calls += 1
+        return [t for t in image_ids if t in self.existing_ids]
+
+    async def flush(self):
+        pass
+
+
+def _png_stream(color=(255, 0, 0)) -> BytesIO:
+    result = BytesIO()
+    Image.new('RGB', (16, 16), color).save(result, 'PNG')
+    result.seek(0)
+    return result
+
+
+async def _upload(service: UploadService, color=(255, 0, 0)) -> ImageData:
+    img_id, _ = await service.spool_file(_png_stream(color), 'png')
+    img_data = ImageData(id=img_id, local=False, format='png', index_date=datetime.now())
+    await service.upload_image(img_data, skip_ocr=True)
+    return img_data
+
+
+class TestUploadService:
+    @pytest.fixture(autouse=True)
+    def spool_path(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(config.upload, 'spool_path', str(tmp_path))
+        return tmp_path
+
+    @pytest.mark.asyncio
+    async def test_job_status(self, spool_path):
+        index_service = FakeIndexService()
+        service = UploadService(None, FakeDbContext(), index_service)
+        img_data = await _upload(service)
+        assert service.get_job_status(img_data.id).state == UploadJobState.queued
+
+        await service._queue.join()
+        status = service.get_job_status(img_data.id)
+        assert status.state == UploadJobState.done
+        assert set(status.stage_durations) == {UploadJobState.queued, UploadJobState.indexing,
+                                               UploadJobState.storing}
+        assert index_service.indexed_batches == [[img_data.id]]
+        assert [t.name for t in service._spool_dir.iterdir()] == ['.lock']
+
+    @pytest.mark.asyncio
+    async def test_failed_job_status(self):
+        service = UploadService(None, FakeDbContext(), FakeIndexService(fail=True))
+        img_data = await _upload(service)
+        await service._queue.join()
+        status = service.get_job_status(img_data.id)
+        assert status.state == UploadJobState.failed
+        assert status.error == "Broken image"
+        assert service.queue_length == 0
+        assert service.get_job_status('00000000-0000-0000-0000-000000000000') is None
+
+    @pytest.mark.asyncio
+    async def test_batch_upload(self, monkeypatch):
+        monkeypatch.setattr(config.upload, 'batch_size', 2)
+        index_service = FakeIndexService()
+        db_context = FakeDbContext()
+        service = UploadService(None, db_context, index_service)
+        image_data = []
+        for i in range(3):
+            img_id, _ = await service.spool_file(_png_stream((i, 0, 0)), 'png')
+            image_data.append(ImageData(id=img_id, local=False, format='png', index_date=datetime.now()))
+        db_context.existing_ids.add(str(image_data[2].id))
+        assert await service.upload_images(image_data + image_data[:1], skip_ocr=True) == [t.id for t in image_data]
+        assert service.queue_length == 3
+        assert await service.upload_images(image_data[:1], skip_ocr=True) == []  # Already queued
+
+        await service._queue.join()
+        assert index_service.indexed_batches == [[image_data[0].id, image_data[1].id]]
+        assert [service.get_job_status(t.id).state for t in image_data] == [
+            UploadJobState.done, UploadJobState.done, UploadJobState.failed]
+
+    @pytest.mark.asyncio
+    async def test_failed_group(self, monkeypatch):
+        monkeypatch.setattr(config.upload, 'workers', 1)
+        index_service = FakeIndexService(fail_ocr=True)
+        service = UploadService(None, FakeDbContext(), index_service)
+        image_data = []
+        for i in range(2):
+            img_id, _ = await service.spool_file(_png_stream((i, 0, 0)), 'png')
+            image_data.append(ImageData(id=img_id, local=False, format='png', index_date=datetime.now()))
+        # Both images are taken into one batch, but indexed in separate groups
+        await service.upload_images(image_data[:1], skip_ocr=False)
+        await service.upload_images(image_data[1:], skip_ocr=True)
+        await service._queue.join()
+        assert index_service.indexed_batches == [[image_data[1].id]]
+        assert [service.get_job_status(t.id).state for t in image_data] == [UploadJobState.failed,
+                                                                              UploadJobState.done]
+
+    @pytest.mark.asyncio
+    async def test_queue_size(self, monkeypatch):
+        monkeypatch.setattr(config.upload, 'queue_size', 2)
+        service = UploadService(None, FakeDbContext(), FakeIndexService())
+        image_data = []
+        for i in range(3):
+            img_id, _ = await service.spool_file(_png_stream((i, 0, 0)), 'png')
+            image_data.append(ImageData(id=img_id, local=False, format='png', index_date=datetime.now()))
+        # The queue size limits the number of images, no matter how they are grouped
+        with pytest.raises(UploadQueueFullError):
+            await service.upload_images(image_data, skip_ocr=True)
+        await service.upload_images(image_data[:2], skip_ocr=True)
+        assert service.queue_length == 2
+        await service._queue.join()
+
+    @pytest.mark.asyncio
+    async def test_shared_spool_path(self, spool_path):
+        service = UploadService(None, FakeDbContext(), FakeIndexService())
+        _, receiving_file = await service.spool_file(_png_stream(), 'png')
+        # Another process starting on the same spool path neither cleans nor replays the files of the running one
+        other_service = UploadService(None, FakeDbContext(), FakeIndexService())
+        assert other_service._spool_dir != service._spool_dir
+        await other_service._replay_task
+        assert receiving_file.exists()
+        assert other_service.queue_length == 0
+
+    @pytest.mark.asyncio
+    async def test_spool_archive(self, spool_path):
+        service = UploadService(None, FakeDbContext(), FakeIndexService())
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as f:
+            f.writestr('a/red.png', _png_stream().getvalue())
+            f.writestr('readme.txt', 'not an image')
+            f.writestr('__MACOSX/a/._red.png', 'metadata')
+        with pytest.raises(TooManyUploadFilesError):
+            await service.spool_archive(archive, {'png', 'txt'}, 1)
+        with pytest.raises(ValueError):
+            await service.spool_archive(BytesIO(b'not an archive'), {'png'}, 10)
+        # Nothing is left behind by the rejected archives
+        assert [t.name for t in service._spool_dir.iterdir()] == ['.lock']
+
+        spooled, skipped = await service.spool_archive(archive, {'png'}, 10)
+        assert [t[0] for t in spooled] == ['a/red.png']
+        assert spooled[0][2].read_bytes() == _png_stream().getvalue()
+        assert skipped == ['readme.txt']
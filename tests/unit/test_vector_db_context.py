@@ -0,0 +1,278 @@
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+
+import numpy
+import pytest
+import pytest_asyncio
+from httpx import Headers
+from qdrant_client.http import models
+from qdrant_client.http.exceptions import UnexpectedResponse
+
+from app.Models.img_data import ImageData
+from app.Models.query_params import FilterParams
+from app.Services.vector_db_context import VectorDbContext
+from app.config import config, QdrantMode, QdrantQuantization
+
+
+class TestVectorDbContext:
+    def test_default_collection_config(self):
+        assert VectorDbContext._get_quantization_config() is None
+        assert VectorDbContext._get_search_params() is None
+
+    def test_quantization_config(self, monkeypatch):
+        monkeypatch.setattr(config.qdrant, 'quantization', QdrantQuantization.PRODUCT)
+        monkeypatch.setattr(config.qdrant, 'product_quantization_compression', 'x32')
+        quantization = VectorDbContext._get_quantization_config()
+        assert quantization.product.compression == models.CompressionRatio.X32
+
+        monkeypatch.setattr(config.qdrant, 'quantization', QdrantQuantization.SCALAR)
+        assert VectorDbContext._get_quantization_config().scalar.type == models.ScalarType.INT8
+
+        monkeypatch.setattr(config.qdrant, 'search_oversampling', 2.0)
+        search_params = VectorDbContext._get_search_params()
+        assert search_params.quantization.oversampling == 2.0
+        assert search_params.quantization.rescore
+
+    def test_payload_indexes(self, monkeypatch):
+        monkeypatch.setattr(config.qdrant, 'ocr_text_tokenizer', 'prefix')
+        indexes = VectorDbContext._get_payload_indexes()
+        assert indexes['ocr_text_lower'].tokenizer == models.TokenizerType.PREFIX
+        assert set(indexes) >= {'width', 'height', 'aspect_ratio', 'starred', 'categories'}
+
+    def test_points_from_img_data(self):
+        items = [ImageData(id=uuid4(), local=True, format='png', index_date=datetime.now(),
+                           image_vector=numpy.array([0.5, 0.25], dtype=numpy.float32),
+                           text_contain_vector=numpy.array([1, 2], dtype=numpy.float32) if i else None)
+                 for i in range(2)]
+        points = VectorDbContext._get_points_from_img_data(items)
+        assert [t.id for t in points] == [str(t.id) for t in items]
+        assert points[0].vector == {VectorDbContext.IMG_VECTOR: [0.5, 0.25]}
+        assert points[1].vector == {VectorDbContext.IMG_VECTOR: [0.5, 0.25], VectorDbContext.TEXT_VECTOR: [1.0, 2.0]}
+        assert points[1].payload == items[1].payload
+        assert VectorDbContext._vectors_to_lists([None, numpy.array([1, 2])]) == [None, [1.0, 2.0]]
+
+
+class TestWriteBuffer:
+    @pytest_asyncio.fixture
+    async def db_context(self, monkeypatch):
+        monkeypatch.setattr(config.qdrant, 'mode', QdrantMode.MEMORY)
+        monkeypatch.setattr(config.qdrant, 'write_buffer_size', 4)
+        monkeypatch.setattr(config.qdrant, 'write_buffer_interval', 60)
+        db_context = VectorDbContext()
+        await db_context.onload()
+        return db_context
+
+    @staticmethod
+    def _make_items(count: int) -> list[ImageData]:
+        return [ImageData(id=uuid4(), local=True, format='png', index_date=datetime.now(),
+                          image_vector=numpy.ones(768, dtype=numpy.float32)) for _ in range(count)]
+
+    @pytest.mark.asyncio
+    async def test_buffered_writes(self, db_context):
+        items = self._make_items(3)
+        await db_context.insertItems(items[:2])
+        items[0].starred = True
+        await db_context.updatePayload(items[0])
+        assert await db_context.get_counts(exact=True) == 0
+        assert set(await db_context.validate_ids([str(t.id) for t in items])) == {str(t.id) for t in items[:2]}
+
+        await db_context.insertItems(items[2:])  # The size threshold is reached
+        assert await db_context.get_counts(exact=True) == 3
+        assert (await db_context.retrieve_by_id(str(items[0].id))).starred
+
+    @pytest.mark.asyncio
+    async def test_flush(self, db_context, monkeypatch):
+        items = self._make_items(1)
+        await db_context.insertItems(items)
+        # Retrieving a buffered item flushes the buffer first
+        assert (await db_context.retrieve_by_id(str(items[0].id))).id == items[0].id
+
+        monkeypatch.setattr(config.qdrant, 'write_buffer_interval', 0.01)
+        await db_context.insertItems(self._make_items(1))
+        await asyncio.sleep(0.1)
+        assert await db_context.get_counts(exact=True) == 2
+        await db_context.deleteItems([str(items[0].id)])
+        await db_context.flush()
+        assert await db_context.get_counts(exact=True) == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_flush(self, db_context, monkeypatch):
+        items = self._make_items(2)
+        await db_context.insertItems(items[:1])
+        batch_update_points = db_context._client.batch_update_points
+
+        async def failing_batch_update_points(**kwargs):
+            # Another write of the same point is buffered while the flush is in progress
+            await db_context.insertItems(items)
+            raise ConnectionError("Qdrant is down")
+
+        monkeypatch.setattr(db_context._client, 'batch_update_points', failing_batch_update_points)
+        with pytest.raises(ConnectionError):
+            await db_context.flush()
+        # The failed writes are kept, along with the ones buffered meanwhile
+        assert set(await db_context.validate_ids([str(t.id) for t in items])) == {str(t.id) for t in items}
+        monkeypatch.setattr(db_context._client, 'batch_update_points', batch_update_points)
+        await db_context.flush()
+        assert await db_context.get_counts(exact=True) == 2
+        assert not db_context._pending_ids and not db_context._flushing_ids
+
+    @pytest.mark.asyncio
+    async def test_write_during_flush(self, db_context, monkeypatch):
+        items = self._make_items(1)
+        await db_context.insertItems(items)
+        batch_update_points = db_context._client.batch_update_points
+
+        async def slow_batch_update_points(**kwargs):
+            items[0].starred = True
+            await db_context.updatePayload(items[0])
+            return await batch_update_points(**kwargs)
+
+        monkeypatch.setattr(db_context._client, 'batch_update_points', slow_batch_update_points)
+        await db_context._flush_writes(wait=True)
+        # The write buffered during the flush is still pending, so reading the point flushes it first
+        assert db_context._is_unwritten(str(items[0].id))
+        monkeypatch.setattr(db_context._client, 'batch_update_points', batch_update_points)
+        assert (await db_context.retrieve_by_id(str(items[0].id))).starred
+
+
+class TestHybridSearch:
+    @pytest_asyncio.fixture
+    async def db_context(self, monkeypatch):
+        monkeypatch.setattr(config.qdrant, 'mode', QdrantMode.MEMORY)
+        db_context = VectorDbContext()
+        await db_context.onload()
+        return db_context
+
+    @pytest.mark.asyncio
+    async def test_hybrid_search(self, db_context):
+        assert db_context.hybrid_search_enabled
+        texts = ["nothing interesting here", "the invoice number 2024", "weather report", "weekly sales summary"]
+        items = [ImageData(id=uuid4(), local=True, format='png', index_date=datetime.now(), ocr_text=text,
+                           image_vector=numpy.eye(768, dtype=numpy.float32)[0],
+                           text_contain_vector=numpy.eye(768, dtype=numpy.float32)[i])
+                 for i, text in enumerate(texts)]
+        await db_context.insertItems(items)
+
+        # The dense vector is closest to the first item, but the second one, which contains the keyword, is fused to
+        # the top by both of its ranks
+        query_vector = numpy.eye(768, dtype=numpy.float32)[0]
+        results = await db_context.queryHybrid("invoice", query_vector, top_k=2)
+        assert [t.img.id for t in results] == [items[1].id, items[0].id]
+        request = db_context.get_hybrid_request("invoice", query_vector, top_k=2)
+        assert (await db_context.query_batch([request]))[0][0].img.id == results[0].img.id
+        assert await db_context.query_candidates(request, 0, 1) == [(str(results[0].img.id), results[0].score)]
+
+    @pytest.mark.asyncio
+    async def test_deep_candidates(self, db_context, monkeypatch):
+        monkeypatch.setattr(config.qdrant, 'hybrid_search_prefetch', 2)
+        items = [ImageData(id=uuid4(), local=True, format='png', index_date=datetime.now(), ocr_text=f"page {i}",
+                           image_vector=numpy.ones(768, dtype=numpy.float32),
+                           text_contain_vector=numpy.ones(768, dtype=numpy.float32)) for i in range(5)]
+        await db_context.insertItems(items)
+        request = db_context.get_hybrid_request("page", numpy.ones(768, dtype=numpy.float32), top_k=2)
+        # The candidates beyond the prefetch limit of the first page are still found
+        assert len(await db_context.query_candidates(request, 3, 2)) == 2
+        assert request.prefetch[0].limit == 2
+
+    @pytest.mark.asyncio
+    async def test_hybrid_search_disabled(self, monkeypatch):
+        monkeypatch.setattr(config.qdrant, 'mode', QdrantMode.MEMORY)
+        monkeypatch.setattr(config.ocr_search, 'hybrid_search', False)
+        db_context = VectorDbContext()
+        await db_context.onload()
+        assert not db_context.hybrid_search_enabled
+        # A collection created without the lexical vector keeps the hybrid search disabled
+        monkeypatch.setattr(config.ocr_search, 'hybrid_search', True)
+        await db_context.check_hybrid_search()
+        assert not db_context.hybrid_search_enabled
+
+
+class TestCombinedSearch:
+    @pytest.mark.asyncio
+    async def test_combined_search(self, monkeypatch):
+        monkeypatch.setattr(config.qdrant, 'mode', QdrantMode.MEMORY)
+        monkeypatch.setattr(config.qdrant, 'combined_search_prefetch', 3)
+        db_context = VectorDbContext()
+        await db_context.onload()
+        eye = numpy.eye(768, dtype=numpy.float32)
+        image_vectors = [eye[0], eye[0], eye[0], eye[1]]
+        text_vectors = [eye[7], eye[6], eye[5] + eye[6], eye[5]]
+        items = [ImageData(id=uuid4(), local=True, format='png', index_date=datetime.now(), image_vector=image_vector,
+                           text_contain_vector=text_vector)
+                 for image_vector, text_vector in zip(image_vectors, text_vectors)]
+        await db_context.insertItems(items)
+
+        request = db_context.get_combined_request(eye[5], positive_vectors=[eye[0]], top_k=2)
+        # The criteria search runs once, as the only prefetch of the rerank query
+        assert isinstance(request.prefetch, models.Prefetch) and request.prefetch.prefetch is None
+        results = await db_context.query_request(request)
+        # The last item matches the extra prompt best, but it isn't a candidate found by the criteria
+        assert results[0].img.id == items[2].id
+        assert results[0].score == pytest.approx(0.5 ** 0.5, abs=1e-4)
+        assert items[3].id not in {t.img.id for t in results}
+
+
+class TestRandomPick:
+    @pytest_asyncio.fixture
+    async def db_context(self, monkeypatch):
+        monkeypatch.setattr(config.qdrant, 'mode', QdrantMode.MEMORY)
+        db_context = VectorDbContext()
+        await db_context.onload()
+        await db_context.insertItems([ImageData(id=uuid4(), local=True, format='png', index_date=datetime.now(),
+                                                starred=i % 2 == 0, image_vector=numpy.ones(768, dtype=numpy.float32))
+                                      for i in range(10)])
+        return db_context
+
+    @pytest.mark.asyncio
+    async def test_sampling(self, db_context):
+        filter_param = FilterParams(starred=True)
+        results = await db_context.queryRandom(filter_param=filter_param, top_k=3)
+        assert len({t.img.id for t in results}) == 3
+        assert all(t.img.starred for t in results)
+        with pytest.raises(ValueError):
+            await db_context.queryRandom(top_k=3, skip=3)
+
+    @pytest.mark.asyncio
+    async def test_sampling_fallback(self, db_context, monkeypatch):
+        async def query_points(*args, **kwargs):
+            raise UnexpectedResponse(400, "Bad Request", b'unknown variant `sample`', Headers())
+
+        # Qdrant servers older than 1.11 can't sample, seeded walks with random seeds are used instead
+        monkeypatch.setattr(db_context._client, 'query_points', query_points)
+        results = await db_context.queryRandom(top_k=3)
+        assert len({t.img.id for t in results}) == 3
+        assert not db_context._sample_query_supported
+
+    @pytest.mark.asyncio
+    async def test_seeded_walk(self, db_context, monkeypatch):
+        monkeypatch.setattr(db_context, 'RANDOM_BUCKET_SIZE', 2)
+        pages = [await db_context.queryRandom(seed=42, top_k=4, skip=skip) for skip in range(0, 12, 4)]
+        ids = [t.img.id for page in pages for t in page]
+        # The walk covers every item exactly once, across 8 buckets
+        assert [len(t) for t in pages] == [4, 4, 2]
+        assert len(set(ids)) == 10
+        assert db_context._random_walks.get((db_context.get_random_request(42).offset, None, 0)).bucket_bits == 3
+        assert [t.img.id for t in await db_context.queryRandom(seed=42, top_k=4, skip=4)] == ids[4:8]
+        # Another seed gives another order, not the same order from another start
+        other_ids = [t.img.id for t in await db_context.queryRandom(seed=7, top_k=10)]
+        assert sorted(other_ids) == sorted(ids)
+        assert all(other_ids != ids[i:] + ids[:i] for i in range(len(ids)))
+
+    @pytest.mark.asyncio
+    async def test_resumed_walk(self, db_context, monkeypatch):
+        monkeypatch.setattr(db_context, 'RANDOM_BUCKET_SIZE', 2)
+        ids = [t.img.id for t in await db_context.queryRandom(seed=42, top_k=10)]
+        db_context._random_walks.clear()
+        get_random_bucket = db_context._get_random_bucket
+        bucket_ranks = []
+
+        async def spy_get_random_bucket(request, bucket_bits, bucket_rank):
+            bucket_ranks.append(bucket_rank)
+            return await get_random_bucket(request, bucket_bits, bucket_rank)
+
+        monkeypatch.setattr(db_context, '_get_random_bucket', spy_get_random_bucket)
+        pages = [await db_context.queryRandom(seed=42, top_k=3, skip=skip) for skip in range(0, 12, 3)]
+        assert [t.img.id for page in pages for t in page] == ids
+        # Every page resumes from where the previous one stopped, without walking the skipped buckets again
+        assert bucket_ranks == sorted(bucket_ranks)